@@ -72,11 +72,21 @@ from .conditional import currently_under_condition
 # block simulation support
 from .simulation import Simulation
 from .simulation import FastSimulation
+from .simulation import BatchedFastSimulation
+from .simulation import BitSlicedSimulation
 from .simulation import SimulationTrace
+from .simulation import StreamingVCDTrace
+from .simulation import SimulationSnapshot
+from .tracefile import write_trace
+from .tracefile import read_trace
+from .tracefile import MappedTrace
 from .compilesim import CompiledSimulation
+from . import simcache
 
 # input and output to file format routines
 from .inputoutput import input_from_blif
+from .inputoutput import vcd_input_columns
+from .inputoutput import replay_vcd
 from .inputoutput import output_to_trivialgraph
 from .inputoutput import output_to_graphviz
 from .inputoutput import OutputToVerilog
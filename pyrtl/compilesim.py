@@ -7,17 +7,91 @@ import shutil
 import collections
 from os import path
 import platform
+import heapq
+import copy
+import functools
+import itertools
+import weakref
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import _ctypes
 
 from .core import working_block
 from .wire import Input, Output, Const, WireVector, Register
 from .memory import RomBlock
 from .pyrtlexceptions import PyrtlError, PyrtlInternalError
-from .simulation import SimulationTrace
+from .simulation import SimulationTrace, SimulationSnapshot
+from .simulation import _writable_mems, _trace_position, _copy_tracer, _trace_chunk_size
+from .simcache import FileCache, content_hash
 
 
 __all__ = ['CompiledSimulation']
 
+_dll_cache = FileCache('compilesim')
+_compiler_id = None
+
+
+def _compiler_version():
+    """Identify the C compiler and the code it generates for cache keys.
+
+    That is the version of gcc, the architecture and the processor that
+    -march=native stands for, but not the host name, so that machines with
+    the same toolchain and processors (such as CI runners) share libraries.
+    """
+    global _compiler_id
+    if _compiler_id is None:
+        shell = platform.system() == 'Windows'
+        version = subprocess.check_output(['gcc', '--version'], shell=shell)
+        try:
+            target = subprocess.check_output(
+                ['gcc', '-march=native', '-Q', '--help=target'], shell=shell)
+        except (subprocess.CalledProcessError, OSError):
+            march = []
+        else:
+            march = [' '.join(line.split()) for line in
+                     target.decode('utf-8', 'replace').splitlines()
+                     if line.strip().startswith('-march=')]
+        _compiler_id = ' '.join([version.decode('utf-8', 'replace'), platform.machine()] + march)
+    return _compiler_id
+
+
+class _SharedLibrary(object):
+    """A loaded simulation library, shared by every simulation of the same code.
+
+    The library is unloaded and its directory removed once no simulation
+    refers to it anymore.
+    """
+
+    def __init__(self, libdir, libpath):
+        self.dir = libdir
+        self.dll = ctypes.CDLL(libpath)
+        bufptr = ctypes.POINTER(ctypes.c_uint64)
+        self.new = self.dll.sim_new
+        self.new.restype = ctypes.c_void_p
+        self.new.argtypes = []
+        self.free = self.dll.sim_free
+        self.free.restype = None
+        self.free.argtypes = [ctypes.c_void_p]
+        self.run_all = self.dll.sim_run_all
+        self.run_all.restype = ctypes.c_uint64
+        self.run_all.argtypes = [ctypes.c_void_p, ctypes.c_uint64, bufptr, bufptr, bufptr]
+        self.run_until = self.dll.sim_run_until
+        self.run_until.restype = ctypes.c_uint64
+        self.run_until.argtypes = [ctypes.c_void_p, ctypes.c_uint64, bufptr, bufptr,
+                                   ctypes.c_uint64, ctypes.c_uint64, ctypes.c_uint64, bufptr,
+                                   bufptr]
+
+    def __del__(self):
+        handle = self.dll._handle
+        if platform.system() == 'Windows':
+            _ctypes.FreeLibrary(handle)  # pylint: disable=no-member
+        else:
+            _ctypes.dlclose(handle)  # pylint: disable=no-member
+        shutil.rmtree(self.dir)
+
+
+_libraries = weakref.WeakValueDictionary()  # the loaded libraries, by content hash
+
 
 class DllMemInspector(collections.Mapping):
     """Dictionary-like access to a memory array in a CompiledSimulation."""
@@ -36,8 +110,22 @@ class DllMemInspector(collections.Mapping):
         else:
             scalar = ctypes.c_uint64
         array_type = scalar*(len(self)*limbs)
-        self._buf = array_type.in_dll(sim._dll, vn)
-        self._sim = sim  # keep reference to avoid freeing dll
+        if isinstance(mem, RomBlock):
+            self._buf = array_type.in_dll(sim._dll, vn)
+        else:
+            self._buf = array_type.from_address(sim._member_address(vn[len('s->'):]))
+        self._sim = sim  # keep reference to avoid freeing the state
+
+    def _set(self, ind, val):
+        """Store val at address ind (used to restore snapshots)."""
+        limbs = self._limbs
+        for n in range(ind*limbs, (ind+1)*limbs):
+            self._buf[n] = val & ((1 << 64)-1)
+            val >>= 64
+
+    def _clear(self):
+        """Set every entry to 0."""
+        ctypes.memset(self._buf, 0, ctypes.sizeof(self._buf))
 
     def __getitem__(self, ind):
         val = 0
@@ -82,24 +170,74 @@ class CompiledSimulation(object):
         - mips64 (untested)
 
     default_value is currently only implemented for registers, not memories.
+
+    The rtl_assert assertions of the block are checked in the compiled code at
+    the end of every step.  When one fails, the simulation stops after that
+    step (which is still traced), failed_assertion is set to the pair of the
+    number of the failing step (counting from 0 at the start of the simulation)
+    and the assertion wire, and the exception of the assertion is raised.
+
+    Any wire of the block can be traced (and inspected) by listing it in the
+    wires_to_track of the tracer; only the traced wires are copied out of the
+    simulation every step, so tracing fewer wires makes the simulation faster.
+
+    The compiled library is cached on disk under a hash of the generated code and
+    the compiler options, so building a simulation of an unchanged design again
+    (for example in a later test run) skips the compilation.  See pyrtl.simcache
+    to change the location or size of the cache, or to disable it.  Within a
+    process, all the simulations of the same code share one loaded library, each
+    with its own state, and run_batch runs several of them in parallel threads.
     """
 
+    _optimization_levels = (0, 1, 2, 3, 's')
+    _unit_size = 20000  # statements of logic per translation unit when splitting automatically
+
     def __init__(
             self, tracer=True, register_value_map={}, memory_value_map={},
-            default_value=0, block=None):
-        self._dll = self._dir = None
+            default_value=0, block=None, optimization_level=0, max_function_size=1000,
+            compile_jobs=None):
+        """ Instantiates a compiled simulation.
+
+        :param optimization_level: gcc optimization level (0, 1, 2, 3 or 's') the
+          generated code is compiled with.  Higher levels take longer to compile but
+          produce faster simulations, so they are worth it for long runs.
+        :param max_function_size: approximate maximum number of C statements in each
+          of the functions the combinational logic is split into.  Keeping functions
+          small stops compile time and memory from exploding at higher optimization
+          levels on large designs.
+        :param compile_jobs: number of gcc processes to run at once.  The logic
+          functions are spread over this many translation units, which are compiled
+          concurrently and linked together.  Defaults to the number of cores, but
+          small designs (under _unit_size statements per core) use fewer units.
+
+        Look at Simulation.__init__ for descriptions for the other parameters
+        """
+        self._lib = self._dll = self._dir = self._state = None
         self.block = working_block(block)
         self.block.sanity_check()
 
+        if optimization_level not in self._optimization_levels:
+            raise PyrtlError('optimization_level must be one of {}'.format(
+                ', '.join(repr(x) for x in self._optimization_levels)))
+        if max_function_size < 1:
+            raise PyrtlError('max_function_size must be positive')
+        if compile_jobs is not None and compile_jobs < 1:
+            raise PyrtlError('compile_jobs must be positive')
+        self._optimization_level = optimization_level
+        self._max_function_size = max_function_size
+        self._compile_jobs = compile_jobs
+
         if tracer is True:
             tracer = SimulationTrace()
         self.tracer = tracer
-        self._remove_untraceable()
 
         self.default_value = default_value
         self._regmap, self._memmap = register_value_map, memory_value_map
         self._uid_counter = 0
         self.varname = {}  # mapping from wires and memories to C variables
+        self._cycle = 0  # number of steps simulated so far
+        self._last_values = {}  # values of the traced wires in the last step simulated
+        self.failed_assertion = None
 
         self._create_dll()
 
@@ -107,19 +245,81 @@ class CompiledSimulation(object):
         """Get a view into the contents of a MemBlock."""
         return DllMemInspector(self, mem)
 
+    def snapshot(self):
+        """Capture the state of the simulation between steps.
+
+        The memories in the snapshot only list their nonzero entries.
+        See Simulation.snapshot
+        """
+        registers = {}
+        for r in self.block.wirevector_subset(Register):
+            limbs = self._register_limbs(r)
+            registers[r.name] = sum(limbs[n] << (64*n) for n in range(len(limbs)))
+        memories = {}
+        for mem in _writable_mems(self.block):
+            memories[mem.name] = {addr: val for addr, val in self.inspect_mem(mem).items() if val}
+        return SimulationSnapshot(registers, memories, _trace_position(self.tracer))
+
+    def restore(self, snapshot):
+        """Bring the simulation back to the state captured in snapshot.
+
+        See Simulation.restore
+        """
+        regs = snapshot._register_values(self.block)
+        memvalue = snapshot._memory_values(self.block)
+        for r, value in regs.items():
+            limbs = self._register_limbs(r)
+            self._pack_value(limbs, 0, len(limbs), value)
+        for mem, values in memvalue.items():
+            inspector = self.inspect_mem(mem)
+            inspector._clear()
+            for addr, value in values.items():
+                inspector._set(addr, value)
+        snapshot._restore_trace(self.tracer)
+        self._last_values = {}
+        if snapshot.trace_position is not None:
+            self._cycle = snapshot.trace_position
+        if snapshot.trace_position is not None and self.tracer is not None:
+            # the whole trace is kept, so it ends with the step before the snapshot
+            self._last_values = {name: vals[-1] for name, vals in self.tracer.trace.items()
+                                 if vals}
+        self.failed_assertion = None
+
+    def fork(self, snapshot=None):
+        """Create a new simulation of the same design, continuing from a snapshot.
+
+        The new simulation shares the compiled library, with a state of its own.
+        See Simulation.fork
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        sim = copy.copy(self)
+        sim._state = None
+        sim._new_state()
+        sim.tracer = _copy_tracer(self.tracer)
+        sim.restore(snapshot)
+        return sim
+
+    def _register_limbs(self, r):
+        """The array holding the value of register r in the state of the simulation."""
+        array_type = ctypes.c_uint64*self._limbs(r)
+        return array_type.from_address(self._member_address(self.varname[r][len('s->'):]))
+
     def inspect(self, w):
-        """Get the latest value of the wire given, if possible."""
+        """Get the latest value of the wire given, if possible.
+
+        The value is that of the last step simulated, whether or not the
+        capture policy of the tracer kept that step in the trace.
+        """
         if isinstance(w, WireVector):
             w = w.name
-        try:
-            vals = self.tracer.trace[w]
-        except KeyError:
-            pass
-        else:
-            if not vals:
+        if self.tracer is not None and w in self.tracer.trace:
+            if w not in self._last_values:
                 raise PyrtlError('No context available. Please run a simulation step')
-            return vals[-1]
-        raise PyrtlError('CompiledSimulation does not support inspecting internal WireVectors')
+            return self._last_values[w]
+        raise PyrtlError(
+            'CompiledSimulation can only inspect traced wires; add "{}" to the '
+            'wires_to_track of the tracer to inspect it'.format(w))
 
     def step(self, inputs):
         """Run one step of the simulation.
@@ -133,97 +333,449 @@ class CompiledSimulation(object):
 
         The argument is a list of input mappings for each step,
         and its length is the number of steps to be executed.
+
+        Alternatively the inputs can be given as columns: a mapping from input
+        names to a NumPy array (or anything NumPy can view as an array, such as
+        a buffer-protocol object) holding the value of that input for every step.
+        The columns are packed with vectorized operations and, when there is a
+        single input column already laid out as contiguous uint64 values, passed
+        to the simulation without copying.  In this case run returns a mapping
+        from the name of every Output and traced wire to a NumPy array of its
+        values, which for wires of up to 64 bits is a view into the output buffer.
+        This requires NumPy to be installed.
+
+        The steps are simulated (and added to the tracer) a few thousand at a
+        time, so the i/o buffers do not grow with the number of steps.
         """
+        if isinstance(inputs, collections.Mapping):
+            return self._run_columns(inputs)
+
         steps = len(inputs)
-        # create i/o arrays of the appropriate length
-        ibuf_type = ctypes.c_uint64*(steps*self._ibufsz)
-        obuf_type = ctypes.c_uint64*(steps*self._obufsz)
-        ibuf = ibuf_type()
-        obuf = obuf_type()
-        # these array will be passed to _crun
-        self._crun.argtypes = [ctypes.c_uint64, ibuf_type, obuf_type]
-
-        # build the input array
-        for n, inmap in enumerate(inputs):
-            for w in inmap:
-                if isinstance(w, WireVector):
-                    name = w.name
+        chunk = max(min(steps, _trace_chunk_size), 1)
+        # create i/o arrays for a chunk of steps
+        ibuf = (ctypes.c_uint64*(chunk*self._ibufsz))()
+        obuf = (ctypes.c_uint64*(chunk*self._obufsz))()
+
+        inputs = iter(inputs)
+        for first in range(0, steps, chunk):
+            # build the input array
+            if first:
+                ctypes.memset(ibuf, 0, ctypes.sizeof(ibuf))  # unspecified inputs are 0
+            count = 0
+            for n, inmap in enumerate(itertools.islice(inputs, chunk)):
+                self._pack_inputs(ibuf, n*self._ibufsz, inmap)
+                count += 1
+
+            # run the simulation
+            count, failed = self._run_all(count, ibuf, obuf)
+
+            # save traced wires
+            self._save_trace(count, ibuf, self._ibufsz, obuf, self._obufsz)
+            self._end_run(count, failed)
+
+    def run_until(self, wire, value, max_cycles, inputs={}):
+        """Run the simulation until a wire has a given value.
+
+        :param wire: the Output or traced wire (or its name) to watch
+        :param value: the value of wire at which the simulation stops
+        :param max_cycles: the maximum number of steps to run
+        :param inputs: a mapping from input names to values, which are held
+          constant for every step
+        :return: the number of steps executed, including the one in which the
+          wire had the value; max_cycles if it never did
+
+        The whole loop, including the check of the stop condition, runs in the
+        compiled code, so this is much faster than calling step until the
+        condition holds.  It is run a few thousand steps at a time, adding them
+        to the tracer in between.
+        """
+        name = wire.name if isinstance(wire, WireVector) else wire
+        if name not in self._outputpos:
+            raise PyrtlError(
+                'can only stop on an Output or traced wire, not "{}"'.format(name))
+        start, count = self._outputpos[name]
+        if value < 0 or value >> self.block.get_wirevector_by_name(name).bitwidth:
+            raise PyrtlError(
+                'Wire {} cannot have value {} as it cannot be represented '
+                'using its bitwidth'.format(name, value))
+        if max_cycles < 0:
+            raise PyrtlError('max_cycles must be non-negative')
+
+        stopval = (ctypes.c_uint64*count)()
+        self._pack_value(stopval, 0, count, value)
+        ibuf = (ctypes.c_uint64*self._ibufsz)()
+        self._pack_inputs(ibuf, 0, inputs)
+        # without a tracer, every step overwrites the outputs of the previous one
+        ostride = 0 if self.tracer is None else self._obufsz
+        chunk = min(max_cycles, _trace_chunk_size)
+        obuf = (ctypes.c_uint64*max(ostride*chunk, self._obufsz))()
+
+        failed = ctypes.c_uint64()
+        steps = 0
+        while steps < max_cycles:
+            cycles = min(chunk, max_cycles - steps)
+            done = self._crununtil(
+                cycles, ibuf, obuf, ostride, start, count, stopval, ctypes.byref(failed))
+            self._save_trace(done, ibuf, 0, obuf, ostride)
+            self._end_run(done, failed.value)
+            steps += done
+            last = (done - 1) * ostride + start
+            if done < cycles or obuf[last:last+count] == stopval[:]:
+                break
+        return steps
+
+    def run_stream(self, chunks, chunk_size=1024, trace_sink=None):
+        """Run the simulation on a stream of input chunks, yielding output chunks.
+
+        :param chunks: an iterable (such as a generator) of chunks, each of which
+          is a list of input mappings for consecutive steps, as passed to run
+        :param chunk_size: the number of steps the i/o buffers hold; longer chunks
+          are simulated in several pieces
+        :param trace_sink: where the values of the traced wires go instead of the
+          tracer: either a function called with a mapping from each traced wire
+          name to the list of its values for every piece that is simulated, or a
+          file to which a line with the traced wire names and then one line of
+          values per step is written
+        :return: a generator that, for each input chunk, yields a mapping from
+          the name of each Output to the list of its values in that chunk
+
+        The buffers are allocated once and reused for every chunk, and the state
+        of the registers and memories carries over from one chunk to the next,
+        so the memory used does not grow with the length of the simulation as
+        long as a trace_sink is given (or there is no tracer).  The simulation
+        only advances as the output chunks are consumed.
+        """
+        if chunk_size < 1:
+            raise PyrtlError('chunk_size must be positive')
+        if trace_sink is not None and self.tracer is None:
+            raise PyrtlError('a trace_sink needs a tracer to know which wires to trace')
+        if trace_sink is None or callable(trace_sink):
+            sink = trace_sink
+        else:
+            names = sorted(self.tracer.trace)
+            trace_sink.write(' '.join(names) + '\n')
+
+            def sink(values):
+                for step in zip(*(values[name] for name in names)):
+                    trace_sink.write(' '.join(str(val) for val in step) + '\n')
+        return self._run_stream(chunks, chunk_size, sink)
+
+    def _run_stream(self, chunks, chunk_size, sink):
+        """Generator doing the work of run_stream, once its arguments are checked."""
+        ibuf = (ctypes.c_uint64*(chunk_size*self._ibufsz))()
+        obuf = (ctypes.c_uint64*(chunk_size*self._obufsz))()
+        outputs = sorted(w.name for w in self.block.wirevector_subset(Output))
+        for chunk in chunks:
+            results = {name: [] for name in outputs}
+            for first in range(0, len(chunk), chunk_size):
+                piece = chunk[first:first+chunk_size]
+                steps = len(piece)
+                ctypes.memset(ibuf, 0, ctypes.sizeof(ibuf))  # unspecified inputs are 0
+                for n, inmap in enumerate(piece):
+                    self._pack_inputs(ibuf, n*self._ibufsz, inmap)
+
+                steps, failed = self._run_all(steps, ibuf, obuf)
+
+                for name in outputs:
+                    start, count = self._outputpos[name]
+                    results[name].extend(
+                        self._unpack_column(obuf, start, count, steps, self._obufsz))
+                if sink is None:
+                    self._save_trace(steps, ibuf, self._ibufsz, obuf, self._obufsz)
                 else:
-                    name = w
-                start, count = self._inputpos[name]
-                start += n*self._ibufsz
-                val = inmap[w]
-                if val >= 1 << self._inputbw[name]:
-                    raise PyrtlError(
-                        'Wire {} has value {} which cannot be represented '
-                        'using its bitwidth'.format(name, val))
-                # pack input
-                for pos in range(start, start+count):
-                    ibuf[pos] = val & ((1 << 64)-1)
-                    val >>= 64
-
-        # run the simulation
-        self._crun(steps, ibuf, obuf)
-
-        # save traced wires
+                    values = self._traced_values(steps, ibuf, self._ibufsz, obuf, self._obufsz)
+                    self._save_last_values(values, steps)
+                    sink(values)
+                self._end_run(steps, failed)
+            yield results
+
+    def _pack_value(self, buf, start, count, val):
+        """Store val in the count 64-bit elements of buf from start."""
+        for pos in range(start, start+count):
+            buf[pos] = val & ((1 << 64)-1)
+            val >>= 64
+
+    def _pack_inputs(self, ibuf, offset, inmap):
+        """Store the input values of one step in ibuf, starting at offset."""
+        for w in inmap:
+            if isinstance(w, WireVector):
+                name = w.name
+            else:
+                name = w
+            start, count = self._inputpos[name]
+            val = inmap[w]
+            if val >= 1 << self._inputbw[name]:
+                raise PyrtlError(
+                    'Wire {} has value {} which cannot be represented '
+                    'using its bitwidth'.format(name, val))
+            self._pack_value(ibuf, start+offset, count, val)
+
+    def _unpack_column(self, buf, start, count, steps, stride):
+        """Get the values of one wire for each of steps steps from an i/o buffer."""
+        res = []
+        for n in range(steps):
+            val = 0
+            # unpack output
+            for pos in reversed(range(start, start+count)):
+                val <<= 64
+                val |= buf[pos]
+            res.append(val)
+            start += stride
+        return res
+
+    def _traced_values(self, steps, ibuf, istride, obuf, ostride):
+        """Get a mapping from each traced wire to its values in the i/o buffers.
+
+        The strides are the distance between the values of consecutive steps
+        in each buffer (0 for values that were the same for every step).
+        """
+        values = {}
         for name in self.tracer.trace:
-            rname = self._probe_mapping.get(name, name)
-            if rname in self._outputpos:
-                start, count = self._outputpos[rname]
-                buf, sz = obuf, self._obufsz
-            elif rname in self._inputpos:
-                start, count = self._inputpos[rname]
-                buf, sz = ibuf, self._ibufsz
+            if name in self._outputpos:
+                start, count = self._outputpos[name]
+                buf, sz = obuf, ostride
+            elif name in self._inputpos:
+                start, count = self._inputpos[name]
+                buf, sz = ibuf, istride
             else:
                 raise PyrtlInternalError('Untraceable wire in tracer')
-            res = []
-            for n in range(steps):
-                val = 0
-                # unpack output
-                for pos in reversed(range(start, start+count)):
-                    val <<= 64
-                    val |= buf[pos]
-                res.append(val)
-                start += sz
-            self.tracer.trace[name].extend(res)
-
-    def _traceable(self, wv):
-        """Check if wv is able to be traced
-
-        If it is traceable due to a probe, record that probe in _probe_mapping.
+            values[name] = self._unpack_column(buf, start, count, steps, sz)
+        return values
+
+    def _save_trace(self, steps, ibuf, istride, obuf, ostride):
+        """Add the values of the traced wires in the i/o buffers to the tracer."""
+        if self.tracer is None:
+            return
+        traced = self._traced_values(steps, ibuf, istride, obuf, ostride)
+        self._save_last_values(traced, steps)
+        for name, values in traced.items():
+            self.tracer._column_of[name].extend(values)
+        self.tracer._steps_added()
+
+    def _save_last_values(self, traced, steps):
+        """Keep the values of the traced wires in the last of steps steps, for inspect.
+
+        The tracer may not keep that step (depending on its capture policy),
+        so the values are kept apart from the trace.
         """
-        if isinstance(wv, (Input, Output)):
-            return True
-        for net in self.block.logic:
-            if net.op == 'w' and net.args[0].name == wv.name and isinstance(net.dests[0], Output):
-                self._probe_mapping[wv.name] = net.dests[0].name
-                return True
-        return False
+        if steps:
+            self._last_values = {name: int(values[-1]) for name, values in traced.items()}
 
-    def _remove_untraceable(self):
-        """Remove from the tracer those wires that CompiledSimulation cannot track.
+    def _run_columns(self, inputs):
+        """Run the simulation on columns of input values (see run)."""
+        try:
+            import numpy
+        except ImportError:
+            raise PyrtlError('need numpy installed to run on columns (try "pip install numpy")')
+
+        columns = {}
+        for w, values in inputs.items():
+            name = w.name if isinstance(w, WireVector) else w
+            if name not in self._inputpos:
+                raise PyrtlError('"{}" is not an input of the simulated block'.format(name))
+            columns[name] = numpy.asarray(values)
+        lengths = {len(col) for col in columns.values()}
+        if len(lengths) != 1:
+            raise PyrtlError('input columns must all have the same length')
+        steps = lengths.pop()
+
+        for name, col in columns.items():
+            if col.dtype.kind not in 'uiO':
+                raise PyrtlError('input column for {} must contain integers'.format(name))
+            if len(col) and (col.min() < 0 or col.max() >> self._inputbw[name]):
+                raise PyrtlError(
+                    'Wire {} has a value which cannot be represented '
+                    'using its bitwidth'.format(name))
+
+        single = next(iter(columns.values())) if len(columns) == 1 else None
+        if (self._ibufsz == 1 and single is not None and single.dtype == numpy.uint64
+                and single.flags['C_CONTIGUOUS']):
+            ibuf = single.reshape(steps, 1)  # already in the layout of the input buffer
+        else:
+            ibuf = numpy.zeros((steps, self._ibufsz), dtype=numpy.uint64)
+            for name, col in columns.items():
+                start, count = self._inputpos[name]
+                if count == 1:
+                    ibuf[:, start] = col
+                else:
+                    col = col.astype(object)
+                    for n in range(count):
+                        ibuf[:, start+n] = (col >> (64*n)) & ((1 << 64)-1)
+        obuf = numpy.empty((steps, self._obufsz), dtype=numpy.uint64)
 
-        Create _probe_mapping for wires only traceable via probes.
+        # run the simulation
+        steps, failed = self._run_all(
+            steps, ibuf.ctypes.data_as(self._bufptr), obuf.ctypes.data_as(self._bufptr))
+        ibuf, obuf = ibuf[:steps], obuf[:steps]
+
+        def column(start, count, buf):
+            if count == 1:
+                return buf[:, start]
+            res = numpy.zeros(steps, dtype=object)
+            for n in reversed(range(start, start+count)):
+                res = (res << 64) | buf[:, n].astype(object)
+            return res
+
+        results = {name: column(start, count, obuf)
+                   for name, (start, count) in self._outputpos.items()}
+        if self.tracer is not None:
+            for name in self.tracer.trace:
+                if name in self._inputpos:
+                    results[name] = column(self._inputpos[name][0],
+                                           self._inputpos[name][1], ibuf)
+                elif name not in results:
+                    raise PyrtlInternalError('Untraceable wire in tracer')
+            self._save_last_values({name: results[name] for name in self.tracer.trace}, steps)
+            # the trace is extended a chunk at a time, applying its capture policy
+            for first in range(0, steps, _trace_chunk_size):
+                for name in self.tracer.trace:
+                    self.tracer._column_of[name].extend(
+                        results[name][first:first+_trace_chunk_size].tolist())
+                self.tracer._steps_added()
+        self._end_run(steps, failed)
+        return results
+
+    def _run_all(self, steps, ibuf, obuf):
+        """Run the compiled simulation for steps steps, stopping early if an assertion fails.
+
+        Returns the number of steps executed and the number of the failed
+        assertion in _assertions, counting from 1 (0 if none failed).
         """
-        self._probe_mapping = {}
-        wvs = {wv for wv in self.tracer.wires_to_track if self._traceable(wv)}
-        self.tracer.wires_to_track = wvs
-        self.tracer._wires = {wv.name: wv for wv in wvs}
-        self.tracer.trace.__init__(wvs)
+        failed = ctypes.c_uint64()
+        steps = self._crun(steps, ibuf, obuf, ctypes.byref(failed))
+        return steps, failed.value
+
+    def _end_run(self, steps, failed):
+        """Account for the steps executed, and raise the exception of the failed assertion."""
+        self._cycle += steps
+        if failed:
+            wire, exp = self._assertions[failed-1]
+            self.failed_assertion = self._cycle-1, wire
+            raise exp
 
     def _create_dll(self):
-        """Create a dynamically-linked library implementing the simulation logic."""
-        self._dir = tempfile.mkdtemp()
-        with open(path.join(self._dir, 'pyrtlsim.c'), 'w') as f:
-            self._create_code(lambda s: f.write(s+'\n'))
-        subprocess.check_call([
-            'gcc', '-O0', '-march=native', '-std=c99', '-m64',
-            '-shared', '-fPIC', '-mcmodel=medium',
-            path.join(self._dir, 'pyrtlsim.c'), '-o', path.join(self._dir, 'pyrtlsim.so'),
-            ], shell=(platform.system() == 'Windows'))
-        self._dll = ctypes.CDLL(path.join(self._dir, 'pyrtlsim.so'))
-        self._crun = self._dll.sim_run_all
-        self._crun.restype = None  # argtypes set on use
+        """Create a dynamically-linked library implementing the simulation logic.
+
+        The library is taken from the on-disk cache when an identical one has
+        been built before, and loaded only once per process: every simulation of
+        the same code shares it, with a state of its own allocated by sim_new.
+        """
+        sources = self._create_code()
+        flags = ['-O{}'.format(self._optimization_level), '-march=native', '-std=c99',
+                 '-m64', '-fPIC', '-mcmodel=medium']
+        key = content_hash(
+            ' '.join(flags), _compiler_version(), *(x for src in sources for x in src))
+
+        lib = _libraries.get(key)
+        if lib is None:
+            self._dir = tempfile.mkdtemp()
+            libpath = path.join(self._dir, 'pyrtlsim.so')
+            cached = _dll_cache.get(key, '.so')
+            try:
+                if cached is None:
+                    raise IOError('library not cached')
+                shutil.copyfile(cached, libpath)
+            except (IOError, OSError):
+                # not cached (or evicted by another process in the meantime)
+                self._compile(sources, flags, libpath)
+                with open(libpath, 'rb') as f:
+                    _dll_cache.put(key, f.read(), '.so')
+            lib = _libraries[key] = _SharedLibrary(self._dir, libpath)
+        self._lib, self._dir, self._dll = lib, lib.dir, lib.dll
+        self._bufptr = ctypes.POINTER(ctypes.c_uint64)
+
+        offsets = (ctypes.c_uint64*len(self._members)).in_dll(self._dll, 'sim_offsets')
+        self._member_offset = dict(zip(self._members, offsets))
+        self._new_state()
+        self._initialize_state()
+
+    def _new_state(self):
+        """Allocate a state in its initial values for this simulation."""
+        self._state = self._lib.new()
+        if not self._state:
+            raise MemoryError('cannot allocate the state of the simulation')
+        self._crun = functools.partial(self._lib.run_all, self._state)
+        self._crununtil = functools.partial(self._lib.run_until, self._state)
+
+    def _initialize_state(self):
+        """Store the initial values of the registers and memories in the state.
+
+        They are kept out of the generated code, so that simulations of the
+        same design with different register_value_map and memory_value_map
+        share one library.
+        """
+        for r in self.block.wirevector_subset(Register):
+            limbs = self._register_limbs(r)
+            self._pack_value(limbs, 0, len(limbs), self._regmap.get(r, self.default_value))
+        for mem, values in self._memmap.items():
+            inspector = self.inspect_mem(mem)
+            for addr, value in values.items():
+                if addr < len(inspector):
+                    inspector._set(addr, value)
+
+    def _member_address(self, vn):
+        """The address of the member vn of the state of this simulation."""
+        return self._state + self._member_offset[vn]
+
+    @staticmethod
+    def run_batch(sims, inputs, jobs=None):
+        """Run several simulations at once on a pool of threads.
+
+        :param sims: a list of CompiledSimulations
+        :param inputs: a list with the inputs for each simulation, in any of the
+          forms accepted by run
+        :param jobs: the number of threads, defaulting to the number of cores
+        :return: the list of what run returned for each simulation
+
+        The compiled code runs without holding the global interpreter lock, so
+        independent simulations (such as the same design with different seeds
+        or configurations, which share one compiled library) run in parallel.
+        """
+        if len(sims) != len(inputs):
+            raise PyrtlError('run_batch needs the inputs for every simulation')
+        if len(set(id(sim) for sim in sims)) != len(sims):
+            raise PyrtlError('a simulation can only appear once in a batch')
+        if not sims:
+            return []
+        pool = ThreadPool(min(len(sims), jobs or multiprocessing.cpu_count()))
+        try:
+            return pool.map(lambda job: job[0].run(job[1]), zip(sims, inputs))
+        finally:
+            pool.close()
+            pool.join()
+
+    def _compile(self, sources, flags, libpath):
+        """Compile the (filename, code) sources into the library libpath.
+
+        With several translation units, each one is compiled to an object file by
+        its own gcc process, running up to compile_jobs of them at once, and the
+        objects are then linked together.
+        """
+        shell = (platform.system() == 'Windows')
+        for filename, code in sources:
+            with open(path.join(self._dir, filename), 'w') as f:
+                f.write(code)
+        units = [path.join(self._dir, filename) for filename, _ in sources
+                 if filename.endswith('.c')]
+        if len(units) == 1:
+            subprocess.check_call(['gcc'] + flags + ['-shared', units[0], '-o', libpath],
+                                  shell=shell)
+            return
+
+        def compile_unit(unit):
+            subprocess.check_call(['gcc'] + flags + ['-c', unit, '-o', unit[:-2] + '.o'],
+                                  shell=shell)
+
+        # gcc does the work in its own process, so threads are enough to run them in parallel
+        pool = ThreadPool(min(len(units), self._compile_jobs or multiprocessing.cpu_count()))
+        try:
+            pool.map(compile_unit, units)
+        finally:
+            pool.close()
+            pool.join()
+        subprocess.check_call(
+            ['gcc'] + flags + ['-shared'] + [unit[:-2] + '.o' for unit in units] + ['-o', libpath],
+            shell=shell)
 
     def _limbs(self, w):
         """Number of 64-bit words needed to store value of wire."""
@@ -278,43 +830,49 @@ class CompiledSimulation(object):
         return x
 
     def _declare_mem(self, write, mem):
-        self.varname[mem] = vn = self._clean_name('m', mem)
+        """Declare the array holding mem.
+
+        RomBlocks never change, so they are constant globals whose definition is
+        written with write.  Other memories are members of the simulation state,
+        which starts out all zero: their initial contents are stored by
+        _initialize_state, so that the code does not depend on them.  Either
+        way the declaration is returned: an extern declaration for a RomBlock,
+        and the member declaration for other memories.
+        """
+        vn = self._clean_name('m', mem)
+        decl = '{const}uint{width}_t {name}[{size}][{limbs}]'.format(
+            const='const ' if isinstance(mem, RomBlock) else '', name=vn,
+            width=self._memwidth(mem), size=1 << mem.addrwidth, limbs=self._limbs(mem))
         if isinstance(mem, RomBlock):
+            self.varname[mem] = vn
             # extract data from mem
             romval = [mem._get_read_data(n) for n in range(1 << mem.addrwidth)]
-            write('static const uint{width}_t {name}[][{limbs}] = {{'.format(
-                name=vn, width=self._memwidth(mem), limbs=self._limbs(mem)))
+            write(decl + ' = {')
             for rv in romval:
                 write(self._makeini(mem, rv)+',')
             write('};')
-        else:
-            write('EXPORT')
-            if mem in self._memmap:
-                highest = min(1 << mem.addrwidth, max(self._memmap[mem])+1)
-                memval = [self._memmap[mem].get(n, 0) for n in range(highest)]
-                write('uint{width}_t {name}[{size}][{limbs}] = {{'.format(
-                    name=vn, width=self._memwidth(mem),
-                    size=1 << mem.addrwidth, limbs=self._limbs(mem)))
-                for mv in memval:
-                    write(self._makeini(mem, mv)+',')
-                write('};')
-            else:
-                # initialize to zero by default
-                write('uint{width}_t {name}[{size}][{limbs}] = {{{{0}}}};'.format(
-                    name=vn, width=self._memwidth(mem),
-                    size=1 << mem.addrwidth, limbs=self._limbs(mem)))
+            return 'extern {};'.format(decl)
+        self.varname[mem] = 's->' + vn
+        self._members.append(vn)
+        return decl + ';'
 
     def _declare_wv(self, write, w):
-        self.varname[w] = vn = self._clean_name('w', w)
+        """Declare the array holding w.
+
+        Like _declare_mem: Consts are constant globals (returning an extern
+        declaration), and other wires are members of the simulation state,
+        with registers given their initial values by _initialize_state.
+        """
+        vn = self._clean_name('w', w)
+        decl = '{const}uint64_t {name}[{limbs}]'.format(
+            const='const ' if isinstance(w, Const) else '', name=vn, limbs=self._limbs(w))
         if isinstance(w, Const):
-            write('const uint64_t {name}[{limbs}] = {val};'.format(
-                limbs=self._limbs(w), name=vn, val=self._makeini(w, w.val)))
-        elif isinstance(w, Register):
-            write('static uint64_t {name}[{limbs}] = {val};'.format(
-                limbs=self._limbs(w), name=vn,
-                val=self._makeini(w, self._regmap.get(w, self.default_value))))
-        else:
-            write('uint64_t {name}[{limbs}];'.format(limbs=self._limbs(w), name=vn))
+            self.varname[w] = vn
+            write('{} = {};'.format(decl, self._makeini(w, w.val)))
+            return 'extern {};'.format(decl)
+        self.varname[w] = 's->' + vn
+        self._members.append(vn)
+        return decl + ';'
 
     def _build_memread(self, write, op, param, args, dest):
         mem = param[1]
@@ -466,8 +1024,110 @@ class CompiledSimulation(object):
             write('{dest}[{n}] = {bits};'.format(
                 dest=self.varname[dest], n=n, bits='|'.join(bits)))
 
-    def _create_code(self, write):
+    def _copied_out(self):
+        """The wires whose values are copied to the output buffer, sorted by name.
+
+        These are all the Outputs, plus every other wire the tracer tracks that is
+        not an Input (the values of Inputs are already in the input buffer).
+        """
+        wires = set(self.block.wirevector_subset(Output))
+        if self.tracer is not None:
+            for w in self.tracer.wires_to_track:
+                if w not in self.block.wirevector_set:
+                    raise PyrtlError(
+                        'traced wire "{}" is not in the simulated block'.format(w.name))
+                if not isinstance(w, Input):
+                    wires.add(w)
+        return sorted(wires, key=lambda w: w.name)
+
+    def _sorted_nets(self):
+        """The combinational nets of the block, in a topological order.
+
+        Unlike iterating over the block, the order only depends on the structure
+        of the block (and the wire names), so that the generated code is identical
+        every time the same design is built.
+        """
+        nets = [net for net in self.block.logic if net.op not in 'r@']
+        driver = {net.dests[0]: net for net in nets}
+        waiting = {}  # number of args of each net still to be computed
+        users = collections.defaultdict(list)
+        ready = []
+        for net in nets:
+            pending = [a for a in net.args if a in driver]
+            waiting[net] = len(pending)
+            for a in pending:
+                users[a].append(net)
+            if not pending:
+                heapq.heappush(ready, (net.dests[0].name, net))
+        while ready:
+            _, net = heapq.heappop(ready)
+            yield net
+            for user in users[net.dests[0]]:
+                waiting[user] -= 1
+                if not waiting[user]:
+                    heapq.heappush(ready, (user.dests[0].name, user))
+
+    def _create_logic_funcs(self):
+        """Create the combinational logic as a series of functions to be called in order.
+
+        A new function is started after at least max_function_size statements,
+        always on the boundary between two nets.  Returns a list of pairs of
+        function name and function code (as a list of lines).
+        """
+        op_builders = {
+            'm': self._build_memread,
+            'w': self._build_wire,
+            '~': self._build_not,
+            '&': self._build_bitwise,
+            '|': self._build_bitwise,
+            '^': self._build_bitwise,
+            'n': self._build_nand,
+            '=': self._build_eq,
+            '<': self._build_cmp,
+            '>': self._build_cmp,
+            'x': self._build_mux,
+            '+': self._build_add,
+            '-': self._build_sub,
+            '*': self._build_mul,
+            'c': self._build_concat,
+            's': self._build_select,
+        }
+        funcs, lines = [], []
+
+        def end_func():
+            name = 'sim_logic_{}'.format(len(funcs))
+            funcs.append((name, ['void {}(struct sim_state *s) {{'.format(name),
+                                 'uint64_t tmp, carry, tmphi, tmplo;']  # temporary variables
+                          + lines + ['}']))
+            del lines[:]
+
+        for net in self._sorted_nets():
+            op, param, args, dest = net.op, net.op_param, net.args, net.dests[0]
+            lines.append('// net {op} : {args} -> {dest}'.format(
+                op=op, args=', '.join(self.varname[x] for x in args), dest=self.varname[dest]))
+            op_builders[op](lines.append, op, param, args, dest)
+            if len(lines) >= self._max_function_size:
+                end_func()
+        if lines:
+            end_func()
+        return funcs
+
+    def _create_code(self):
+        """Generate the C code for the simulation.
+
+        Returns a list of (filename, code) pairs.  The simulation state (wires,
+        registers and memories) is kept in a struct sim_state, so that any number
+        of simulations can share the library, each with a state allocated by
+        sim_new.  The struct and the constants are declared in the header, so
+        that the combinational logic functions can be spread over several
+        translation units that are compiled in parallel.
+        """
+        header, state, main = [], [], []
+        write = header.append
         write('#include <stdint.h>')
+        write('#include <stddef.h>')
+        write('#include <stdlib.h>')
+        write('#include <string.h>')
 
         # windows dllexport needed to make symbols visible
         if platform.system() == 'Windows':
@@ -492,25 +1152,47 @@ class CompiledSimulation(object):
             write('#define mul128(t0, t1, pl, ph) __asm__({})'.format(mulinstr[machine]))
 
         # declare memories
-        mems = {net.op_param[1] for net in self.block.logic_subset('m@')}
+        mems = sorted({net.op_param[1] for net in self.block.logic_subset('m@')},
+                      key=lambda m: (m.name, m.id))
         for key in self._memmap:
             if key not in mems:
                 raise PyrtlError('unrecognized MemBlock in memory_value_map')
             if isinstance(key, RomBlock):
                 raise PyrtlError('RomBlock in memory_value_map')
+        self._members = []  # names of the members of the state struct, in order
+        members = []
         for mem in mems:
-            self._declare_mem(write, mem)
-
-        # single step function
-        write('static void sim_run_step(uint64_t inputs[], uint64_t outputs[]) {')
-        write('uint64_t tmp, carry, tmphi, tmplo;')  # temporary variables
+            decl = self._declare_mem(state.append, mem)
+            (write if isinstance(mem, RomBlock) else members.append)(decl)
 
         # declare wire vectors
-        for w in self.block.wirevector_set:
-            self._declare_wv(write, w)
+        #  these live outside of any function as the logic is split over many functions
+        for w in sorted(self.block.wirevector_set, key=lambda w: w.name):
+            decl = self._declare_wv(state.append, w)
+            (write if isinstance(w, Const) else members.append)(decl)
+
+        write('struct sim_state {')
+        header.extend(members)
+        write('};')
+
+        # offsets of the members, to find them from python
+        state.append('EXPORT')
+        state.append('const uint64_t sim_offsets[] = {')
+        state.extend('offsetof(struct sim_state, {}),'.format(vn) for vn in self._members)
+        state.append('0};')
+
+        # combinational logic, split into functions of bounded size
+        logic_funcs = self._create_logic_funcs()
+        for func, _ in logic_funcs:
+            write('void {}(struct sim_state *s);'.format(func))
+
+        # single step function
+        write = main.append
+        write('static uint64_t sim_run_step(struct sim_state *s, uint64_t inputs[], '
+              'uint64_t outputs[]) {')
 
         # inputs copied in
-        inputs = list(self.block.wirevector_subset(Input))
+        inputs = sorted(self.block.wirevector_subset(Input), key=lambda w: w.name)
         self._inputpos = {}  # for each input wire, start and number of elements in input array
         self._inputbw = {}  # bitwidth of each input wire
         ipos = 0
@@ -523,34 +1205,24 @@ class CompiledSimulation(object):
         self._ibufsz = ipos  # total length of input array
 
         # combinational logic
-        op_builders = {
-            'm': self._build_memread,
-            'w': self._build_wire,
-            '~': self._build_not,
-            '&': self._build_bitwise,
-            '|': self._build_bitwise,
-            '^': self._build_bitwise,
-            'n': self._build_nand,
-            '=': self._build_eq,
-            '<': self._build_cmp,
-            '>': self._build_cmp,
-            'x': self._build_mux,
-            '+': self._build_add,
-            '-': self._build_sub,
-            '*': self._build_mul,
-            'c': self._build_concat,
-            's': self._build_select,
-        }
-        for net in self.block:  # topological order
-            if net.op in 'r@':
-                continue  # skip synchronized nets
-            op, param, args, dest = net.op, net.op_param, net.args, net.dests[0]
-            write('// net {op} : {args} -> {dest}'.format(
-                op=op, args=', '.join(self.varname[x] for x in args), dest=self.varname[dest]))
-            op_builders[op](write, op, param, args, dest)
+        for func, _ in logic_funcs:
+            write('{}(s);'.format(func))
+
+        # outputs and traced wires copied out
+        #  before the state updates, so that registers are traced with their current values
+        self._outputpos = {}  # for each wire copied out, start and number of elements in array
+        opos = 0
+        for w in self._copied_out():
+            self._outputpos[w.name] = opos, self._limbs(w)
+            for n in range(self._limbs(w)):
+                write('outputs[{pos}] = {vn}[{n}];'.format(pos=opos, vn=self.varname[w], n=n))
+                opos += 1
+        self._obufsz = opos  # total length of output array
 
         # memory writes
-        for net in self.block.logic_subset('@'):
+        memnets = sorted(self.block.logic_subset('@'), key=lambda net: (
+            net.op_param[1].name, net.op_param[1].id, [a.name for a in net.args]))
+        for net in memnets:
             mem = net.op_param[1]
             write('if ({enable}[0]) {{'.format(enable=self.varname[net.args[2]]))
             for n in range(self._limbs(mem)):
@@ -562,7 +1234,7 @@ class CompiledSimulation(object):
             write('}')
 
         # register updates
-        regnets = list(self.block.logic_subset('r'))
+        regnets = sorted(self.block.logic_subset('r'), key=lambda net: net.dests[0].name)
         for x, net in enumerate(regnets):
             rin = net.args[0]
             write('uint64_t regtmp{x}[{limbs}];'.format(x=x, limbs=self._limbs(rin)))
@@ -574,37 +1246,90 @@ class CompiledSimulation(object):
             for n in range(self._limbs(rout)):
                 write('{vn}[{n}] = regtmp{x}[{n}];'.format(vn=self.varname[rout], x=x, n=n))
 
-        # output copied out
-        outputs = list(self.block.wirevector_subset(Output))
-        self._outputpos = {}  # for each output wire, start and number of elements in output array
-        opos = 0
-        for w in outputs:
-            self._outputpos[w.name] = opos, self._limbs(w)
-            for n in range(self._limbs(w)):
-                write('outputs[{pos}] = {vn}[{n}];'.format(pos=opos, vn=self.varname[w], n=n))
-                opos += 1
-        self._obufsz = opos  # total length of output array
+        # rtl assertions, returning the number of the first one that failed
+        self._assertions = sorted(self.block.rtl_assert_dict.items(), key=lambda a: a[0].name)
+        for x, (w, _) in enumerate(self._assertions):
+            write('if (!{vn}[0]) {{'.format(vn=self.varname[w]))
+            write('return {};'.format(x+1))
+            write('}')
+        write('return 0;')
+        write('}')
+
+        # allocation of the state of a new simulation, all zero
+        #  the initial values of registers and memories are stored from python
+        write('EXPORT')
+        write('struct sim_state *sim_new(void) {')
+        write('return calloc(1, sizeof(struct sim_state));')
+        write('}')
+        write('EXPORT')
+        write('void sim_free(struct sim_state *s) {')
+        write('free(s);')
         write('}')
 
         # entry point
+        #  stops after a step in which an assertion failed, returning the steps executed
         write('EXPORT')
-        write('void sim_run_all(uint64_t stepcount, uint64_t inputs[], uint64_t outputs[]) {')
+        write('uint64_t sim_run_all(struct sim_state *s, uint64_t stepcount, uint64_t inputs[], '
+              'uint64_t outputs[], uint64_t *failed) {')
         write('uint64_t input_pos = 0, output_pos = 0;')
+        write('*failed = 0;')
         write('for (uint64_t stepnum = 0; stepnum < stepcount; stepnum++) {')
-        write('sim_run_step(inputs+input_pos, outputs+output_pos);')
+        write('*failed = sim_run_step(s, inputs+input_pos, outputs+output_pos);')
+        write('if (*failed) {')
+        write('return stepnum+1;')
+        write('}')
         write('input_pos += {};'.format(self._ibufsz))
         write('output_pos += {};'.format(self._obufsz))
-        write('}}')
+        write('}')
+        write('return stepcount;')
+        write('}')
+
+        # entry point that stops once the output at stoppos equals stopval (or an assertion fails)
+        write('EXPORT')
+        write('uint64_t sim_run_until(struct sim_state *s, uint64_t maxsteps, uint64_t inputs[], '
+              'uint64_t outputs[], uint64_t outstride, uint64_t stoppos, uint64_t stoplimbs, '
+              'uint64_t stopval[], uint64_t *failed) {')
+        write('uint64_t output_pos = 0;')
+        write('*failed = 0;')
+        write('for (uint64_t stepnum = 0; stepnum < maxsteps; stepnum++) {')
+        write('*failed = sim_run_step(s, inputs, outputs+output_pos);')
+        write('int stop = 1;')
+        write('for (uint64_t n = 0; n < stoplimbs; n++) {')
+        write('stop &= outputs[output_pos+stoppos+n] == stopval[n];')
+        write('}')
+        write('output_pos += outstride;')
+        write('if (stop || *failed) {')
+        write('return stepnum+1;')
+        write('}')
+        write('}')
+        write('return maxsteps;')
+        write('}')
+
+        # split the logic functions into translation units
+        statements = sum(len(code) for _, code in logic_funcs)
+        if self._compile_jobs is None:
+            units = min(multiprocessing.cpu_count(), statements // self._unit_size)
+        else:
+            units = min(self._compile_jobs, len(logic_funcs))
+        if units <= 1:
+            logic = [line for _, code in logic_funcs for line in code]
+            return [('pyrtlsim.c', '\n'.join(header + state + logic + main) + '\n')]
+        include = ['#include "pyrtlsim.h"']
+        sources = [('pyrtlsim.h', '\n'.join(header) + '\n'),
+                   ('pyrtlsim.c', '\n'.join(include + state + main) + '\n')]
+        per_unit = (len(logic_funcs) + units - 1) // units
+        for n in range(0, len(logic_funcs), per_unit):
+            logic = [line for _, code in logic_funcs[n:n+per_unit] for line in code]
+            sources.append(('pyrtlsim_logic{}.c'.format(n // per_unit),
+                            '\n'.join(include + logic) + '\n'))
+        return sources
 
     def __del__(self):
-        """Handle removal of the DLL when the simulator is deleted."""
-        if self._dll is not None:
-            handle = self._dll._handle
-            if platform.system() == 'Windows':
-                _ctypes.FreeLibrary(handle)  # pylint: disable=no-member
-            else:
-                _ctypes.dlclose(handle)  # pylint: disable=no-member
-            self._dll = None
-        if self._dir is not None:
-            shutil.rmtree(self._dir)
-            self._dir = None
+        """Free the state of the simulation when it is deleted.
+
+        The library itself is unloaded once no simulation uses it anymore.
+        """
+        if self._state:
+            self._lib.free(self._state)
+            self._state = None
+        self._lib = self._dll = None
@@ -9,6 +9,7 @@ accordingly, or write information from the Block out to the file.
 from __future__ import print_function, unicode_literals
 import re
 import collections
+import six
 
 from .pyrtlexceptions import PyrtlError, PyrtlInternalError
 from .core import working_block, _NameSanitizer
@@ -206,6 +207,170 @@ def input_from_blif(blif, block=None, merge_io_vectors=True):
         extract_commands(model)
 
 
+def vcd_input_columns(vcd, block=None, period=10, clock=None, chunk_size=1 << 16):
+    """ Read the values of the Inputs of a block from a VCD file, a chunk of cycles at a time.
+
+    :param vcd: an open VCD file or a string
+    :param block: the block whose Inputs are read, defaulting to the working block
+    :param period: the time between two cycles in the dump
+    :param clock: the name of a 1-bit variable in the dump; if given, the
+      cycles are at its rising edges rather than at multiples of period
+    :param chunk_size: the number of cycles in each chunk
+    :return: a generator yielding, for each chunk of consecutive cycles, a map
+      from the name of each Input to the sequence of its values in the chunk
+
+    The value of an Input in a cycle is the value (after the changes at the
+    time of the cycle) of the variable of the same name in the dump, in
+    whichever scope.  Without a clock, cycle n is at time n * period and the
+    last time in the dump marks its end, as in the output of print_vcd.
+    Unknown (x and z) bits are read as 0.  The file is only read as the chunks
+    are consumed, so it can be much larger than the memory available.  The
+    chunks can be passed directly to the run methods of the simulators, as
+    replay_vcd does.
+    """
+    from .simulation import _trace_column
+
+    block = working_block(block)
+    inputs = sorted(block.wirevector_subset(Input), key=lambda w: w.name)
+    if not inputs:
+        raise PyrtlError('the block has no Inputs to read from the VCD')
+    if period < 1 or chunk_size < 1:
+        raise PyrtlError('period and chunk_size must be positive')
+    if isinstance(vcd, six.string_types):
+        vcd = vcd.splitlines()
+    index = {w.name: n for n, w in enumerate(inputs)}
+    return _read_vcd_columns(vcd, inputs, index, period, clock, chunk_size, _trace_column)
+
+
+def _read_vcd_columns(vcd, inputs, index, period, clock, chunk_size, new_column):
+    """ The generator doing the work of vcd_input_columns, once its arguments are checked. """
+    tokens = (token for line in vcd for token in line.split())
+    targets = collections.defaultdict(list)  # from each VCD id to the indices of its inputs
+    clock_id = None
+
+    for token in tokens:
+        if token == '$var':
+            var = []
+            for token in tokens:
+                if token == '$end':
+                    break
+                var.append(token)
+            if len(var) < 4:
+                raise PyrtlError('malformed VCD variable "%s"' % ' '.join(var))
+            name = var[3].split('[')[0]
+            if name in index:
+                targets[var[2]].append(index[name])
+            if name == clock:
+                clock_id = var[2]
+        elif token == '$enddefinitions':
+            break
+        elif token.startswith('$') and token != '$end':
+            for token in tokens:  # skip the other sections of the header
+                if token == '$end':
+                    break
+
+    found = {n for indices in targets.values() for n in indices}
+    for n, w in enumerate(inputs):
+        if n not in found:
+            raise PyrtlError('Input "%s" is not in the VCD' % w.name)
+    if clock is not None and clock_id is None:
+        raise PyrtlError('clock "%s" is not in the VCD' % clock)
+
+    def parse(bits):
+        try:
+            return int(bits, 2)
+        except ValueError:
+            return int(re.sub('[xXzZ]', '0', bits), 2)
+
+    values = [0] * len(inputs)
+    columns = [new_column(w.bitwidth) for w in inputs]
+    filled = 0  # the number of cycles in columns
+    now = 0
+    clock_value = rising = None
+    for token in tokens:
+        first = token[0]
+        if first == '#':
+            time = int(token[1:])
+            if time < now:
+                raise PyrtlError('the times in the VCD must increase')
+            if clock is None:
+                pending = -(-time // period) - -(-now // period)
+            else:
+                pending, rising = int(bool(rising)), False
+            now = time
+            while pending:
+                count = min(pending, chunk_size - filled)
+                for column, value in zip(columns, values):
+                    column.extend([value] * count)
+                filled += count
+                pending -= count
+                if filled == chunk_size:
+                    yield {w.name: column for w, column in zip(inputs, columns)}
+                    columns = [new_column(w.bitwidth) for w in inputs]
+                    filled = 0
+            continue
+        if first == '$':
+            if token == '$comment':
+                for token in tokens:
+                    if token == '$end':
+                        break
+            continue  # $dumpvars and the like only group value changes
+        if first in 'bBrR':
+            ident = next(tokens)
+            if first in 'rR':
+                if ident in targets:
+                    raise PyrtlError('real values cannot be input to "%s"' % ident)
+                continue
+            value = parse(token[1:])
+        else:
+            ident = token[1:]
+            value = 1 if first == '1' else 0
+        if ident == clock_id:
+            if value == 1 and clock_value != 1:
+                rising = True
+            clock_value = value
+        for n in targets.get(ident, ()):
+            if value > inputs[n].bitmask:
+                raise PyrtlError('the value %d in the VCD does not fit in Input "%s"'
+                                 % (value, inputs[n].name))
+            values[n] = value
+
+    if rising:
+        for column, value in zip(columns, values):
+            column.append(value)
+        filled += 1
+    if filled:
+        yield {w.name: column for w, column in zip(inputs, columns)}
+
+
+def replay_vcd(sim, vcd, period=10, clock=None, chunk_size=1 << 16):
+    """ Simulate the stimulus in a VCD file, feeding its values to the Inputs of a simulation.
+
+    :param sim: a Simulation, FastSimulation or CompiledSimulation
+    :param vcd: an open VCD file or a string
+    :param period: the time between two cycles in the dump
+    :param clock: the name of a 1-bit variable in the dump marking the cycles
+    :param chunk_size: the number of cycles read and simulated at once
+    :return: the number of cycles simulated
+
+    The values are read with vcd_input_columns, and each chunk of cycles is
+    passed as columns to the run method of the simulation, so neither the
+    dump nor a dictionary for each step is ever built in memory.  Replaying
+    into a CompiledSimulation requires NumPy.
+
+    Example ::
+
+        sim = pyrtl.FastSimulation()
+        with open('stimulus.vcd') as f:
+            pyrtl.replay_vcd(sim, f)
+    """
+    cycles = 0
+    for columns in vcd_input_columns(vcd, sim.block, period, clock, chunk_size):
+        sim.run(columns)
+        cycles += len(next(iter(columns.values())))
+    return cycles
+
+
 # ----------------------------------------------------------------
 #    __       ___  __       ___
 #   /  \ |  |  |  |__) |  |  |
@@ -404,8 +569,13 @@ def block_to_svg(block=None):
         raise PyrtlError('need graphviz installed (try "pip install graphviz")')
 
 
-def trace_to_html(simtrace, trace_list=None, sortkey=None):
-    """ Return a HTML block showing the trace. """
+def trace_to_html(simtrace, trace_list=None, sortkey=None, start=0, end=None,
+                  max_steps=None, collapse=False):
+    """ Return a HTML block showing the trace.
+
+    The start, end, max_steps and collapse arguments select the steps of the
+    trace to show, as for SimulationTrace.render_trace.
+    """
 
     from .simulation import SimulationTrace, _trace_sort_key
     if not isinstance(simtrace, SimulationTrace):
@@ -417,6 +587,7 @@ def trace_to_html(simtrace, trace_list=None, sortkey=None):
 
     if trace_list is None:
         trace_list = sorted(trace, key=sortkey)
+    _, window = simtrace._render_window(trace_list, start, end, max_steps, collapse)
 
     wave_template = (
         """\
@@ -433,7 +604,7 @@ def trace_to_html(simtrace, trace_list=None, sortkey=None):
         wavelist = []
         datalist = []
         last = None
-        for i, value in enumerate(trace[w]):
+        for value in window[w]:
             if last == value:
                 wavelist.append('.')
             else:
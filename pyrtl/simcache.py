@@ -0,0 +1,205 @@
+"""
+Persistent on-disk cache for the artifacts built by the compiled simulators.
+
+Building a simulator for a large design (running gcc for CompiledSimulation,
+or generating and compiling the Python code of FastSimulation) can take much
+longer than the simulation itself, and the result only depends on the design
+and the build options.  The cache stores these artifacts under a content hash
+so that repeated runs, test suites and CI shards can skip the build entirely.
+
+The cache lives in the directory named by the PYRTL_CACHE_DIR environment
+variable, defaulting to "pyrtl" inside the user cache directory.  It is bounded
+in size, evicting the least recently used entries first, and is safe to fill
+from several processes at once: entries are written to a private temporary
+file and then atomically renamed into place.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import os
+import time
+import errno
+import collections
+import hashlib
+import tempfile
+
+from .pyrtlexceptions import PyrtlError
+
+
+_default_size_limit = 1 << 30  # one gigabyte
+_stale_tmp_age = 3600  # seconds after which a temporary file is left over from a failed write
+
+_cache_dir = os.environ.get('PYRTL_CACHE_DIR')
+if _cache_dir is None:
+    _cache_dir = os.path.join(
+        os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+        'pyrtl')
+_size_limit = _default_size_limit
+
+
+def set_cache_dir(path):
+    """ Set the directory in which built simulators are cached.
+
+    :param path: the directory to use, or None to disable caching entirely
+    """
+    global _cache_dir
+    _cache_dir = path
+
+
+def get_cache_dir():
+    """ Return the directory in which built simulators are cached (None if disabled). """
+    return _cache_dir
+
+
+def set_cache_size_limit(nbytes):
+    """ Set the maximum total size in bytes of each cache before old entries are evicted. """
+    global _size_limit
+    if nbytes < 0:
+        raise PyrtlError('cache size limit must be non-negative')
+    _size_limit = nbytes
+
+
+def clear_cache():
+    """ Remove every entry from the simulation caches. """
+    if _cache_dir is None or not os.path.isdir(_cache_dir):
+        return
+    for subdir in os.listdir(_cache_dir):
+        FileCache(subdir).clear()
+
+
+def content_hash(*parts):
+    """ Return a hex digest identifying the given strings (in order). """
+    h = hashlib.sha256()
+    for part in parts:
+        part = part.encode('utf-8')
+        h.update(str(len(part)).encode('ascii') + b':')
+        h.update(part)
+    return h.hexdigest()
+
+
+class FileCache(object):
+    """ A size-bounded directory of files keyed by content hash, with LRU eviction.
+
+    Every entry is a single file named "<key><suffix>".  Using an entry touches
+    its modification time, which is what eviction uses to find the least
+    recently used entries.
+    """
+
+    def __init__(self, subdir):
+        self.subdir = subdir
+
+    @property
+    def path(self):
+        if _cache_dir is None:
+            return None
+        return os.path.join(_cache_dir, self.subdir)
+
+    def _entry(self, key, suffix):
+        return os.path.join(self.path, key + suffix)
+
+    def get(self, key, suffix=''):
+        """ Return the path of the entry for key, or None if it is not cached. """
+        if self.path is None:
+            return None
+        entry = self._entry(key, suffix)
+        try:
+            os.utime(entry, None)  # mark as recently used
+        except OSError:
+            return None
+        return entry
+
+    def put(self, key, data, suffix=''):
+        """ Store the bytes data as the entry for key and return the path to it. """
+        if self.path is None:
+            return None
+        try:
+            os.makedirs(self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                return None
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=self.path, prefix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            _replace(tmpname, self._entry(key, suffix))
+        except (IOError, OSError):
+            # the cache is only an optimization, so failing to fill it is not an error
+            return None
+        self.evict()
+        return self._entry(key, suffix)
+
+    def evict(self, size_limit=None):
+        """ Remove the least recently used entries until the cache fits in size_limit.
+
+        Temporary files that were left behind by interrupted writes are removed
+        as well, once they are old enough not to belong to a write in progress.
+        """
+        if size_limit is None:
+            size_limit = _size_limit
+        entries = []
+        stale = time.time() - _stale_tmp_age
+        for name in os.listdir(self.path):
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue  # removed by someone else in the meantime
+            if name.startswith('.tmp'):
+                if st.st_mtime < stale:
+                    try:
+                        os.remove(os.path.join(self.path, name))
+                    except OSError:
+                        pass
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= size_limit:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """ Remove every entry in this cache. """
+        if self.path is not None and os.path.isdir(self.path):
+            self.evict(0)
+
+
+class MemoryCache(object):
+    """ A process-local map from keys to objects holding the most recently used entries.
+
+    This sits in front of a FileCache for artifacts that are cheaper to keep
+    around than to load again from disk.
+    """
+
+    def __init__(self, size_limit=64):
+        self.size_limit = size_limit
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        """ Return the entry for key, or None if it is not cached. """
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self._entries[key] = value  # mark as recently used
+        return value
+
+    def put(self, key, value):
+        """ Store value as the entry for key, evicting the least recently used entries. """
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        while len(self._entries) > self.size_limit:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """ Remove every entry in this cache. """
+        self._entries.clear()
+
+
+def _replace(src, dst):
+    """ Atomically move src to dst, replacing dst if it exists. """
+    try:
+        os.replace(src, dst)
+    except AttributeError:  # python 2 has no os.replace, but rename replaces on posix
+        os.rename(src, dst)
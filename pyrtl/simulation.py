@@ -4,8 +4,13 @@ from __future__ import print_function, unicode_literals
 
 import sys
 import re
+import array
 import numbers
 import collections
+import copy
+import heapq
+import operator
+import marshal
 
 from .pyrtlexceptions import PyrtlError, PyrtlInternalError
 from .core import working_block, PostSynthBlock, _PythonSanitizer
@@ -13,6 +18,25 @@ from .wire import Input, Register, Const, Output, WireVector
 from .memory import RomBlock
 from .helperfuncs import check_rtl_assertions, _currently_in_ipython
 from .inputoutput import _VerilogSanitizer
+from .simcache import FileCache, MemoryCache, content_hash
+
+_fastsim_cache = FileCache('fastsim')  # marshalled code of the generated sim_funcs
+_fastsim_code = MemoryCache()  # the same, already loaded, for this process
+_generator_id = None
+
+
+def _generator_version():
+    """Identify the code generators of this module (and the python version) for cache keys."""
+    global _generator_id
+    if _generator_id is None:
+        source = __file__[:-1] if __file__.endswith(('.pyc', '.pyo')) else __file__
+        try:
+            with open(source, 'rb') as f:
+                _generator_id = content_hash(sys.version, f.read().decode('utf-8', 'replace'))
+        except (IOError, OSError):
+            _generator_id = sys.version
+    return _generator_id
+
 
 # ----------------------------------------------------------------
 #    __                         ___    __
@@ -31,7 +55,8 @@ class Simulation(object):
     * *.tracer*: stores the SimulationTrace in which results are stored
     * *.value*: a map from every signal in the block to its current simulation value
     * *.regvalue*: a map from register to its value on the next tick
-    * *.memvalue*: a map from memid to a dictionary of address: value
+    * *.memvalue*: a map from memid to a dictionary of address: value (a
+      DenseMemory for memories small enough to be held in an array)
     """
 
     simple_func = {  # OPS
@@ -52,7 +77,7 @@ class Simulation(object):
 
     def __init__(
             self, tracer=True, register_value_map=None, memory_value_map=None,
-            default_value=0, block=None):
+            default_value=0, block=None, event_driven=False):
         """ Creates a new circuit simulator
 
         :param tracer: an instance of SimulationTrace used to store execution results.
@@ -64,12 +89,19 @@ class Simulation(object):
           the roms specified. Format: {Register: value}.
         :param memory_value_map: Defines initial values for many
           addresses in a single or multiple memory. Format: {Memory: {address: Value}}.
-          Memory is a memory block, address is the address of a value
+          Memory is a memory block, address is the address of a value.  The maps
+          of memories held in a DenseMemory (see inspect_mem) are copied into it,
+          so they do not follow the memory as the simulation writes to it.
         :param default_value: is the value that all unspecified registers and
           memories will initialize to. If no default_value is specified, it will
           use the value stored in the object (default to 0)
         :param block: the hardware block to be traced (which might be of type PostSynthesisBlock).
           defaults to the working block
+        :param event_driven: if True, each step only evaluates the nets some of whose
+          arguments changed value (following the fanout of the inputs, registers and
+          memories that changed) instead of every net of the block.  This is much
+          faster for designs where little of the logic switches every cycle.  In this
+          mode, the values in .value and .memvalue should not be changed directly
 
         Warning: Simulation initializes some things when called with __init__,
         so changing items in the block for Simulation will likely break
@@ -88,6 +120,7 @@ class Simulation(object):
         self.memvalue = {}  # map from {memid :{address: value}}
         self.block = block
         self.default_value = default_value
+        self.event_driven = event_driven
         if tracer is True:
             tracer = SimulationTrace()
         self.tracer = tracer
@@ -118,11 +151,16 @@ class Simulation(object):
             assert isinstance(w.val, numbers.Integral)  # for now
 
         # set memories to their passed values
-
+        #  RomBlocks are turned into tables once, shared by all of their read ports
+        self._rom_tables = {}
         for mem_net in self.block.logic_subset('m@'):
-            memid = mem_net.op_param[1].id
-            if memid not in self.memvalue:
-                self.memvalue[memid] = {}
+            mem = mem_net.op_param[1]
+            if mem.id not in self.memvalue:
+                if isinstance(mem, RomBlock):
+                    self.memvalue[mem.id] = {}
+                    self._rom_tables[mem] = _rom_table(mem)
+                else:
+                    self.memvalue[mem.id] = _new_memory(mem, default_value)
 
         if memory_value_map is not None:
             for (mem, mem_map) in memory_value_map.items():
@@ -139,6 +177,8 @@ class Simulation(object):
                     if val < 0 or val >= max_bit_val:
                         raise PyrtlError('error, %s at %s in %s outside of bounds' %
                                          (str(val), str(addr), mem.name))
+                if _fits_dense(mem):
+                    self.memvalue[mem.id] = _new_memory(mem, default_value, mem_map)
 
         # set all other variables to default value
         for w in self.block.wirevector_set:
@@ -148,6 +188,29 @@ class Simulation(object):
         self.ordered_nets = tuple((i for i in self.block))
         self.reg_update_nets = tuple((self.block.logic_subset('r')))
         self.mem_update_nets = tuple((self.block.logic_subset('@')))
+        # the execution plan: a function evaluating each combinational net, in order
+        self._comb_nets = tuple(net for net in self.ordered_nets if net.op not in 'r@')
+        self._plan = tuple(self._compile_net(net) for net in self._comb_nets)
+        if self.event_driven:
+            self._initialize_fanout()
+
+    def _initialize_fanout(self):
+        """ Precompute what the event driven mode needs to follow changes through the block.
+
+        The combinational nets are numbered in topological order, and for every
+        wire (and memory) the numbers of the nets reading it are recorded, so that
+        evaluating the nets in increasing number only ever visits each net once.
+        """
+        number = {net: n for n, net in enumerate(self._comb_nets)}
+        _, wire_sinks = self.block.net_connections()
+        self._fanout = {w: tuple(number[net] for net in nets if net in number)
+                        for w, nets in wire_sinks.items()}
+        self._mem_readers = collections.defaultdict(list)
+        for net in self._comb_nets:
+            if net.op == 'm':
+                self._mem_readers[net.op_param[0]].append(number[net])
+        self._sources = tuple(self.block.wirevector_subset((Input, Register)))
+        self._dirty_nets = set(range(len(self._comb_nets)))  # evaluate everything at first
 
     def step(self, provided_inputs):
         """ Take the simulation forward one cycle
@@ -162,6 +225,8 @@ class Simulation(object):
         respectively
         """
 
+        prior = [self.value[w] for w in self._sources] if self.event_driven else None
+
         # Check that all Input have a corresponding provided_input
         input_set = self.block.wirevector_subset(Input)
         supplied_inputs = set()
@@ -194,14 +259,52 @@ class Simulation(object):
             for i in input_set.difference(supplied_inputs):
                 raise PyrtlError('Input "%s" has no input value specified' % i.name)
 
+        self._advance(prior)
+
+    def run(self, inputs, nsteps=None):
+        """ Run the simulation for many cycles.
+
+        :param inputs: a dictionary mapping the Inputs (or their names) to either
+          a sequence holding the value of the input in each step, or a single
+          value used in every step.  A list with the provided_inputs of each
+          step (as taken by step) is also accepted.
+        :param nsteps: the number of steps to run, defaulting to the length of
+          the input sequences
+
+        This has the same effect as calling step for each cycle, but the input
+        values are checked once for the whole run and set directly from the
+        sequences, without building a dictionary for each step.
+        """
+        columns, nsteps = _input_columns(self.block, inputs, nsteps)
+        columns = [(self.block.wirevector_by_name[name], values)
+                   for name, values in columns.items()]
+        value = self.value
+        for n in range(nsteps):
+            prior = [value[w] for w in self._sources] if self.event_driven else None
+            for wire, values in columns:
+                value[wire] = values[n]
+            self._advance(prior)
+
+    def _advance(self, prior):
+        """ Simulate the current cycle, once the values of the Inputs are set.
+
+        :param prior: the values of the Inputs and Registers before the cycle
+          in event-driven mode (None otherwise)
+        """
         self.value.update(self.regvalue)  # apply register updates from previous step
 
-        for net in self.ordered_nets:
-            self._execute(net)
+        if self.event_driven:
+            self._propagate([w for w, v in zip(self._sources, prior) if self.value[w] != v])
+        else:
+            value, memvalue = self.value, self.memvalue
+            for evaluate in self._plan:
+                evaluate(value, memvalue)
 
         # Do all of the mem operations based off the new values changed in _execute()
         for net in self.mem_update_nets:
-            self._mem_update(net)
+            if self._mem_update(net) and self.event_driven:
+                # the reads of the memory need to be evaluated again in the next step
+                self._dirty_nets.update(self._mem_readers[net.op_param[0]])
 
         # at the end of the step, record the values to the trace
         # print self.value # Helpful Debug Print
@@ -217,6 +320,55 @@ class Simulation(object):
         # raise the appropriate exceptions
         check_rtl_assertions(self)
 
+    def snapshot(self):
+        """ Capture the state of the simulation between steps.
+
+        :return: a SimulationSnapshot of the registers, memories and trace position
+
+        The simulation can be brought back to this state with restore(), and
+        new simulations can be started from it with fork().
+        """
+        registers = {r.name: self.regvalue.get(r, self.value[r])
+                     for r in self.block.wirevector_subset(Register)}
+        memories = {mem.name: _memory_dict(self.memvalue[mem.id])
+                    for mem in _writable_mems(self.block)}
+        return SimulationSnapshot(registers, memories, _trace_position(self.tracer))
+
+    def restore(self, snapshot):
+        """ Bring the simulation back to the state captured in snapshot.
+
+        :param snapshot: a SimulationSnapshot of a simulation of the same design
+
+        Steps traced after the snapshot was taken are dropped from the trace.
+        """
+        regvalue = snapshot._register_values(self.block)
+        memvalue = snapshot._memory_values(self.block)
+        self.regvalue = regvalue
+        for mem, values in memvalue.items():
+            self.memvalue[mem.id] = _new_memory(mem, self.default_value, values)
+        snapshot._restore_trace(self.tracer)
+        if self.event_driven:
+            self._dirty_nets = set(range(len(self._comb_nets)))
+
+    def fork(self, snapshot=None):
+        """ Create a new simulation of the same design, continuing from a snapshot.
+
+        :param snapshot: the SimulationSnapshot to start from (defaults to the
+          current state of this simulation)
+        :return: a new, independent simulation with a copy of the trace
+
+        Forking does not rebuild anything, so it is much cheaper than creating
+        a new simulation and running it to the same point.
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        sim = copy.copy(self)
+        sim.value = dict(self.value)
+        sim.memvalue = dict(self.memvalue)
+        sim.tracer = _copy_tracer(self.tracer)
+        sim.restore(snapshot)
+        return sim
+
     def inspect(self, w):
         """ Get the value of a wirevector in the last simulation cycle.
 
@@ -236,7 +388,9 @@ class Simulation(object):
         :return: {address: value}
 
         Note that this returns the current memory state. Modifying the dictonary
-        will also modify the state in the simulator
+        will also modify the state in the simulator.  Memories small enough to be
+        held in an array are returned as a DenseMemory, which lists the addresses
+        not holding the default value.
         """
         return self.memvalue[mem.id]
 
@@ -250,40 +404,144 @@ class Simulation(object):
         """
         return val & wirevector.bitmask
 
+    _binary_func = {  # the ops of simple_func with two arguments, as builtin functions
+        '&': operator.and_,
+        '|': operator.or_,
+        '^': operator.xor,
+        '+': operator.add,
+        '-': operator.sub,
+        '*': operator.mul,
+        '<': operator.lt,
+        '>': operator.gt,
+        '=': operator.eq,
+    }
+
+    def _compile_net(self, net):
+        """Return a function that evaluates the given (combinational) net.
+
+        The function takes the value and memvalue maps and stores the value of
+        the destination of the net in value.  Everything that does not depend on
+        the values of the wires (which op to apply, the arguments, the mask of the
+        destination, the shifts of a concatenation or selection) is worked out
+        here once, so that a step only has to call the functions of the plan.
+        Comparisons produce booleans, which the mask turns into ints.
+        """
+        op, args, dest = net.op, net.args, net.dests[0]
+        mask = dest.bitmask
+
+        if op in self._binary_func:
+            func, (a, b) = self._binary_func[op], args
+
+            def evaluate(value, memvalue):
+                value[dest] = func(value[a], value[b]) & mask
+        elif op == 'w':
+            a, = args
+
+            def evaluate(value, memvalue):
+                value[dest] = value[a] & mask
+        elif op == '~':
+            a, = args
+
+            def evaluate(value, memvalue):
+                value[dest] = ~value[a] & mask
+        elif op == 'n':
+            a, b = args
+
+            def evaluate(value, memvalue):
+                value[dest] = ~(value[a] & value[b]) & mask
+        elif op == 'x':
+            sel, f, t = args
+
+            def evaluate(value, memvalue):
+                value[dest] = (value[t] if value[sel] else value[f]) & mask
+        elif op == 'c':
+            shifts, shift = [], 0
+            for arg in reversed(args):
+                shifts.append((arg, shift))
+                shift += len(arg)
+
+            def evaluate(value, memvalue):
+                result = 0
+                for arg, shift in shifts:
+                    result |= value[arg] << shift
+                value[dest] = result & mask
+        elif op == 's':
+            a, = args
+            low = net.op_param[0]
+            if tuple(net.op_param) == tuple(range(low, low + len(net.op_param))):
+                # a contiguous slice, the most common case
+                def evaluate(value, memvalue):
+                    value[dest] = (value[a] >> low) & mask
+            else:
+                bits = tuple(enumerate(net.op_param))
+
+                def evaluate(value, memvalue):
+                    source = value[a]
+                    result = 0
+                    for pos, b in bits:
+                        result |= (1 & (source >> b)) << pos
+                    value[dest] = result
+        elif op == 'm':
+            # memories act async for reads
+            memid, mem = net.op_param
+            addr, = args
+            table = self._rom_tables.get(mem)
+            if table is not None:
+                def evaluate(value, memvalue):
+                    value[dest] = table[value[addr]]
+            elif isinstance(mem, RomBlock):
+                def evaluate(value, memvalue):
+                    value[dest] = mem._get_read_data(value[addr]) & mask
+            elif _fits_dense(mem):
+                def evaluate(value, memvalue):
+                    value[dest] = memvalue[memid]._data[value[addr]] & mask
+            else:
+                default_value = self.default_value
+
+                def evaluate(value, memvalue):
+                    value[dest] = memvalue[memid].get(value[addr], default_value) & mask
+        else:
+            raise PyrtlInternalError('error, unknown op type')
+        return evaluate
+
     def _execute(self, net):
         """Handle the combinational logic update rules for the given net.
 
         This function, along with edge_update, defined the semantics
         of the primitive ops. Function updates self.value accordingly.
+        The steps of the simulation run the same functions, prepared in
+        advance in the execution plan.
         """
         if net.op in 'r@':
             return  # registers and memory write ports have no logic function
-        elif net.op in self.simple_func:
-            argvals = (self.value[arg] for arg in net.args)
-            result = self.simple_func[net.op](*argvals)
-        elif net.op == 'c':
-            result = 0
-            for arg in net.args:
-                result = result << len(arg)
-                result = result | self.value[arg]
-        elif net.op == 's':
-            result = 0
-            source = self.value[net.args[0]]
-            for b in net.op_param[::-1]:
-                result = (result << 1) | (0x1 & (source >> b))
-        elif net.op == 'm':
-            # memories act async for reads
-            memid = net.op_param[0]
-            mem = net.op_param[1]
-            read_addr = self.value[net.args[0]]
-            if isinstance(mem, RomBlock):
-                result = mem._get_read_data(read_addr)
-            else:
-                result = self.memvalue[memid].get(read_addr, self.default_value)
-        else:
-            raise PyrtlInternalError('error, unknown op type')
+        self._compile_net(net)(self.value, self.memvalue)
 
-        self.value[net.dests[0]] = self._sanitize(result, net.dests[0])
+    def _propagate(self, changed):
+        """ Evaluate the nets affected by the wires in changed (for the event driven mode).
+
+        Starting from the nets reading the changed wires (and those marked dirty
+        by the memory writes of the last step), nets are evaluated in topological
+        order, and the readers of every net whose value changed are added in turn.
+        """
+        queued = self._dirty_nets
+        fanout = self._fanout
+        for w in changed:
+            queued.update(fanout.get(w, ()))
+        heap = list(queued)
+        heapq.heapify(heap)
+        nets, plan = self._comb_nets, self._plan
+        value, memvalue = self.value, self.memvalue
+        while heap:
+            n = heapq.heappop(heap)
+            dest = nets[n].dests[0]
+            old = value[dest]
+            plan[n](value, memvalue)
+            if value[dest] != old:
+                for n in fanout.get(dest, ()):
+                    if n not in queued:
+                        queued.add(n)
+                        heapq.heappush(heap, n)
+        queued.clear()
 
     def _mem_update(self, net):
         """Handle the mem update for the simulation of the given net (which is a memory).
@@ -291,7 +549,7 @@ class Simulation(object):
         Combinational logic should have no posedge behavior, but registers and
         memory should.  This function, used after _execute, defines the
         semantics of the primitive ops.  Function updates self.memvalue accordingly
-        (using prior_value)
+        (using prior_value), and returns whether the contents of the memory changed.
         """
         if net.op != '@':
             raise PyrtlInternalError
@@ -300,7 +558,58 @@ class Simulation(object):
         write_val = self.value[net.args[1]]
         write_enable = self.value[net.args[2]]
         if write_enable:
-            self.memvalue[memid][write_addr] = write_val
+            mem = self.memvalue[memid]
+            if isinstance(mem, DenseMemory):
+                mem = mem._data  # the address is always in range
+                changed = mem[write_addr] != write_val
+            else:
+                changed = mem.get(write_addr, self.default_value) != write_val
+            mem[write_addr] = write_val
+            return changed
+        return False
+
+
+def _input_columns(block, inputs, nsteps):
+    """ Check the inputs of a run of nsteps steps and turn them into a column per Input.
+
+    :return: a map from each Input name to the sequence of its values, and
+      the number of steps (which defaults to the length of the sequences)
+    """
+    if not isinstance(inputs, collections.Mapping):
+        steps = list(inputs)
+        if nsteps is None:
+            nsteps = len(steps)
+        inputs = {wire: [step[wire] for step in steps[:nsteps]]
+                  for wire in (steps[0] if steps else ())}
+
+    if nsteps is None:
+        lengths = [len(values) for values in inputs.values()
+                   if not isinstance(values, numbers.Integral)]
+        if not lengths:
+            raise PyrtlError('nsteps is needed when no input is given as a sequence')
+        nsteps = min(lengths)
+
+    input_set = block.wirevector_subset(Input)
+    columns = {}
+    for key, values in inputs.items():
+        wire = block.get_wirevector_by_name(key) if isinstance(key, str) else key
+        if wire not in input_set:
+            raise PyrtlError('"%s" is not an input of the simulated block' % key)
+        if isinstance(values, numbers.Integral):
+            values = [values] * nsteps
+        elif len(values) < nsteps:
+            raise PyrtlError('Input "%s" has %d values, but %d steps are to be run'
+                             % (wire.name, len(values), nsteps))
+        else:
+            values = values[:nsteps]
+        if nsteps and (max(values) > wire.bitmask or min(values) < 0):
+            raise PyrtlError("Wire {} has a value which cannot be represented"
+                             " using its bitwidth".format(wire))
+        columns[wire.name] = values
+    for wire in input_set:
+        if wire.name not in columns:
+            raise PyrtlError('Input "%s" has no input value specified' % wire.name)
+    return columns, nsteps
 
 
 # ----------------------------------------------------------------
@@ -323,6 +632,12 @@ class FastSimulation(object):
     #  WireVector names.
     #  Careful use of repr() is used to make sure that strings stay the same
     #  when put into the generated code
+    #  The generated code holds every wire (inputs and registers included) in
+    #  a local variable, loaded once at the start of the cycle, and the next
+    #  values of the registers in the locals named by _regnext.  Outputs and
+    #  registers are only put in the dictionaries returned at the end.
+
+    _mem_copies = 1  # the number of copies of each memory held (one per lane when batched)
 
     def __init__(
             self, register_value_map=None, memory_value_map=None,
@@ -340,6 +655,11 @@ class FastSimulation(object):
         This builds the Fast Simulation compiled Python code, so all changes
         to the circuit after calling this function will not be reflected in
         the simulation
+
+        The compiled code is cached, both in the process and on disk (see
+        pyrtl.simcache), under a hash of the structure of the block and of the
+        traced wires, so building another simulation of the same design skips
+        the code generation.
         """
 
         block = working_block(block)
@@ -351,6 +671,7 @@ class FastSimulation(object):
             tracer = SimulationTrace()
         self.tracer = tracer
         self.sim_func = None
+        self._run_func = None
         self.code_file = code_file
         self.mems = {}
         self.regs = {}
@@ -375,16 +696,74 @@ class FastSimulation(object):
                 self.regs[r.name] = default_value
 
         self._initialize_mems(memory_value_map)
+        self.sim_func = self._load_sim_func()
 
-        s = self._compiled()
-        if self.code_file is not None:
-            with open(self.code_file, 'w') as file:
+    def _load_sim_func(self):
+        """ Return the generated sim_func, compiling its code only if it is not cached. """
+        return self._load_generated('sim_func', self._compiled, self.code_file)
+
+    def _load_generated(self, func_name, generate, code_file=None):
+        """ Return the function func_name from the code produced by generate.
+
+        The compiled code is taken from the cache when possible.
+        """
+        key = content_hash(func_name, self._structure_key())
+        code = _fastsim_code.get(key)
+        if code is None:
+            path = _fastsim_cache.get(key, '.marshal')
+            if path is not None:
+                try:
+                    with open(path, 'rb') as f:
+                        code = marshal.loads(f.read())
+                except (IOError, OSError, EOFError, ValueError, TypeError):
+                    code = None  # evicted in the meantime, or a broken entry
+
+        s = None
+        if code_file is not None:
+            s = generate()
+            with open(code_file, 'w') as file:
                 file.write(s)
+        if code is None:
+            if s is None:
+                s = generate()
+            code = compile(s, '<string>', 'exec')
+            _fastsim_cache.put(key, marshal.dumps(code), '.marshal')
+        _fastsim_code.put(key, code)
 
         context = {}
-        logic_creator = compile(s, '<string>', 'exec')
-        exec(logic_creator, context)
-        self.sim_func = context['sim_func']
+        exec(code, context)
+        return context[func_name]
+
+    def _structure_key(self):
+        """ Return a hash of everything that the generated code depends on.
+
+        That is the nets of the block, with the types, names and bitwidths of
+        their wires, the traced wires, the default value, the simulation class,
+        the code generator and the python version (which determines the format
+        of the bytecode).  The nets are sorted, as any topological order of them
+        gives a correct sim_func.
+        """
+        def describe_wire(w):
+            if isinstance(w, Const):
+                return 'Const(%d/%d)' % (w.val, w.bitwidth)
+            return '%s(%r/%d)' % (type(w).__name__, w.name, w.bitwidth)
+
+        def describe_net(net):
+            param = net.op_param
+            if net.op in 'm@':
+                memid, mem = param
+                param = (memid, mem.id, type(mem).__name__, mem.bitwidth, mem.addrwidth,
+                         self._mem_varname(mem) in self._rom_tables,
+                         self._mem_varname(mem) in self._dense_mems)
+            return '%s %r %s -> %s' % (net.op, param,
+                                       ' '.join(describe_wire(w) for w in net.args),
+                                       ' '.join(describe_wire(w) for w in net.dests))
+
+        traced = [] if self.tracer is None else sorted(self.tracer.trace)
+        return content_hash(
+            type(self).__name__, _generator_version(), repr(self.default_value),
+            ' '.join(repr(name) for name in traced),
+            *sorted(describe_net(net) for net in self.block.logic))
 
     def _initialize_mems(self, memory_value_map):
         if memory_value_map is not None:
@@ -393,13 +772,22 @@ class FastSimulation(object):
                     raise PyrtlError('error, one or more of the memories in the map is a RomBlock')
                 self.mems[self._mem_varname(mem)] = mem_map
 
-        for net in self.block.logic_subset('m@'):
-            mem = net.op_param[1]
-            if self._mem_varname(mem) not in self.mems:
-                if isinstance(mem, RomBlock):
-                    self.mems[self._mem_varname(mem)] = mem
+        self._dense_mems = set()  # the memories held in a DenseMemory, indexed directly
+        self._rom_tables = set()  # the RomBlocks turned into a tuple, indexed directly
+        for mem in {net.op_param[1] for net in self.block.logic_subset('m@')}:
+            name = self._mem_varname(mem)
+            if isinstance(mem, RomBlock):
+                table = _rom_table(mem)
+                if table is None:
+                    self.mems[name] = mem
                 else:
-                    self.mems[self._mem_varname(mem)] = {}
+                    self.mems[name] = table
+                    self._rom_tables.add(name)
+            elif name not in self.mems or _fits_dense(mem, self._mem_copies):
+                self.mems[name] = _new_memory(
+                    mem, self.default_value, self.mems.get(name), self._mem_copies)
+                if isinstance(self.mems[name], DenseMemory):
+                    self._dense_mems.add(name)
 
     def step(self, provided_inputs):
         """ Run the simulation for a cycle
@@ -420,11 +808,8 @@ class FastSimulation(object):
         ins.update(self.regs)
         ins.update(self.mems)
 
-        # propagate through logic
-        self.regs, self.outs, mem_writes = self.sim_func(ins)
-
-        for mem, addr, value in mem_writes:
-            self.mems[mem][addr] = value
+        # propagate through logic (which also does the memory writes)
+        self.regs, self.outs = self.sim_func(ins)
 
         # for tracer compatibility
         self.context = self.outs.copy()
@@ -435,6 +820,78 @@ class FastSimulation(object):
         # check the rtl assertions
         check_rtl_assertions(self)
 
+    def run(self, inputs, nsteps=None):
+        """ Run the simulation for many cycles.
+
+        :param inputs: a dictionary mapping the Inputs (or their names) to either
+          a sequence holding the value of the input in each step, or a single
+          value used in every step.  A list with the provided_inputs of each
+          step (as taken by step) is also accepted.
+        :param nsteps: the number of steps to run, defaulting to the length of
+          the input sequences
+
+        This has the same effect as calling step for each cycle, but the loop
+        over the cycles is part of the generated code, which keeps the registers
+        in local variables and appends to the trace as it goes, so none of the
+        per-step dictionaries are built.  The function is generated at the
+        first call.  The cycles are run a few thousand at a time, applying the
+        capture policy of the tracer in between.
+        """
+        columns, nsteps = _input_columns(self.block, inputs, nsteps)
+        if nsteps == 0:
+            return
+
+        if self._run_func is None:
+            self._run_func = self._load_generated('sim_run', self._compiled_run)
+        if self.tracer is None:
+            trace = []
+        else:
+            trace = [self.tracer._column_of[name].append for name in sorted(self.tracer.trace)]
+
+        for first in range(0, nsteps, _trace_chunk_size):
+            steps = min(_trace_chunk_size, nsteps - first)
+            chunk = {name: values[first:first + steps] for name, values in columns.items()}
+            self.regs, self.context, failed = self._run_func(
+                steps, chunk, self.regs, self.mems, trace)
+            if self.tracer is not None:
+                self.tracer._steps_added()
+            if failed is not None:
+                raise self.block.rtl_assert_dict[self.block.wirevector_by_name[failed]]
+
+    def snapshot(self):
+        """ Capture the state of the simulation between steps.
+
+        See Simulation.snapshot
+        """
+        memories = {mem.name: _memory_dict(self.mems[self._mem_varname(mem)])
+                    for mem in _writable_mems(self.block)}
+        return SimulationSnapshot(dict(self.regs), memories, _trace_position(self.tracer))
+
+    def restore(self, snapshot):
+        """ Bring the simulation back to the state captured in snapshot.
+
+        See Simulation.restore
+        """
+        regs = snapshot._register_values(self.block)
+        memvalue = snapshot._memory_values(self.block)
+        self.regs = {r.name: value for r, value in regs.items()}
+        for mem, values in memvalue.items():
+            self.mems[self._mem_varname(mem)] = _new_memory(mem, self.default_value, values)
+        snapshot._restore_trace(self.tracer)
+
+    def fork(self, snapshot=None):
+        """ Create a new simulation of the same design, continuing from a snapshot.
+
+        The generated code is shared with this simulation.  See Simulation.fork
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        sim = copy.copy(self)
+        sim.mems = dict(self.mems)
+        sim.tracer = _copy_tracer(self.tracer)
+        sim.restore(snapshot)
+        return sim
+
     def inspect(self, w):
         """ Get the value of a wirevector in the last simulation cycle.
 
@@ -482,20 +939,16 @@ class FastSimulation(object):
 
     def _arg_varname(self, wire):
         """
-        Input, Const, and Registers have special input values
+        Consts are hardcoded, everything else is loaded into a local
         """
-        if isinstance(wire, (Input, Register)):
-            return 'd[' + repr(wire.name) + ']'  # passed in
-        elif isinstance(wire, Const):
+        if isinstance(wire, Const):
             return str(wire.val)  # hardcoded
         else:
             return self._varname(wire)
 
     def _dest_varname(self, wire):
-        if isinstance(wire, Output):
-            return 'outs[' + repr(wire.name) + ']'
-        elif isinstance(wire, Register):
-            return 'regs[' + repr(wire.name) + ']'
+        if isinstance(wire, Register):
+            return self._regnext[wire.name]  # the value for the next cycle
         else:
             return self._varname(wire)
 
@@ -519,21 +972,121 @@ class FastSimulation(object):
         'm': lambda net: -1,   # just not going to optimize this right now
     }
 
-    # Yeah, triple quotes don't respect indentation (aka the 4 spaces on the
-    # start of each line is part of the string)
-    _prog_start = """def sim_func(d):
-    regs = {}
-    outs = {}
-    mem_ws = []"""
-
     def _compiled(self):
         """Return a string of the self.block compiled to a block of
          code that can be execed to get a function to execute"""
         # Dev Notes:
         # Because of fast locals in functions in both CPython and PyPy, getting a
         # function to execute makes the code a few times faster than
-        # just executing it in the global exec scope.
-        prog = [self._prog_start]
+        # just executing it in the global exec scope.  For the same reason the
+        # inputs, registers and memories are loaded from _fs_ins into locals once.
+        regs = [net.dests[0] for net in self.block.logic_subset('r')]
+        self._regnext = {r.name: '_fs_next%d' % i for i, r in enumerate(regs)}
+        self._mem_writes = []
+        logic = self._compiled_logic()
+
+        used = {arg for net in self.block.logic for arg in net.args}
+        inputs = [w for w in self.block.wirevector_subset(Input) if w in used]
+        outputs = list(self.block.wirevector_subset(Output))
+        if self.tracer is not None:
+            # add traced wires to the returned outputs
+            outputs.extend(
+                w for w in (self.block.wirevector_by_name[n] for n in self.tracer.trace)
+                if not isinstance(w, (Input, Const, Register, Output)))
+
+        prog = ['def sim_func(_fs_ins):']
+        for w in inputs + regs:
+            prog.append('    %s = _fs_ins[%r]' % (self._varname(w), w.name))
+        for m in sorted(self.mems):
+            prog.append('    %s = _fs_ins[%r]%s' % (m, m, self._mem_data(m)))
+        prog.extend('    ' + line for line in logic + self._mem_writes)
+        prog.append('    return {%s}, {%s}' % (
+            ', '.join('%r: %s' % (r.name, self._regnext[r.name]) for r in regs),
+            ', '.join('%r: %s' % (w.name, self._varname(w)) for w in outputs)))
+        return '\n'.join(prog)
+
+    def _compiled_run(self):
+        """Return a string of the self.block compiled to a function that runs
+        many cycles, keeping the wires, registers and memories in locals"""
+        regs = [net.dests[0] for net in self.block.logic_subset('r')]
+        self._regnext = {r.name: '_fsr_next%d' % i for i, r in enumerate(regs)}
+        self._mem_writes = []
+        logic = self._compiled_logic()
+
+        def value(wire):
+            if isinstance(wire, Const):
+                return str(wire.val)
+            return self._varname(wire)
+
+        inputs = list(self.block.wirevector_subset(Input))
+        mems = sorted(self.mems)
+        traced = [] if self.tracer is None else sorted(self.tracer.trace)
+        asserts = sorted(self.block.rtl_assert_dict, key=lambda w: w.name)
+        context = inputs + regs + list(self.block.wirevector_subset(Output))
+        context.extend(w for w in (self.block.wirevector_by_name[n] for n in traced)
+                       if not isinstance(w, (Input, Const, Register, Output)))
+
+        # the registers are loaded at the start of each cycle from their next
+        # values, so that after the loop they hold their values in the last cycle
+        prog = ['def sim_run(_fsr_steps, _fsr_ins, _fsr_regs, _fsr_mems, _fsr_trace):']
+        for i, w in enumerate(inputs):
+            prog.append('    _fsr_in%d = _fsr_ins[%r]' % (i, w.name))
+        for r in regs:
+            prog.append('    %s = _fsr_regs[%r]' % (self._regnext[r.name], r.name))
+        for m in mems:
+            prog.append('    %s = _fsr_mems[%r]%s' % (m, m, self._mem_data(m)))
+        for i, name in enumerate(traced):
+            prog.append('    _fsr_trace%d = _fsr_trace[%d]' % (i, i))
+        prog.append('    _fsr_failed = None')
+        prog.append('    for _fsr_n in range(_fsr_steps):')
+        for i, w in enumerate(inputs):
+            prog.append('        %s = _fsr_in%d[_fsr_n]' % (self._varname(w), i))
+        for r in regs:
+            prog.append('        %s = %s' % (self._varname(r), self._regnext[r.name]))
+        prog.extend('        ' + line for line in logic)
+        for i, name in enumerate(traced):
+            wire = self.block.wirevector_by_name[name]
+            prog.append('        _fsr_trace%d(%s)' % (i, value(wire)))
+        prog.extend('        ' + line for line in self._mem_writes)
+        for w in asserts:
+            prog.append('        if not %s:' % self._varname(w))
+            prog.append('            _fsr_failed = %r' % w.name)
+            prog.append('            break')
+        prog.append('    return ({%s}, {%s}, _fsr_failed)' % (
+            ', '.join('%r: %s' % (r.name, self._regnext[r.name]) for r in regs),
+            ', '.join('%r: %s' % (w.name, self._varname(w)) for w in context)))
+        return '\n'.join(prog)
+
+    def _mem_data(self, name):
+        """ The attribute of the memory name that the generated code works on """
+        return '._data' if name in self._dense_mems else ''
+
+    def _compiled_mem_read(self, mem, read_addr):
+        """ Expression reading read_addr from mem in the generated code """
+        if self._mem_varname(mem) in self._rom_tables:
+            return '%s[%s]' % (self._mem_varname(mem), read_addr)
+        elif isinstance(mem, RomBlock):
+            return '%s._get_read_data(%s)' % (self._mem_varname(mem), read_addr)
+        elif self._mem_varname(mem) in self._dense_mems:
+            return '%s[%s]' % (self._mem_varname(mem), read_addr)
+        else:  # memories act async for reads
+            return '%s.get(%s, %s)' % (self._mem_varname(mem), read_addr, self.default_value)
+
+    def _compiled_mem_write(self, mem, write_addr, write_val, write_enable):
+        """ Line of generated code performing a write to mem """
+        return 'if {}: {}[{}] = {}'.format(
+            write_enable, self._mem_varname(mem), write_addr, write_val)
+
+    def _compiled_logic(self):
+        """Return the (unindented) lines of generated code evaluating one cycle
+        of the logic in self.block.
+
+        Wire names are produced by _arg_varname and _dest_varname and memory
+        accesses by _compiled_mem_read and _compiled_mem_write, so the same
+        logic can be embedded in differently shaped generated functions.  The
+        memory writes are collected in self._mem_writes (and the next values of
+        the registers named by self._regnext), which the caller sets up."""
+        prog = []
 
         simple_func = {  # OPS
             'w': lambda x: x,
@@ -598,42 +1151,743 @@ class FastSimulation(object):
                 expr += make_split()
             elif net.op == 'm':
                 read_addr = self._arg_varname(net.args[0])
-                mem = net.op_param[1]
-                if isinstance(net.op_param[1], RomBlock):
-                    expr = 'd["%s"]._get_read_data(%s)' % (self._mem_varname(mem), read_addr)
-                else:  # memories act async for reads
-                    expr = 'd["%s"].get(%s, %s)' % (self._mem_varname(mem),
-                                                    read_addr, self.default_value)
+                expr = self._compiled_mem_read(net.op_param[1], read_addr)
             elif net.op == '@':
-                mem = self._mem_varname(net.op_param[1])
                 write_addr, write_val, write_enable = (self._arg_varname(a) for a in net.args)
-                prog.append('    if {}:'.format(write_enable))
-                prog.append('        mem_ws.append(("{}", {}, {}))'
-                            .format(mem, write_addr, write_val))
+                # writes are deferred until all of the reads of the cycle have been done
+                self._mem_writes.append(self._compiled_mem_write(
+                    net.op_param[1], write_addr, write_val, write_enable))
                 continue  # memwrites are special
             else:
                 raise PyrtlError('FastSimulation cannot handle primitive "%s"' % net.op)
 
-            # prog.append('    #  ' + str(net))
+            # prog.append('#  ' + str(net))
             result = self._dest_varname(net.dests[0])
             if len(net.dests[0]) == self._no_mask_bitwidth[net.op](net):
-                prog.append("    %s = %s" % (result, expr))
+                prog.append("%s = %s" % (result, expr))
             else:
                 mask = str(net.dests[0].bitmask)
-                prog.append('    %s = %s & %s' % (result, mask, expr))
+                prog.append('%s = %s & %s' % (result, mask, expr))
+        return prog
+
+
+class BatchedFastSimulation(FastSimulation):
+    """A FastSimulation that steps many independent copies ("lanes") of a block at once.
+
+    Every lane has its own register and memory state, but all of the lanes share
+    a single generated function, so the cost of code generation and of the Python
+    call overhead for each step is paid once for the whole batch rather than once
+    per lane.  This is useful for pushing many independent stimulus streams through
+    the same design.
+
+    Values passed in and out of the simulation are per-lane sequences: a list (or
+    any other indexable sequence such as an array) with one entry per lane.  So
+    inspect returns a list with the value of the wire in each lane, inspect_mem
+    a list with the {address: value} map of the memory in each lane, and the
+    SimulationTrace of each lane is in .tracers.
+    """
+
+    def __init__(
+            self, lanes, register_value_map=None, memory_value_map=None,
+            default_value=0, tracer=True, block=None, code_file=None):
+        """ Instantiates a batched Fast Simulation instance.
+
+        :param lanes: The number of independent copies of the block to simulate
+        :param tracer: If True (the default) a new SimulationTrace is created
+          for each lane.  A list with one SimulationTrace per lane may be passed
+          instead, or None to disable tracing.  The tracers are available in .tracers
+        :param register_value_map: Format: {Register: value}, where value is either
+          an int used for every lane or a sequence with one value per lane
+        :param memory_value_map: Format: {Memory: {address: Value}}, where the map
+          for each memory is copied into every lane
+
+        Look at FastSimulation.__init__ for descriptions for the other parameters
+        """
+        if lanes < 1:
+            raise PyrtlError('BatchedFastSimulation needs at least one lane')
+        self.lanes = self._mem_copies = lanes
+
+        block = working_block(block)
+        if tracer is True:
+            tracers = [SimulationTrace(block=block) for _ in range(lanes)]
+        elif tracer is None:
+            tracers = None
+        else:
+            tracers = list(tracer)
+            if len(tracers) != lanes:
+                raise PyrtlError('expected %d tracers, one per lane, got %d'
+                                 % (lanes, len(tracers)))
+        self.tracers = tracers
+        # a representative tracer, used by code generation to find the traced wires
+        tracer = None if tracers is None else tracers[0]
+        super(BatchedFastSimulation, self).__init__(
+            register_value_map=register_value_map, memory_value_map=memory_value_map,
+            default_value=default_value, tracer=tracer, block=block, code_file=code_file)
+
+    def _initialize(self, register_value_map=None, memory_value_map=None, default_value=None):
+        if default_value is None:
+            default_value = self.default_value
+        if register_value_map is None:
+            register_value_map = {}
+
+        for wire in self.block.wirevector_set:
+            self.internal_names.make_valid_string(wire.name)
+
+        # set registers to their values, one entry per lane
+        for r in self.block.wirevector_subset(Register):
+            val = register_value_map.get(r, default_value)
+            if isinstance(val, numbers.Integral):
+                self.regs[r.name] = [val] * self.lanes
+            else:
+                vals = list(val)
+                if len(vals) != self.lanes:
+                    raise PyrtlError('initial value for register "%s" needs one entry per lane'
+                                     % r.name)
+                self.regs[r.name] = vals
+
+        self._initialize_mems(memory_value_map)
+        self._inputs = [w.name for w in self.block.wirevector_subset(Input)]
+        self.sim_func = self._load_sim_func()
 
-        # add traced wires to dict
+    def _initialize_mems(self, memory_value_map):
+        super(BatchedFastSimulation, self)._initialize_mems(memory_value_map)
+        # RomBlocks are shared by all of the lanes, memories get a copy each
+        #  (held in dictionaries, rather than DenseMemories, once the copies of
+        #  a memory would add up to more than 2**_dense_addrwidth entries)
+        for mem_name, mem in self.mems.items():
+            if not isinstance(mem, (RomBlock, tuple)):
+                self.mems[mem_name] = [mem.copy() for _ in range(self.lanes)]
+
+    def step(self, provided_inputs):
+        """ Run the simulation for a cycle in every lane
+
+        :param provided_inputs: a dictionary mapping WireVectors (or their names)
+          to a sequence of values for this step, one for each lane
+          eg: {wire: [3, 4], "wire_name": [17, 0]}
+        """
+        ins = {}
+        for wire, values in provided_inputs.items():
+            wire = self.block.get_wirevector_by_name(wire) if isinstance(wire, str) else wire
+            if len(values) != self.lanes:
+                raise PyrtlError('Input "%s" needs one value per lane (%d lanes, %d values)'
+                                 % (wire.name, self.lanes, len(values)))
+            if max(values) > wire.bitmask or min(values) < 0:
+                raise PyrtlError("Wire {} has a value which cannot be represented"
+                                 " using its bitwidth".format(wire))
+            ins[wire.name] = values
+        for name in self._inputs:
+            if name not in ins:
+                raise PyrtlError('Input "%s" has no input value specified' % name)
+
+        # propagate through logic
+        regs, self.outs = self.sim_func(ins, self.regs, self.mems, self.lanes)
+
+        # for tracer compatibility
+        self.context = self.outs.copy()
+        self.context.update(ins)
+        self.context.update(self.regs)  # the old register values
+        self.regs = self.regs.copy()
+        self.regs.update(regs)
+        if self.tracers is not None:
+            for lane, tracer in enumerate(self.tracers):
+                for wire_name, tracelist in tracer._named_columns:
+                    tracelist.append(self.context[wire_name][lane])
+                tracer._steps_added()
+
+        # check the rtl assertions in every lane
+        for (w, exp) in self.block.rtl_assert_dict.items():
+            if w.name in self.context and not all(self.context[w.name]):
+                raise exp
+
+    def run(self, inputs, nsteps=None):
+        """ Not supported: step the lanes of a batch one cycle at a time. """
+        raise PyrtlError('BatchedFastSimulation does not support run')
+
+    def snapshot(self):
+        """ Not supported: the lanes of a batch cannot be captured as one snapshot. """
+        raise PyrtlError('BatchedFastSimulation does not support snapshots')
+
+    def restore(self, snapshot):
+        """ Not supported: the lanes of a batch cannot be captured as one snapshot. """
+        raise PyrtlError('BatchedFastSimulation does not support snapshots')
+
+    def fork(self, snapshot=None):
+        """ Not supported: the lanes of a batch cannot be captured as one snapshot. """
+        raise PyrtlError('BatchedFastSimulation does not support snapshots')
+
+    def _compiled(self):
+        """Return a string of the self.block compiled to a function that runs
+        one cycle of every lane"""
+        regs = [net.dests[0] for net in self.block.logic_subset('r')]
+        self._regnext = {r.name: '_fsb_next%d' % i for i, r in enumerate(regs)}
+        self._mem_writes = []
+        logic = self._compiled_logic()
+
+        reads = list(enumerate(self.block.wirevector_subset((Input, Register))))
+        outputs = list(self.block.wirevector_subset(Output))
         if self.tracer is not None:
-            for wire_name in self.tracer.trace:
-                wire = self.block.wirevector_by_name[wire_name]
-                if not isinstance(wire, (Input, Const, Register, Output)):
-                    v_wire_name = self._varname(wire)
-                    prog.append('    outs["%s"] = %s' % (wire_name, v_wire_name))
+            outputs.extend(
+                w for w in (self.block.wirevector_by_name[n] for n in self.tracer.trace)
+                if not isinstance(w, (Input, Const, Register, Output)))
+        mems = sorted(self.mems)
+
+        prog = ['def sim_func(_fsb_ins, _fsb_regs, _fsb_mems, _fsb_lanes):']
+        for i, w in reads:
+            src = '_fsb_ins' if isinstance(w, Input) else '_fsb_regs'
+            prog.append('    _fsb_in%d = %s[%r]' % (i, src, w.name))
+        for i, r in enumerate(regs):
+            prog.append('    _fsb_reg%d = [0] * _fsb_lanes' % i)
+        for i, w in enumerate(outputs):
+            prog.append('    _fsb_out%d = [0] * _fsb_lanes' % i)
+        for i, m in enumerate(mems):
+            prog.append('    _fsb_mem%d = _fsb_mems[%r]' % (i, m))
+        prog.append('    for _fsb_lane in range(_fsb_lanes):')
+        for i, w in reads:
+            prog.append('        %s = _fsb_in%d[_fsb_lane]' % (self._varname(w), i))
+        for i, m in enumerate(mems):
+            if isinstance(self.mems[m], (RomBlock, tuple)):
+                prog.append('        %s = _fsb_mem%d' % (m, i))
+            else:
+                prog.append('        %s = _fsb_mem%d[_fsb_lane]%s' % (m, i, self._mem_data(m)))
+        prog.extend('        ' + line for line in logic + self._mem_writes)
+        for i, r in enumerate(regs):
+            prog.append('        _fsb_reg%d[_fsb_lane] = %s' % (i, self._regnext[r.name]))
+        for i, w in enumerate(outputs):
+            prog.append('        _fsb_out%d[_fsb_lane] = %s' % (i, self._varname(w)))
+        prog.append('    return ({%s}, {%s})' % (
+            ', '.join('%r: _fsb_reg%d' % (r.name, i) for i, r in enumerate(regs)),
+            ', '.join('%r: _fsb_out%d' % (w.name, i) for i, w in enumerate(outputs))))
+        return '\n'.join(prog)
+
 
-        prog.append("    return regs, outs, mem_ws")
+# ----------------------------------------------------------------
+#    __     ___     __        __   ___  __
+#   |__) |   |     /__` |    |  ` |__  |  \
+#   |__) |   |     .__/ |___ |__, |___ |__/
+#
+
+
+def _pack_planes(values, bitwidth):
+    """ Transpose a sequence of per-lane values into a list of bit-planes.
+
+    Plane n of the result is an integer whose bit i is bit n of values[i].
+    """
+    planes = []
+    for b in range(bitwidth):
+        bits = ''.join('1' if (v >> b) & 1 else '0' for v in reversed(values))
+        planes.append(int(bits, 2) if bits else 0)
+    return planes
+
+
+def _unpack_planes(planes, lanes):
+    """ Transpose a list of bit-planes back into a list of per-lane values. """
+    values = [0] * lanes
+    for b, plane in enumerate(planes):
+        if not plane:
+            continue
+        bits = bin(plane)[2:].zfill(lanes)[::-1]
+        for lane in range(lanes):
+            if bits[lane] == '1':
+                values[lane] |= 1 << b
+    return values
+
+
+def _bitsliced_mem_read(mem, lane_mems, addr_planes, bitwidth, lanes, default_value):
+    """ Read a memory independently in each lane of a bit-sliced simulation. """
+    addrs = _unpack_planes(addr_planes, lanes)
+    if isinstance(mem, RomBlock):
+        vals = [mem._get_read_data(addr) for addr in addrs]
+    else:
+        vals = [lane_mem.get(addr, default_value) for lane_mem, addr in zip(lane_mems, addrs)]
+    return _pack_planes(vals, bitwidth)
+
+
+def _bitsliced_mem_write(lane_mems, addr_planes, data_planes, enable_plane, lanes):
+    """ Write a memory independently in each lane of a bit-sliced simulation. """
+    if not enable_plane:
+        return
+    addrs = _unpack_planes(addr_planes, lanes)
+    datas = _unpack_planes(data_planes, lanes)
+    for lane in range(lanes):
+        if (enable_plane >> lane) & 1:
+            lane_mems[lane][addrs[lane]] = datas[lane]
+
+
+class BitSlicedSimulation(object):
+    """A simulator evaluating many independent test vectors ("lanes") at once,
+    one bit of every lane packed into each Python integer.
+
+    This is intended for gate-level netlists such as those produced by
+    synthesize(), where almost every net is a 1-bit &, |, ^, ~ or register.
+    Each single-bit wire of the block is held as one integer with one bit per
+    lane (a "bit-plane"), so that a single pass over the topologically ordered
+    gates evaluates every lane at once; multi-bit wires are lists of bit-planes.
+    Concats, selects and plain wire assignments only rename bit-planes and so
+    cost nothing at runtime.
+
+    Supported ops are w, ~, &, |, ^, n, c, s, x, =, r and memories (which
+    are accessed one lane at a time and are therefore slow).  The arithmetic
+    and comparison ops should be removed with synthesize() first.
+    """
+
+    _supported_ops = set('w~&|^ncsx=rm@')
+
+    def __init__(
+            self, lanes=64, register_value_map=None, memory_value_map=None,
+            default_value=0, block=None, code_file=None):
+        """ Instantiates a bit-sliced simulation.
+
+        :param lanes: The number of independent test vectors simulated by each step
+        :param register_value_map: Format: {Register: value}, where value is either
+          an int used for every lane or a sequence with one value per lane
+        :param memory_value_map: Format: {Memory: {address: Value}}, where the map
+          for each memory is copied into every lane
+        :param default_value: The value that all unspecified registers and
+          memories will initialize to
+        :param block: the hardware block to be simulated (usually a PostSynthBlock)
+        :param code_file: The file in which to store a copy of the generated
+          python code. Defaults to no code being stored.
+        """
+        block = working_block(block)
+        block.sanity_check()  # check that this is a good hw block
+
+        unsupported = {net.op for net in block.logic} - self._supported_ops
+        if unsupported:
+            raise PyrtlError(
+                'BitSlicedSimulation cannot handle primitives "%s" '
+                '(try calling synthesize() on the block first)' % ''.join(sorted(unsupported)))
+        if lanes < 1:
+            raise PyrtlError('BitSlicedSimulation needs at least one lane')
+
+        self.block = block
+        self.lanes = lanes
+        self.default_value = default_value
+        self.code_file = code_file
+        self._mask = (1 << lanes) - 1
+        self.regs = {}
+        self.mems = {}
+        self._initialize(register_value_map, memory_value_map)
+
+    def _initialize(self, register_value_map, memory_value_map):
+        if register_value_map is None:
+            register_value_map = {}
+        for r in self.block.wirevector_subset(Register):
+            val = register_value_map.get(r, self.default_value)
+            if isinstance(val, numbers.Integral):
+                val = [val] * self.lanes
+            elif len(val) != self.lanes:
+                raise PyrtlError('initial value for register "%s" needs one entry per lane'
+                                 % r.name)
+            self.regs[r.name] = _pack_planes([v & r.bitmask for v in val], r.bitwidth)
+
+        mems = {net.op_param[1] for net in self.block.logic_subset('m@')}
+        if memory_value_map is not None:
+            for (mem, mem_map) in memory_value_map.items():
+                if isinstance(mem, RomBlock):
+                    raise PyrtlError('error, one or more of the memories in the map is a RomBlock')
+                if isinstance(self.block, PostSynthBlock):
+                    mem = self.block.mem_map[mem]  # pylint: disable=maybe-no-member
+                self.mems[mem.id] = [dict(mem_map) for _ in range(self.lanes)]
+        for mem in mems:
+            if mem.id not in self.mems:
+                self.mems[mem.id] = [{} for _ in range(self.lanes)]
+        self._mem_blocks = {mem.id: mem for mem in mems}
+
+        self._inputs = {w.name: w for w in self.block.wirevector_subset(Input)}
+        s = self._compiled()
+        if self.code_file is not None:
+            with open(self.code_file, 'w') as file:
+                file.write(s)
+        context = {'_bitsliced_mem_read': _bitsliced_mem_read,
+                   '_bitsliced_mem_write': _bitsliced_mem_write,
+                   '_bs_memblocks': self._mem_blocks}
+        exec(compile(s, '<string>', 'exec'), context)
+        self.sim_func = context['sim_func']
+
+    def step(self, provided_inputs):
+        """ Run the simulation for a cycle in every lane.
+
+        :param provided_inputs: a dictionary mapping WireVectors (or their names)
+          to a sequence of values for this step, one for each lane
+        """
+        packed = {}
+        for wire, values in provided_inputs.items():
+            wire = self.block.get_wirevector_by_name(wire) if isinstance(wire, str) else wire
+            if len(values) != self.lanes:
+                raise PyrtlError('Input "%s" needs one value per lane (%d lanes, %d values)'
+                                 % (wire.name, self.lanes, len(values)))
+            if max(values) > wire.bitmask or min(values) < 0:
+                raise PyrtlError("Wire {} has a value which cannot be represented"
+                                 " using its bitwidth".format(wire))
+            packed[wire.name] = _pack_planes(values, wire.bitwidth)
+        self.step_packed(packed)
+
+    def step_packed(self, provided_inputs):
+        """ Run the simulation for a cycle in every lane, with inputs already bit-sliced.
+
+        :param provided_inputs: a dictionary mapping WireVectors (or their names)
+          to a list of bit-planes (least significant bit first), where bit i of
+          plane n is bit n of the input for lane i
+        """
+        ins = {}
+        for wire, planes in provided_inputs.items():
+            name = wire.name if isinstance(wire, WireVector) else wire
+            if name not in self._inputs:
+                raise PyrtlError('step provided a value for input for "%s" which is '
+                                 'not a known input ' % name)
+            if len(planes) != self._inputs[name].bitwidth:
+                raise PyrtlError('Input "%s" needs one bit-plane per bit' % name)
+            ins[name] = planes
+        for name in self._inputs:
+            if name not in ins:
+                raise PyrtlError('Input "%s" has no input value specified' % name)
+
+        regs, outs = self.sim_func(ins, self.regs, self.mems, self._mask, self.lanes)
+        self.context = dict(outs)
+        self.context.update(ins)
+        self.context.update(self.regs)  # the old register values
+        self.regs = self.regs.copy()
+        self.regs.update(regs)
+
+        # check the rtl assertions in every lane
+        for (w, exp) in self.block.rtl_assert_dict.items():
+            if w.name in self.context and self.context[w.name][0] != self._mask:
+                raise exp
+
+    def inspect(self, w):
+        """ Get the values of a wirevector in the last simulation cycle.
+
+        :param w: the name of the Input, Output or Register to inspect
+        :return: a list holding the value of w in each lane
+        """
+        return _unpack_planes(self.inspect_packed(w), self.lanes)
+
+    def inspect_packed(self, w):
+        """ Get the bit-planes of a wirevector in the last simulation cycle. """
+        name = w.name if isinstance(w, WireVector) else w
+        try:
+            return self.context[name]
+        except AttributeError:
+            raise PyrtlError("No context available. Please run a simulation step in "
+                             "order to populate values for wires")
+
+    def inspect_mem(self, mem):
+        """ Get the contents of a memory in every lane.
+
+        :return: a list with one {address: value} map per lane
+        """
+        if isinstance(mem, RomBlock):
+            raise PyrtlError("ROM blocks are not stored in the simulation object")
+        if isinstance(self.block, PostSynthBlock) and mem in self.block.mem_map:
+            mem = self.block.mem_map[mem]  # pylint: disable=maybe-no-member
+        return self.mems[mem.id]
+
+    def _compiled(self):
+        """Return a string of the self.block compiled to a bit-sliced function"""
+        prog = ['def sim_func(_bs_ins, _bs_regs, _bs_mems, _bs_mask, _bs_lanes):']
+        planes = {}  # map from wire to a list of expressions, one for each bit
+        uid = [0]
+
+        def new_var(expr):
+            var = '_bs%d' % uid[0]
+            uid[0] += 1
+            prog.append('    %s = %s' % (var, expr))
+            return var
+
+        def arg_planes(wire, width):
+            p = planes[wire][:width]
+            return p + ['0'] * (width - len(p))
+
+        for w in self.block.wirevector_subset(Const):
+            planes[w] = ['_bs_mask' if (w.val >> b) & 1 else '0' for b in range(w.bitwidth)]
+        for w in self.block.wirevector_subset(Input):
+            prog.append('    _bs_i = _bs_ins[%r]' % w.name)
+            planes[w] = [new_var('_bs_i[%d]' % b) for b in range(w.bitwidth)]
+        for w in self.block.wirevector_subset(Register):
+            prog.append('    _bs_i = _bs_regs[%r]' % w.name)
+            planes[w] = [new_var('_bs_i[%d]' % b) for b in range(w.bitwidth)]
+
+        reg_next = {}
+        mem_writes = []
+        for net in self.block:
+            dest = net.dests[0] if net.dests else None
+            width = len(dest) if dest is not None else 0
+            op = net.op
+            if op == 'w':
+                result = arg_planes(net.args[0], width)
+            elif op == 'r':
+                reg_next[dest] = arg_planes(net.args[0], width)
+                continue
+            elif op == 'c':
+                result = [p for a in reversed(net.args) for p in planes[a]][:width]
+            elif op == 's':
+                result = [planes[net.args[0]][b] for b in net.op_param]
+            elif op == '~':
+                result = [new_var('_bs_mask ^ %s' % a) for a in arg_planes(net.args[0], width)]
+            elif op in '&|^':
+                result = [new_var('%s %s %s' % (a, op, b)) for a, b in zip(
+                    arg_planes(net.args[0], width), arg_planes(net.args[1], width))]
+            elif op == 'n':
+                result = [new_var('_bs_mask ^ (%s & %s)' % (a, b)) for a, b in zip(
+                    arg_planes(net.args[0], width), arg_planes(net.args[1], width))]
+            elif op == 'x':
+                sel = planes[net.args[0]][0]
+                result = [new_var('%s ^ ((%s ^ %s) & %s)' % (f, f, t, sel)) for f, t in zip(
+                    arg_planes(net.args[1], width), arg_planes(net.args[2], width))]
+            elif op == '=':
+                argwidth = max(len(net.args[0]), len(net.args[1]))
+                diffs = ' | '.join('(%s ^ %s)' % (a, b) for a, b in zip(
+                    arg_planes(net.args[0], argwidth), arg_planes(net.args[1], argwidth)))
+                result = [new_var('_bs_mask ^ (%s)' % diffs)]
+            elif op == 'm':
+                mem = net.op_param[1]
+                if isinstance(mem, RomBlock):
+                    lane_mems = 'None'
+                else:
+                    lane_mems = '_bs_mems[%d]' % mem.id
+                read = new_var('_bitsliced_mem_read(_bs_memblocks[%d], %s, [%s], %d, '
+                               '_bs_lanes, %d)' % (mem.id, lane_mems,
+                                                   ', '.join(planes[net.args[0]]),
+                                                   mem.bitwidth, self.default_value))
+                result = ['%s[%d]' % (read, b) for b in range(mem.bitwidth)]
+                result = [new_var(r) for r in result[:width]]
+            elif op == '@':
+                mem = net.op_param[1]
+                addr, data, enable = net.args
+                mem_writes.append(
+                    '    _bitsliced_mem_write(_bs_mems[%d], [%s], [%s], %s, _bs_lanes)'
+                    % (mem.id, ', '.join(planes[addr]), ', '.join(planes[data]),
+                       planes[enable][0]))
+                continue
+            else:
+                raise PyrtlInternalError('error, unknown op type')
+            planes[dest] = result + ['0'] * (width - len(result))
+
+        # memory writes only happen after all of the reads of the cycle
+        prog.extend(mem_writes)
+        outs = [w for w in self.block.wirevector_subset(Output)]
+        prog.append('    return ({%s}, {%s})' % (
+            ', '.join('%r: [%s]' % (r.name, ', '.join(p)) for r, p in reg_next.items()),
+            ', '.join('%r: [%s]' % (w.name, ', '.join(planes[w])) for w in outs)))
         return '\n'.join(prog)
 
 
+# ----------------------------------------------------------------
+#          ___        __   __
+#   |\/| |__   |\/| /  \ |__) \ /
+#   |  | |___  |  | \__/ |  \  |
+#
+
+_dense_addrwidth = 22  # memories with wider addresses are held in (sparse) dictionaries
+_rom_table_addrwidth = 16  # larger RomBlocks are not turned into tables
+
+
+class DenseMemory(collections.MutableMapping):
+    """ Dictionary-like contents of a memory, held in a flat array with one entry per address.
+
+    The simulators use this for the memories with an address space of up to
+    2**22 entries, which are then read and written by indexing the array
+    directly.  The array is an array.array of the smallest unsigned type that
+    fits the bitwidth of the memory (and a list above 64 bits), so it costs a
+    few bytes per address rather than the hundred or so of a dictionary entry.
+
+    Like the dictionary it replaces, it only lists the addresses holding
+    something: iterating over it, len and "in" cover the addresses whose
+    value is not the default value (so an address written with the default
+    value is left out).  Reading any other valid address gives the default
+    value rather than a KeyError.
+    """
+
+    def __init__(self, mem, default_value=0, contents=None):
+        self.bitmask = (1 << mem.bitwidth) - 1
+        self.default_value = default_value & self.bitmask
+        size = 1 << mem.addrwidth
+        typecode = _array_typecode(mem.bitwidth)
+        if typecode is None:
+            self._data = [self.default_value] * size
+        else:
+            self._data = array.array(typecode, [self.default_value]) * size
+        if contents is not None:
+            self.update(contents)
+
+    def _check(self, addr):
+        if not 0 <= addr < len(self._data):
+            raise KeyError(addr)
+
+    def __getitem__(self, addr):
+        self._check(addr)
+        return self._data[addr]
+
+    def __setitem__(self, addr, value):
+        self._check(addr)
+        self._data[addr] = value & self.bitmask
+
+    def __delitem__(self, addr):
+        self[addr] = self.default_value
+
+    def __contains__(self, addr):
+        return 0 <= addr < len(self._data) and self._data[addr] != self.default_value
+
+    def __iter__(self):
+        default_value = self.default_value
+        return (addr for addr, val in enumerate(self._data) if val != default_value)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __eq__(self, other):
+        if isinstance(other, DenseMemory):
+            return self._data == other._data
+        try:
+            return all(self[addr] == val for addr, val in other.items()) and \
+                all(other.get(addr, self.default_value) == val for addr, val in self.items())
+        except KeyError:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def copy(self):
+        """ Return a copy of the memory contents. """
+        contents = copy.copy(self)
+        contents._data = self._data[:]
+        return contents
+
+    def nonzero(self):
+        """ Return a dictionary of the addresses holding something other than 0. """
+        return {addr: val for addr, val in enumerate(self._data) if val}
+
+    def __repr__(self):
+        return 'DenseMemory(%r)' % self.nonzero()
+
+
+def _array_typecode(bitwidth):
+    """ The typecode of the smallest unsigned array.array holding bitwidth bits (or None). """
+    for typecode in 'BHILQ':
+        try:
+            if 8 * array.array(typecode).itemsize >= bitwidth:
+                return typecode
+        except ValueError:  # no 'Q' in python 2
+            pass
+    return None
+
+
+def _fits_dense(mem, copies=1):
+    """ Whether copies of the contents of mem fit in DenseMemories together. """
+    return copies << mem.addrwidth <= 1 << _dense_addrwidth
+
+
+def _new_memory(mem, default_value, contents=None, copies=1):
+    """ The contents of mem for a simulation: a DenseMemory, or a dictionary if it is too big.
+
+    copies is the number of copies of the memory the simulation holds (one per
+    lane of a BatchedFastSimulation), which share the budget of a DenseMemory.
+    """
+    if _fits_dense(mem, copies):
+        return DenseMemory(mem, default_value, contents)
+    return {} if contents is None else dict(contents)
+
+
+def _rom_table(rom):
+    """ The contents of rom as a tuple indexed by address, validated once.
+
+    Returns None for RomBlocks with more than 2**_rom_table_addrwidth
+    addresses, and for those holding invalid data at some address (such as
+    data shorter than the address space), which must still raise their error
+    only when that address is read; both are read through _get_read_data.
+    """
+    if rom.addrwidth > _rom_table_addrwidth:
+        return None
+    try:
+        return tuple(rom._get_read_data(addr) for addr in range(1 << rom.addrwidth))
+    except PyrtlError:
+        return None
+
+
+def _memory_dict(contents):
+    """ The contents of a memory as a dictionary, for a snapshot. """
+    if isinstance(contents, DenseMemory):
+        return contents.nonzero()
+    return dict(contents)
+
+
+# ----------------------------------------------------------------
+#     __        __   __   __        __  ___
+#    /__` |\ |  /\  |__) /__` |__| /  \  |
+#    .__/ | \| /~~\ |    .__/ |  | \__/  |
+#
+
+
+class SimulationSnapshot(object):
+    """ The state of a simulation between two steps, as returned by snapshot().
+
+    A snapshot holds the values of the registers and the contents of the
+    (writable) memories, by name, and the position in the trace at which it was
+    taken.  It only holds plain dictionaries and integers, so it can be pickled
+    and restored in another process, or into another kind of simulator, as long
+    as the design is the same.  Rebuilding a design with the same names (rather
+    than reusing the same block) is enough.
+
+    * *.registers*: a map from register name to its value in the next step
+    * *.memories*: a map from memory name to a dictionary of address: value
+    * *.trace_position*: the length of the trace when the snapshot was taken
+      (None if the simulation had no tracer, or its tracer has a capture policy)
+    """
+
+    def __init__(self, registers, memories, trace_position):
+        self.registers = registers
+        self.memories = memories
+        self.trace_position = trace_position
+
+    def _register_values(self, block):
+        """ Return a map from each register of block to its value in the snapshot. """
+        registers = block.wirevector_subset(Register)
+        if set(self.registers) != {r.name for r in registers}:
+            raise PyrtlError('the registers in the snapshot do not match those of the block')
+        return {r: self.registers[r.name] for r in registers}
+
+    def _memory_values(self, block):
+        """ Return a map from each writable memory of block to its contents in the snapshot. """
+        mems = _writable_mems(block)
+        if set(self.memories) != {mem.name for mem in mems}:
+            raise PyrtlError('the memories in the snapshot do not match those of the block')
+        return {mem: self.memories[mem.name] for mem in mems}
+
+    def _restore_trace(self, tracer):
+        """ Drop the steps of the trace that were simulated after the snapshot was taken. """
+        if tracer is not None and self.trace_position is not None:
+            for name in tracer.trace:
+                del tracer.trace[name][self.trace_position:]
+
+
+def _writable_mems(block):
+    """ The memories (but not RomBlocks) used in block. """
+    return {net.op_param[1] for net in block.logic_subset('m@')
+            if not isinstance(net.op_param[1], RomBlock)}
+
+
+def _trace_position(tracer):
+    """ The number of steps in the trace, or None if it cannot be restored to it. """
+    if tracer is None or tracer._capturing:
+        return None
+    return len(tracer)
+
+
+def _copy_tracer(tracer):
+    """ A new SimulationTrace with the same wires and contents as tracer. """
+    if tracer is None:
+        return None
+    duplicate = SimulationTrace(
+        wires_to_track=tracer.wires_to_track, block=tracer.block, compact=tracer.compact,
+        keep_last=tracer.keep_last, every=tracer.every, start_trigger=tracer.start_trigger,
+        stop_trigger=tracer.stop_trigger, pre_trigger=tracer.pre_trigger)
+    for name in tracer.trace:
+        duplicate.trace[name].extend(tracer.trace[name])
+    for attr in ('start_cycle', '_cycles', '_kept', '_front', '_started', '_stopped'):
+        setattr(duplicate, attr, getattr(tracer, attr))
+    return duplicate
+
+
 # ----------------------------------------------------------------
 #    ___  __        __   ___
 #     |  |__)  /\  /  ` |__
@@ -729,10 +1983,21 @@ def _trace_sort_key(w):
 
 
 class TraceStorage(collections.Mapping):
-    __slots__ = ('__data',)
+    __slots__ = ('__data', '_before_read')
 
-    def __init__(self, wvs):
-        self.__data = {wv.name: [] for wv in wvs}
+    def __init__(self, wvs, compact=False):
+        if compact:
+            self.__data = {wv.name: _trace_column(wv.bitwidth) for wv in wvs}
+        else:
+            self.__data = {wv.name: [] for wv in wvs}
+        self._before_read = None  # called before a column is read, to bring it up to date
+
+    @classmethod
+    def _of_columns(cls, columns):
+        """ A TraceStorage holding the given map from wire name to its column of values. """
+        storage = cls(())
+        storage.__data = columns
+        return storage
 
     def __len__(self):
         return len(self.__data)
@@ -747,18 +2012,120 @@ class TraceStorage(collections.Mapping):
                 'Access to trace by WireVector instead of name is deprecated.',
                 DeprecationWarning)
             key = key.name
+        if self._before_read is not None:
+            self._before_read()
         return self.__data[key]
 
 
+def _trace_column(bitwidth):
+    """ An empty array.array for the values of a wire, or a list if it is too wide. """
+    typecode = _array_typecode(bitwidth) if bitwidth is not None else None
+    return [] if typecode is None else array.array(typecode)
+
+
+class _VCDDumper(object):
+    """ Writes the steps of a trace to a file as a value change dump.
+
+    Only the wires whose value changed since the previous step are written, and
+    the output is collected into large writes rather than one per line.
+    """
+
+    _buffered_lines = 4096
+
+    def __init__(self, file, wires, include_clock=False):
+        internal_names = _VerilogSanitizer('_vcd_tmp_')
+        for wire in wires:
+            internal_names.make_valid_string(wire.name)
+        self.file = file
+        self.ids = [internal_names[wire.name] for wire in wires]
+        self.include_clock = include_clock
+        self.last = None
+        self.lines = ['$timescale 1ns $end', '$scope module logic $end']
+        if include_clock:
+            self.lines.append('$var wire 1 clk clk $end')
+        for wire, vn in zip(wires, self.ids):
+            self.lines.append('$var wire %d %s %s $end' % (wire.bitwidth, vn, vn))
+        self.lines.extend(['$upscope $end', '$enddefinitions $end'])
+
+    def step(self, time, values):
+        """ Dump the values (one per wire, in order) of the step at time (in cycles). """
+        lines = self.lines
+        if self.last is None:
+            lines.append('$dumpvars')
+            lines.extend('b{0:b} {1}'.format(v, vn) for v, vn in zip(values, self.ids))
+            lines.append('$end')
+            changes = []
+        else:
+            changes = ['b{0:b} {1}'.format(v, vn)
+                       for v, last, vn in zip(values, self.last, self.ids) if v != last]
+        if changes or self.include_clock:
+            lines.append('#%d' % (time * 10))
+            lines.extend(changes)
+            if self.include_clock:
+                lines.extend(['b1 clk', '', '#%d' % (time * 10 + 5), 'b0 clk'])
+            lines.append('')
+        self.last = values
+        if len(lines) > self._buffered_lines:
+            self.flush()
+
+    def end(self, time):
+        """ Mark the end of the dump at time (in cycles) and flush it. """
+        self.lines.append('#%d' % (time * 10))
+        self.flush()
+        self.file.flush()
+
+    def flush(self):
+        if self.lines:
+            self.file.write('\n'.join(self.lines) + '\n')
+            self.lines = []
+
+
+_trace_chunk_size = 4096  # the most steps added to a trace before its capture policy is applied
+
+
+def _first_nonzero(column, start, end):
+    """ The index of the first nonzero value of column[start:end], or None. """
+    for n in range(start, end):
+        if column[n]:
+            return n
+    return None
+
+
 class SimulationTrace(object):
     """ Storage and presentation of simulation waveforms. """
 
-    def __init__(self, wires_to_track=None, block=None):
+    def __init__(self, wires_to_track=None, block=None, compact=False, keep_last=None,
+                 every=1, start_trigger=None, stop_trigger=None, pre_trigger=0):
         """
         Creates a new Simulation Trace
 
         :param wires_to_track: The wires that the tracer should track
         :param block:
+        :param compact: If True, the values of each wire of up to 64 bits are
+          stored in an array.array of the smallest unsigned type that fits,
+          rather than in a list, which takes 4 to 8 times less memory for long
+          simulations.  Wider wires still use lists.  The columns of the trace
+          support the same operations as lists, but do not compare equal to them.
+        :param keep_last: if not None, only the last keep_last recorded steps are
+          kept, like the ring buffer of a logic analyzer
+        :param every: only every every-th step (cycles 0, every, 2*every...) is
+          recorded; the triggers are only checked on these steps
+        :param start_trigger: a traced wire (or its name); if given, recording
+          starts at the first recorded step in which its value is nonzero
+        :param stop_trigger: a traced wire (or its name); if given, recording
+          stops for good after the first step (once started) in which its value
+          is nonzero
+        :param pre_trigger: the number of recorded steps before the start
+          trigger fires to keep in the trace
+
+        Without any of keep_last, every and the triggers, every step is kept.
+        Otherwise, the trace holds consecutive recorded steps, the first of
+        which was simulated at cycle .start_cycle (counting from 0), so the
+        step at index n of the trace is that of cycle start_cycle + n * every.
+        The simulators apply the policy at least every few thousand steps, also
+        in the middle of a long run, so the memory the trace needs does not grow
+        with the length of the simulation.  Restoring a snapshot does not remove
+        recorded steps from a trace with such a capture policy.
         """
         self.block = working_block(block)
 
@@ -776,8 +2143,43 @@ class SimulationTrace(object):
             raise PyrtlError("There needs to be at least one named wire "
                              "for simulation to be useful")
         self.wires_to_track = wires_to_track
-        self.trace = TraceStorage(wires_to_track)
+        self.compact = compact
+        self.trace = TraceStorage(wires_to_track, compact)
         self._wires = {wv.name: wv for wv in wires_to_track}
+        # the column of each wire, in the order in which add_step fills them
+        self._columns = [(wv, self.trace[wv.name]) for wv in self._wires.values()]
+        self._named_columns = [(wv.name, column) for wv, column in self._columns]
+        self._column_of = dict(self._named_columns)  # the columns, not brought up to date
+
+        if keep_last is not None and keep_last < 1:
+            raise PyrtlError('keep_last must be positive')
+        if every < 1:
+            raise PyrtlError('every must be positive')
+        if pre_trigger < 0:
+            raise PyrtlError('pre_trigger must be non-negative')
+        self.keep_last = keep_last
+        self.every = every
+        self.start_trigger = self._trigger_name(start_trigger)
+        self.stop_trigger = self._trigger_name(stop_trigger)
+        self.pre_trigger = pre_trigger
+        self.start_cycle = 0
+        self._capturing = (keep_last is not None or every > 1 or
+                           start_trigger is not None or stop_trigger is not None)
+        self._cycles = 0  # the number of steps the simulators added
+        self._kept = 0  # the number of steps in the columns the policy was applied to
+        self._front = 0  # the number of steps at the front of the columns already dropped
+        self._started = start_trigger is None
+        self._stopped = False
+        if self._capturing:
+            self.trace._before_read = self._drop_front
+
+    def _trigger_name(self, trigger):
+        if trigger is None:
+            return None
+        name = getattr(trigger, 'name', trigger)
+        if name not in self.trace:
+            raise PyrtlError('trigger wire "%s" must be one of the traced wires' % name)
+        return name
 
     def __len__(self):
         """ Return the current length of the trace in cycles. """
@@ -793,20 +2195,77 @@ class SimulationTrace(object):
             raise PyrtlError('error, simulation trace needs at least 1 signal to track '
                              '(by default, unnamed signals are not traced -- try either passing '
                              'a name to a WireVector or setting a "wirevector_subset" option)')
-        for wire in self.trace:
-            tracelist = self.trace[wire]
-            wirevec = self._wires[wire]
+        for wirevec, tracelist in self._columns:
             tracelist.append(value_map[wirevec])
+        self._steps_added()
 
     def add_step_named(self, value_map):
         for wire in value_map:
-            if wire in self.trace:
-                self.trace[wire].append(value_map[wire])
+            if wire in self._column_of:
+                self._column_of[wire].append(value_map[wire])
+        self._steps_added()
 
     def add_fast_step(self, fastsim):
         """ Add the fastsim context to the trace. """
-        for wire_name in self.trace:
-            self.trace[wire_name].append(fastsim.context[wire_name])
+        context = fastsim.context
+        for wire_name, tracelist in self._named_columns:
+            tracelist.append(context[wire_name])
+        self._steps_added()
+
+    def _steps_added(self):
+        """ Called by the simulators after they append steps to the columns of the trace.
+
+        This applies the capture policy to the steps added since the last call.
+        The steps dropped from the front of the trace (by keep_last and the
+        start trigger) are only counted in _front, and deleted from the columns
+        once they are at least as many as the steps kept, or when the trace is
+        read; so keeping the last steps costs a constant time per step, like a
+        ring buffer, rather than shifting the whole trace every step.
+        """
+        if not self._capturing:
+            return
+        columns = [column for _, column in self._named_columns]
+        kept = self._kept
+        added = len(columns[0]) - kept
+        first = -self._cycles % self.every  # the first added step to record
+        self._cycles += added
+        if self._stopped or self.every > 1:
+            for column in columns:
+                recorded = [] if self._stopped else column[kept + first::self.every]
+                del column[kept:]
+                column.extend(recorded)
+
+        end = len(columns[0])
+        front = self._front  # the number of steps to drop from the front of the trace
+        start = kept  # where to look for the stop trigger
+        if not self._started:
+            fired = _first_nonzero(self._column_of[self.start_trigger], kept, end)
+            if fired is None:
+                front, start = max(front, end - self.pre_trigger), end
+            else:
+                front, start = max(front, fired - self.pre_trigger), fired
+                self._started = True
+        if self.stop_trigger is not None and not self._stopped:
+            fired = _first_nonzero(self._column_of[self.stop_trigger], start, end)
+            if fired is not None:
+                end = fired + 1
+                self._stopped = True
+        if self.keep_last is not None:
+            front = max(front, end - self.keep_last)
+        for column in columns:
+            del column[end:]
+        self.start_cycle += (front - self._front) * self.every
+        self._front, self._kept = front, end
+        if front >= end - front:
+            self._drop_front()
+
+    def _drop_front(self):
+        """ Delete the steps dropped from the front of the trace from its columns. """
+        front = self._front
+        if front:
+            for _, column in self._named_columns:
+                del column[:front]
+            self._front, self._kept = 0, self._kept - front
 
     def print_trace(self, file=sys.stdout, base=10, compact=False):
         """
@@ -843,63 +2302,34 @@ class SimulationTrace(object):
         :param include_clock: boolean specifying if the implicit clk should be included.
 
         Dumps the current trace to file as a "value change dump" file.  The file parameter
-        defaults to _stdout_ and the include_clock defaults to True.
+        defaults to _stdout_ and the include_clock defaults to True.  After the
+        initial values, only the wires whose value changed are dumped at each
+        time.  To write a dump while the simulation runs, without keeping the
+        trace in memory, use a StreamingVCDTrace as the tracer instead.
 
         Examples ::
 
             sim_trace.print_vcd()
             sim_trace.print_vcd("my_waveform.vcd", include_clock=False)
         """
-        # dump header info
-        # file_timestamp = time.strftime("%a, %d %b %Y %H:%M:%S (UTC/GMT)", time.gmtime())
-        # print >>file, " ".join(["$date", file_timestamp, "$end"])
-        self.internal_names = _VerilogSanitizer('_vcd_tmp_')
-        for wire in self.wires_to_track:
-            self.internal_names.make_valid_string(wire.name)
-
-        def _varname(wireName):
-            """ Converts WireVector names to internal names """
-            return self.internal_names[wireName]
-
-        print(' '.join(['$timescale', '1ns', '$end']), file=file)
-        print(' '.join(['$scope', 'module logic', '$end']), file=file)
-
-        def print_trace_strs(time):
-            for wn in sorted(self.trace, key=_trace_sort_key):
-                print(' '.join([str(bin(self.trace[wn][time]))[1:], _varname(wn)]), file=file)
-
-        # dump variables
-        if include_clock:
-            print(' '.join(['$var', 'wire', '1', 'clk', 'clk', '$end']), file=file)
-        for wn in sorted(self.trace, key=_trace_sort_key):
-            print(' '.join(['$var', 'wire', str(self._wires[wn].bitwidth),
-                            _varname(wn), _varname(wn), '$end']), file=file)
-        print(' '.join(['$upscope', '$end']), file=file)
-        print(' '.join(['$enddefinitions', '$end']), file=file)
-        print(' '.join(['$dumpvars']), file=file)
-        print_trace_strs(0)
-        print(' '.join(['$end']), file=file)
-
-        # dump values
-        endtime = max([len(self.trace[w]) for w in self.trace])
-        for timestamp in range(endtime):
-            print(''.join(['#', str(timestamp*10)]), file=file)
-            print_trace_strs(timestamp)
-            if include_clock:
-                print('b1 clk', file=file)
-                print('', file=file)
-                print(''.join(['#', str(timestamp*10+5)]), file=file)
-                print('b0 clk', file=file)
-            print('', file=file)
-        print(''.join(['#', str(endtime*10)]), file=file)
-        file.flush()
+        names = sorted(self.trace, key=_trace_sort_key)
+        dumper = _VCDDumper(file, [self._wires[wn] for wn in names], include_clock)
+        endtime = 0
+        for endtime, values in enumerate(zip(*(self.trace[wn] for wn in names)), 1):
+            dumper.step(endtime - 1, values)
+        dumper.end(endtime)
 
     def render_trace(
             self, trace_list=None, file=sys.stdout, render_cls=default_renderer(),
-            symbol_len=5, segment_size=5, segment_delim=' ', extra_line=True):
+            symbol_len=5, segment_size=5, segment_delim=' ', extra_line=True,
+            start=0, end=None, max_steps=None, collapse=False):
 
         """ Render the trace to a file using unicode and ASCII escape sequences.
 
+        Only the steps in the window from start to end are read from the trace,
+        and the ticks are labeled with the number of the step rendered after
+        them, so that downsampled or collapsed traces can still be followed.
+
         :param trace_list: A list of signals to be output in the specified order.
         :param file: The place to write output, default to stdout.
         :param render_cls: A class that translates traces into output bytes.
@@ -907,6 +2337,12 @@ class SimulationTrace(object):
         :param segment_size: Traces are broken in the segments of this number of cycles.
         :param segment_delim: The character to be output between segments.
         :param extra_line: A Boolean to determin if we should print a blank line between signals.
+        :param start: The first step of the trace to render.
+        :param end: The step of the trace before which to stop rendering (None for the end).
+        :param max_steps: If the window has more steps than this, only every
+          k-th of them is rendered, with k the smallest that fits.
+        :param collapse: If True, steps in which none of the rendered signals
+          change are left out.
 
         The resulting output can be viewed directly on the terminal or looked
         at with "more" or "less -R" which both should handle the ASCII escape
@@ -916,7 +2352,9 @@ class SimulationTrace(object):
         if _currently_in_ipython():
             from IPython.display import display, HTML, Javascript  # pylint: disable=import-error
             from .inputoutput import trace_to_html
-            htmlstring = trace_to_html(self, trace_list=trace_list, sortkey=_trace_sort_key)
+            htmlstring = trace_to_html(self, trace_list=trace_list, sortkey=_trace_sort_key,
+                                       start=start, end=end, max_steps=max_steps,
+                                       collapse=collapse)
             html_elem = HTML(htmlstring)
             display(html_elem)
             # print(htmlstring)
@@ -934,11 +2372,13 @@ class SimulationTrace(object):
             self.render_trace_to_text(
                 trace_list=trace_list, file=file, render_cls=render_cls,
                 symbol_len=symbol_len, segment_size=segment_size,
-                segment_delim=segment_delim, extra_line=extra_line)
+                segment_delim=segment_delim, extra_line=extra_line,
+                start=start, end=end, max_steps=max_steps, collapse=collapse)
 
     def render_trace_to_text(
             self, trace_list, file, render_cls,
-            symbol_len, segment_size, segment_delim, extra_line):
+            symbol_len, segment_size, segment_delim, extra_line,
+            start=0, end=None, max_steps=None, collapse=False):
 
         renderer = render_cls()
 
@@ -965,22 +2405,90 @@ class SimulationTrace(object):
                 DeprecationWarning)
             trace_list = [getattr(x, 'name', x) for x in trace_list]
 
+        steps, window = self._render_window(trace_list, start, end, max_steps, collapse)
+
         # print the 'ruler' which is just a list of 'ticks'
         # mapped by the pretty map
 
         maxnamelen = max(len(w) for w in self.trace)
-        maxtracelen = max(len(v) for v in self.trace.values())
         if segment_size is None:
-            segment_size = maxtracelen
+            segment_size = max(len(steps), 1)
         spaces = ' '*(maxnamelen+1)
-        ticks = [renderer.tick_segment(n, symbol_len, segment_size)
-                 for n in range(0, maxtracelen, segment_size)]
+        ticks = [renderer.tick_segment(steps[n], symbol_len, segment_size)
+                 for n in range(0, len(steps), segment_size)]
         print(spaces + segment_delim.join(ticks), file=file)
 
         # now all the traces
         for w in trace_list:
             if extra_line:
                 print(file=file)
-            print(formatted_trace_line(w, self.trace[w]), file=file)
+            print(formatted_trace_line(w, window[w]), file=file)
         if extra_line:
             print(file=file)
+
+    def _render_window(self, trace_list, start, end, max_steps, collapse):
+        """ The steps of the trace to render and a map from each wire in trace_list to its values.
+
+        Only the steps from start to end are read from the columns of the trace.
+        """
+        start, end, _ = slice(start, end).indices(len(self))
+        end = max(start, end)
+        if max_steps is not None and max_steps < 1:
+            raise PyrtlError('max_steps must be positive')
+        if not collapse:
+            every = 1 if max_steps is None else max(1, -(-(end - start) // max_steps))
+            steps = list(range(start, end, every))
+            return steps, {w: self.trace[w][start:end:every] for w in trace_list}
+        columns = [self.trace[w][start:end] for w in trace_list]
+        rows = list(zip(*columns))
+        keep = [n for n in range(len(rows)) if n == 0 or rows[n] != rows[n - 1]]
+        if max_steps is not None and len(keep) > max_steps:
+            keep = keep[::-(-len(keep) // max_steps)]
+        return ([start + n for n in keep],
+                {w: [column[n] for n in keep] for w, column in zip(trace_list, columns)})
+
+
+class StreamingVCDTrace(SimulationTrace):
+    """ A SimulationTrace that writes a value change dump while the simulation runs.
+
+    It can be the tracer of any of the simulators.  Every step is written to
+    the file as it is added, in the format of print_vcd, and only the last step
+    is kept in the trace (so that the simulators can still inspect it), which
+    makes dumps of millions of cycles possible.  Call close() at the end of the
+    simulation to finish the dump.
+
+    Steps that were written cannot be taken back, so restoring a snapshot of a
+    simulation does not remove them from the dump.
+    """
+
+    def __init__(self, file, wires_to_track=None, block=None, include_clock=False):
+        """
+        Creates a new Simulation Trace writing to a VCD file
+
+        :param file: the (open) file to write the dump to
+        :param wires_to_track: The wires that the tracer should track
+        :param block:
+        :param include_clock: boolean specifying if the implicit clk should be included.
+        """
+        super(StreamingVCDTrace, self).__init__(wires_to_track, block)
+        names = sorted(self.trace, key=_trace_sort_key)
+        self._dump_columns = [self.trace[wn] for wn in names]
+        self._dumper = _VCDDumper(file, [self._wires[wn] for wn in names], include_clock)
+        self._time = 0  # the number of steps written
+        self._written = 0  # the number of steps in the trace that are already written
+
+    def _steps_added(self):
+        columns = self._dump_columns
+        steps = min(len(column) for column in columns)
+        for n in range(min(self._written, steps), steps):
+            self._dumper.step(self._time, [column[n] for column in columns])
+            self._time += 1
+        if steps > 1:
+            for column in columns:
+                del column[:steps - 1]
+        self._written = min(steps, 1)
+
+    def close(self):
+        """ Write out the end of the dump. The file itself is not closed. """
+        self._steps_added()
+        self._dumper.end(self._time)
@@ -0,0 +1,329 @@
+"""
+Binary trace files, for archiving long simulation traces and reading them back quickly.
+
+A trace file holds a header with the names and bitwidths of the traced wires,
+followed by one column of fixed-size little-endian unsigned integers per wire.
+Each column either holds the value of the wire at every step, or (with
+change-only encoding) the steps at which its value changed along with the new
+values, which is much smaller for wires that rarely change.  Values of up to
+64 bits use the smallest of 1, 2, 4 or 8 bytes that fits, and wider values
+are split into 64-bit limbs, least significant first.
+
+Reading a trace file maps it into memory rather than loading it, so only the
+parts of the columns that are actually used are read from disk.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import sys
+import json
+import mmap
+import bisect
+import struct
+import collections
+
+from .pyrtlexceptions import PyrtlError
+from .core import Block
+from .wire import WireVector
+from .simulation import SimulationTrace, TraceStorage, _trace_sort_key
+
+_magic = b'PYRTLTRC'
+_version = 1
+_formats = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}  # item size to struct and memoryview format
+_chunk_size = 1 << 16  # the number of values encoded or decoded at once
+
+
+def _itemsize(bitwidth):
+    """ The number of bytes in which values of bitwidth bits are stored. """
+    for itemsize in (1, 2, 4):
+        if bitwidth <= itemsize * 8:
+            return itemsize
+    return 8
+
+
+def _limbs(bitwidth):
+    """ The number of items each value of bitwidth bits is split into. """
+    return 1 if bitwidth <= 64 else (bitwidth + 63) // 64
+
+
+def _aligned(nbytes):
+    return (nbytes + 7) & ~7
+
+
+def _changes(column):
+    """ The steps at which the values of column change, and the values they change to. """
+    steps, values = [], []
+    last = None
+    for step, value in enumerate(column):
+        if step == 0 or value != last:
+            steps.append(step)
+            values.append(value)
+            last = value
+    return steps, values
+
+
+def _encode(file, values, itemsize, limbs):
+    """ Write the values, in chunks, as items of itemsize bytes, and return the bytes written. """
+    fmt = _formats[itemsize]
+    mask = (1 << 64) - 1
+    written = 0
+    values = iter(values)
+    while True:
+        chunk = []
+        for value in values:
+            if limbs == 1:
+                chunk.append(value)
+            else:
+                chunk.extend((value >> (64 * limb)) & mask for limb in range(limbs))
+            if len(chunk) >= _chunk_size:
+                break
+        if not chunk:
+            break
+        data = struct.pack(str('<%d%s' % (len(chunk), fmt)), *chunk)
+        file.write(data)
+        written += len(data)
+    file.write(b'\0' * (_aligned(written) - written))
+    return _aligned(written)
+
+
+def write_trace(simtrace, file, change_only=False):
+    """ Write a SimulationTrace to a binary trace file.
+
+    :param simtrace: the trace to write (which may itself be a MappedTrace)
+    :param file: the name of the file, or a file open for writing in binary mode
+    :param change_only: if True, only the steps at which the value of each
+      wire changes are stored, rather than its value at every step
+
+    The trace can be read back with read_trace.
+
+    Example ::
+
+        sim = pyrtl.Simulation()
+        ...
+        pyrtl.write_trace(sim.tracer, 'nightly.trace', change_only=True)
+    """
+    if not hasattr(file, 'write'):
+        with open(file, 'wb') as f:
+            return write_trace(simtrace, f, change_only)
+
+    names = sorted(simtrace.trace, key=_trace_sort_key)
+    steps = len(simtrace)
+    index_itemsize = _itemsize(max(steps - 1, 0).bit_length())
+    wires, columns = [], []
+    offset = 0
+    for name in names:
+        bitwidth = simtrace._wires[name].bitwidth
+        itemsize, limbs = _itemsize(bitwidth), _limbs(bitwidth)
+        wire = {'name': name, 'bitwidth': bitwidth, 'itemsize': itemsize, 'limbs': limbs}
+        column = simtrace.trace[name]
+        if len(column) != steps:
+            raise PyrtlError('the columns of the trace must all have the same length')
+        if change_only:
+            indices, column = _changes(column)
+            wire['changes'] = len(indices)
+            wire['index_offset'] = offset
+            offset += _aligned(len(indices) * index_itemsize)
+            columns.append((indices, index_itemsize, 1))
+        wire['offset'] = offset
+        offset += _aligned(len(column) * itemsize * limbs)
+        columns.append((column, itemsize, limbs))
+        wires.append(wire)
+
+    header = json.dumps({
+        'steps': steps,
+        'index_itemsize': index_itemsize,
+        'start_cycle': simtrace.start_cycle,
+        'every': simtrace.every,
+        'wires': wires,
+    }).encode('utf-8')
+    preamble = _magic + struct.pack('<II', _version, len(header)) + header
+    file.write(preamble + b'\0' * (_aligned(len(preamble)) - len(preamble)))
+    for values, itemsize, limbs in columns:
+        _encode(file, values, itemsize, limbs)
+    file.flush()
+
+
+def read_trace(file):
+    """ Open a binary trace file written by write_trace.
+
+    :param file: the name of the file, or a file open for reading in binary mode
+    :return: a MappedTrace of the file
+    """
+    return MappedTrace(file)
+
+
+class _PackedItems(object):
+    """ The little-endian items of a format in part of a buffer, decoded as they are used.
+
+    This stands in for a memoryview cast to the format, which python 2 lacks,
+    supporting just what _MappedColumn needs: len, indexing, slicing (without
+    a step) and tolist.
+    """
+
+    def __init__(self, buf, offset, fmt, count):
+        self._buf = buf
+        self._offset = offset
+        self._fmt = fmt
+        self._count = count
+        self._itemsize = struct.calcsize(str('<' + fmt))
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(self._count)
+            return _PackedItems(self._buf, self._offset + start * self._itemsize, self._fmt,
+                                max(stop - start, 0))
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('index out of range')
+        return struct.unpack_from(str('<' + self._fmt), self._buf,
+                                  self._offset + index * self._itemsize)[0]
+
+    def tolist(self):
+        return list(struct.unpack_from(str('<%d%s' % (self._count, self._fmt)), self._buf,
+                                       self._offset))
+
+
+class _MappedColumn(collections.Sequence):
+    """ The values of one wire in a trace file, read from the mapped file as they are used. """
+
+    def __init__(self, length, values, limbs, indices=None):
+        self._length = length
+        self._values = values
+        self._limbs = limbs
+        self._indices = indices  # the steps at which the values change, if change-only
+
+    def __len__(self):
+        return self._length
+
+    def _decode(self, start, stop):
+        """ The list of the stored values from start to stop. """
+        limbs = self._limbs
+        if limbs == 1:
+            return self._values[start:stop].tolist()
+        items = self._values[start * limbs:stop * limbs].tolist()
+        return [sum(item << (64 * limb) for limb, item in enumerate(items[n:n + limbs]))
+                for n in range(0, len(items), limbs)]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step == 1 and self._indices is None:
+                return self._decode(start, max(start, stop))
+            return [self[n] for n in range(start, stop, step)]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('trace index out of range')
+        if self._indices is not None:
+            index = bisect.bisect_right(self._indices, index) - 1
+        return self._decode(index, index + 1)[0]
+
+    def __iter__(self):
+        if self._indices is None:
+            for start in range(0, self._length, _chunk_size):
+                for value in self._decode(start, min(start + _chunk_size, self._length)):
+                    yield value
+        else:
+            indices = self._indices
+            changes = len(indices)
+            for start in range(0, changes, _chunk_size):
+                stop = min(start + _chunk_size, changes)
+                for n, value in enumerate(self._decode(start, stop), start):
+                    end = indices[n + 1] if n + 1 < changes else self._length
+                    for _ in range(end - indices[n]):
+                        yield value
+
+    def __repr__(self):
+        return 'MappedColumn(%d steps)' % self._length
+
+
+class MappedTrace(SimulationTrace):
+    """ A SimulationTrace read from a binary trace file, without loading the file.
+
+    The file is mapped into memory, and the columns of .trace are sequences
+    that only read the values they are asked for, so the trace can be much
+    larger than the memory available.  Indexing, slicing and iterating over
+    them all work as for lists.  The trace can be printed, rendered and dumped
+    to a VCD file like any other, but steps cannot be added to it.  Call close()
+    when done to unmap the file.
+    """
+
+    def __init__(self, file):
+        """
+        Opens a binary trace file
+
+        :param file: the name of the file, or a file open for reading in binary mode
+        """
+        if sys.byteorder != 'little':
+            raise PyrtlError('trace files can only be mapped on little-endian machines')
+        if hasattr(file, 'fileno'):
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            with open(file, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        preamble = len(_magic) + 8
+        if len(self._mmap) < preamble or self._mmap[:len(_magic)] != _magic:
+            self._mmap.close()
+            raise PyrtlError('not a pyrtl trace file')
+        version, header_len = struct.unpack('<II', self._mmap[len(_magic):preamble])
+        if version != _version:
+            self._mmap.close()
+            raise PyrtlError('unsupported trace file version %d' % version)
+        header = json.loads(self._mmap[preamble:preamble + header_len].decode('utf-8'))
+
+        block = Block()
+        wires = [WireVector(bitwidth=wire['bitwidth'], name=wire['name'], block=block)
+                 for wire in header['wires']]
+        super(MappedTrace, self).__init__(wires, block)
+        self.start_cycle = header['start_cycle']
+        self.every = header['every']
+
+        data = _aligned(preamble + header_len)
+        steps = header['steps']
+        self._views = []
+
+        def view(offset, itemsize, count):
+            start = data + offset
+            if not hasattr(memoryview, 'cast'):  # python 2
+                return _PackedItems(self._mmap, start, _formats[itemsize], count)
+            mapped = memoryview(self._mmap)[start:start + itemsize * count]
+            self._views.append(mapped)
+            values = mapped.cast(_formats[itemsize])
+            self._views.append(values)
+            return values
+
+        columns = {}
+        for wire in header['wires']:
+            limbs = wire['limbs']
+            if 'changes' in wire:
+                changes = wire['changes']
+                indices = view(wire['index_offset'], header['index_itemsize'], changes)
+                values = view(wire['offset'], wire['itemsize'], changes * limbs)
+                columns[wire['name']] = _MappedColumn(steps, values, limbs, indices)
+            else:
+                values = view(wire['offset'], wire['itemsize'], steps * limbs)
+                columns[wire['name']] = _MappedColumn(steps, values, limbs)
+        self.trace = TraceStorage._of_columns(columns)
+        self._columns = self._named_columns = []
+        self._column_of = {}
+
+    def add_step(self, value_map):
+        raise PyrtlError('a MappedTrace is read-only')
+
+    def add_step_named(self, value_map):
+        raise PyrtlError('a MappedTrace is read-only')
+
+    def add_fast_step(self, fastsim):
+        raise PyrtlError('a MappedTrace is read-only')
+
+    def close(self):
+        """ Unmap the file.  The trace cannot be used afterwards. """
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
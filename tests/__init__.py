@@ -0,0 +1,19 @@
+import shutil
+import tempfile
+
+import pyrtl
+
+_saved_cache_dir = []
+
+
+def setup_package():
+    """ Fill the simulation caches in a temporary directory rather than the user's cache. """
+    if not _saved_cache_dir:
+        _saved_cache_dir.append(pyrtl.simcache.get_cache_dir())
+        pyrtl.simcache.set_cache_dir(tempfile.mkdtemp(prefix='pyrtl-test-cache-'))
+
+
+def teardown_package():
+    if _saved_cache_dir:
+        shutil.rmtree(pyrtl.simcache.get_cache_dir(), ignore_errors=True)
+        pyrtl.simcache.set_cache_dir(_saved_cache_dir.pop())
@@ -0,0 +1,11 @@
+import pytest
+
+from tests import setup_package, teardown_package
+
+
+@pytest.fixture(scope='session', autouse=True)
+def simulation_cache_dir():
+    """ The nose package fixtures of tests, for test runs under pytest. """
+    setup_package()
+    yield
+    teardown_package()
@@ -1,5 +1,9 @@
 import unittest
 import six
+import pickle
+import os
+import shutil
+import tempfile
 
 import pyrtl
 from pyrtl.corecircuits import _basic_add
@@ -338,9 +342,6 @@ $enddefinitions $end
 $dumpvars
 b0 o
 $end
-#0
-b0 o
-
 #10
 b1 o
 
@@ -400,6 +401,34 @@ b110 o
         sim_trace.print_vcd(test_output)
         self.assertEqual(self.VCD_OUTPUT, test_output.getvalue())
 
+    def test_streaming_vcd_output(self):
+        test_output = six.StringIO()
+        sim_trace = pyrtl.StreamingVCDTrace(test_output, [self.o])
+        sim = self.sim(tracer=sim_trace)
+        sim.run([{}] * 10)
+        sim.run([{}] * 5)
+        self.assertEqual(sim.inspect(self.o), 6)
+        self.assertEqual(len(sim_trace), 1)  # only the last step is kept
+        sim_trace.close()
+        self.assertEqual(self.VCD_OUTPUT, test_output.getvalue())
+
+    def test_vcd_only_dumps_changes(self):
+        a = pyrtl.Input(4, 'a')
+        o2 = pyrtl.Output(4, 'o2')
+        o2 <<= a
+        sim_trace = pyrtl.SimulationTrace([a, self.o])
+        sim = self.sim(tracer=sim_trace)
+        sim.run([{a: value} for value in (2, 2, 2, 5)])
+        test_output = six.StringIO()
+        sim_trace.print_vcd(test_output, include_clock=True)
+        self.assertEqual(test_output.getvalue().split('$enddefinitions $end\n')[1], (
+            '$dumpvars\nb10 a\nb0 o\n$end\n'
+            '#0\nb1 clk\n\n#5\nb0 clk\n\n'
+            '#10\nb1 o\nb1 clk\n\n#15\nb0 clk\n\n'
+            '#20\nb10 o\nb1 clk\n\n#25\nb0 clk\n\n'
+            '#30\nb101 a\nb11 o\nb1 clk\n\n#35\nb0 clk\n\n'
+            '#40\n'))
+
 
 class SimTraceWithMuxBase(unittest.TestCase):
     def setUp(self):
@@ -729,6 +758,389 @@ class InspectBase(unittest.TestCase):
         sim.step({a: 3, b: 23})
         self.assertEqual(sim.inspect_mem(mem), {23: 3})
 
+    def inspect_counter(self, steps, **policy):
+        r = pyrtl.Register(8, 'r')
+        r.next <<= r + 1
+        hit, half = pyrtl.WireVector(1, 'hit'), pyrtl.WireVector(1, 'half')
+        hit <<= r == 100
+        half <<= r == 50
+        sim = self.sim(tracer=pyrtl.SimulationTrace([r, hit, half], **policy))
+        sim.run([{}] * (steps - 1))
+        sim.step({})
+        return sim.inspect(r)
+
+    def test_inspect_every(self):
+        self.assertEqual(self.inspect_counter(70, every=4), 69)
+
+    def test_inspect_keep_last(self):
+        self.assertEqual(self.inspect_counter(70, keep_last=3), 69)
+
+    def test_inspect_after_stop_trigger(self):
+        self.assertEqual(self.inspect_counter(70, stop_trigger='half'), 69)
+
+    def test_inspect_before_start_trigger(self):
+        self.assertEqual(self.inspect_counter(10, start_trigger='hit'), 9)
+
+    def test_inspect_before_any_step(self):
+        a = pyrtl.Input(8, 'a')
+        o = pyrtl.Output(8, 'o')
+        o <<= a
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.sim().inspect(o)
+
+
+class TraceInternalWiresBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(8, 'a')
+        self.r = pyrtl.Register(70, 'r')
+        self.sum = pyrtl.WireVector(70, 'sum')
+        self.unused = pyrtl.WireVector(8, 'unused')
+        self.sum <<= self.r + self.a
+        self.r.next <<= self.sum
+        self.unused <<= ~self.a
+        o = pyrtl.Output(8, 'o')
+        o <<= self.sum[:8]
+
+    def run_both(self, wires):
+        traces = []
+        for sim_class in (pyrtl.Simulation, self.sim):
+            sim = sim_class(tracer=pyrtl.SimulationTrace(wires))
+            for a in [200] * 5 + [3]:
+                sim.step({'a': a})
+            traces.append(sim.tracer.trace)
+        return sim, traces
+
+    def test_internal_wires_match_simulation(self):
+        wires = [self.a, self.r, self.sum]
+        sim, (ref, trace) = self.run_both(wires)
+        for w in wires:
+            self.assertEqual(trace[w.name], ref[w.name])
+        self.assertEqual(sim.inspect(self.sum), ref['sum'][-1])
+        self.assertEqual(sim.inspect('r'), ref['r'][-1])
+
+    def test_only_traced_wires_are_copied_out(self):
+        sim, _ = self.run_both([self.sum])
+        self.assertEqual(set(sim._outputpos), {'o', 'sum'})
+        with self.assertRaises(pyrtl.PyrtlError):
+            sim.inspect(self.unused)
+
+
+class LongRunCaptureBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(1, 'a')
+        self.r = pyrtl.Register(16, 'r')
+        self.r.next <<= self.r + self.a
+        self.steps = 5 * pyrtl.simulation._trace_chunk_size
+
+    def sim_recording(self):
+        """ A simulation keeping the last 10 steps, and the steps held after each update. """
+        tracer = pyrtl.SimulationTrace([self.r], keep_last=10)
+        self.held = []
+        steps_added = tracer._steps_added
+
+        def record():
+            steps_added()
+            self.held.append(len(tracer._column_of['r']))
+        tracer._steps_added = record
+        return self.sim(tracer=tracer)
+
+    def check_bounded(self, sim, steps):
+        self.assertGreater(len(self.held), 1)  # applied in the middle of the run
+        self.assertLessEqual(max(self.held), 20 + pyrtl.simulation._trace_chunk_size)
+        self.assertEqual(sim.tracer.trace['r'], list(range(steps - 10, steps)))
+        self.assertEqual(sim.inspect('r'), steps - 1)
+
+    def test_run(self):
+        sim = self.sim_recording()
+        sim.run([{'a': 1}] * self.steps)
+        self.check_bounded(sim, self.steps)
+
+    def test_run_until(self):
+        sim = self.sim_recording()
+        self.assertEqual(sim.run_until(self.r, self.steps - 1, 2 * self.steps, {'a': 1}),
+                         self.steps)
+        self.check_bounded(sim, self.steps)
+
+    def test_run_until_stops_at_end_of_chunk(self):
+        sim = self.sim_recording()
+        chunk = pyrtl.simulation._trace_chunk_size
+        self.assertEqual(sim.run_until(self.r, chunk - 1, self.steps, {'a': 1}), chunk)
+        self.assertEqual(sim.inspect('r'), chunk - 1)
+
+    def test_run_columns(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest('columnar inputs require numpy')
+        sim = self.sim_recording()
+        sim.run({'a': numpy.ones(self.steps, dtype=numpy.uint64)})
+        self.check_bounded(sim, self.steps)
+
+
+class RunUntilBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.inc = pyrtl.Input(4, 'inc')
+        self.count = count = pyrtl.Register(100, 'count')
+        count.next <<= count + self.inc
+        self.done = pyrtl.Output(1, 'done')
+        # 1 << 70 is a long on python 2, which as_wires does not take
+        self.done <<= count == pyrtl.concat(pyrtl.Const(1, 30), pyrtl.Const(0, 70))
+        self.total = pyrtl.WireVector(100, 'total')
+        self.total <<= count + 1
+
+    def test_stops_at_condition(self):
+        sim = self.sim(register_value_map={self.count: (1 << 70) - 20})
+        self.assertEqual(sim.run_until(self.done, 1, 1000, {'inc': 4}), 6)
+        ref = pyrtl.Simulation(register_value_map={self.count: (1 << 70) - 20})
+        for _ in range(6):
+            ref.step({'inc': 4})
+        self.assertEqual(sim.tracer.trace['count'], ref.tracer.trace['count'])
+        self.assertEqual(sim.tracer.trace['inc'], [4] * 6)
+        self.assertEqual(sim.inspect(self.done), 1)
+
+    def test_stops_on_traced_wire(self):
+        sim = self.sim(tracer=pyrtl.SimulationTrace([self.total]))
+        self.assertEqual(sim.run_until('total', 10, 1000, {'inc': 3}), 4)
+        self.assertEqual(sim.tracer.trace['total'], [1, 4, 7, 10])
+
+    def test_max_cycles(self):
+        sim = self.sim(tracer=None)
+        self.assertEqual(sim.run_until(self.done, 1, 50, {'inc': 1}), 50)
+        self.assertEqual(sim.run_until(self.done, 0, 50, {'inc': 1}), 1)
+
+    def test_invalid_condition(self):
+        sim = self.sim(tracer=pyrtl.SimulationTrace([self.inc]))
+        with self.assertRaises(pyrtl.PyrtlError):
+            sim.run_until('total', 1, 10, {'inc': 1})
+        with self.assertRaises(pyrtl.PyrtlError):
+            sim.run_until(self.done, 2, 10, {'inc': 1})
+
+
+class RunStreamBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(8, 'a')
+        self.r = r = pyrtl.Register(80, 'r')
+        r.next <<= r + self.a
+        mem = pyrtl.MemBlock(80, 2, 'mem', asynchronous=True)
+        mem[self.a[:2]] <<= r
+        o, o2 = pyrtl.Output(80, 'o'), pyrtl.Output(80, 'o2')
+        o <<= r
+        o2 <<= mem[(self.a[:2] + 1)[:2]]
+        self.inputs = [{'a': (7 * n) % 256} for n in range(25)]
+        self.ref = pyrtl.Simulation()
+        for inmap in self.inputs:
+            self.ref.step(inmap)
+
+    def chunks(self):
+        for n in range(0, 25, 10):
+            yield self.inputs[n:n+10]
+
+    def test_chunks_match_simulation(self):
+        sim = self.sim()
+        outs = list(sim.run_stream(self.chunks(), chunk_size=4))
+        self.assertEqual([len(out['o']) for out in outs], [10, 10, 5])
+        for name in ('o', 'o2'):
+            self.assertEqual([v for out in outs for v in out[name]], self.ref.tracer.trace[name])
+        self.assertEqual(sim.tracer.trace['r'], self.ref.tracer.trace['r'])
+
+    def test_callback_sink(self):
+        received = []
+        sim = self.sim(tracer=pyrtl.SimulationTrace([self.r, self.a]))
+        for _ in sim.run_stream(self.chunks(), chunk_size=8, trace_sink=received.append):
+            pass
+        self.assertEqual([len(values['r']) for values in received], [8, 2, 8, 2, 5])
+        self.assertEqual([v for values in received for v in values['r']],
+                         self.ref.tracer.trace['r'])
+        self.assertEqual(sim.tracer.trace['r'], [])
+
+    def test_file_sink(self):
+        sink = six.StringIO()
+        sim = self.sim(tracer=pyrtl.SimulationTrace([self.r, self.a]))
+        for _ in sim.run_stream(self.chunks(), trace_sink=sink):
+            pass
+        lines = sink.getvalue().splitlines()
+        self.assertEqual(lines[0], 'a r')
+        self.assertEqual(len(lines), 26)
+        self.assertEqual(lines[-1], '{} {}'.format(
+            self.ref.tracer.trace['a'][-1], self.ref.tracer.trace['r'][-1]))
+
+    def test_capture_policy(self):
+        hit = pyrtl.WireVector(1, 'hit')
+        hit <<= self.a == 7 * 12
+        tracer = pyrtl.SimulationTrace([self.r, hit], start_trigger=hit, pre_trigger=3)
+        sim = self.sim(tracer=tracer)
+        for _ in sim.run_stream(self.chunks(), chunk_size=4):
+            pass
+        self.assertEqual(tracer.trace['r'], self.ref.tracer.trace['r'][9:])
+        self.assertEqual(tracer.trace['hit'], [0, 0, 0, 1] + [0] * 12)
+        self.assertEqual(tracer.start_cycle, 9)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.sim().run_stream(self.chunks(), chunk_size=0)
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.sim(tracer=None).run_stream(self.chunks(), trace_sink=lambda values: None)
+
+
+class SharedLibraryBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(8, 'a')
+        self.r = pyrtl.Register(8, 'r')
+        self.r.next <<= self.r + self.a
+        self.mem = pyrtl.MemBlock(8, 2, 'mem', asynchronous=True)
+        self.mem[self.a[:2]] <<= self.r
+        o = pyrtl.Output(8, 'o')
+        o <<= self.r
+
+    def test_instances_share_library_not_state(self):
+        sims = [self.sim() for _ in range(3)]
+        self.assertEqual(len({id(sim._dll) for sim in sims}), 1)
+        for n, sim in enumerate(sims):
+            sim.run([{'a': n + 1}] * 3)
+        self.assertEqual([sim.inspect('o') for sim in sims], [2, 4, 6])
+        self.assertEqual([sim.inspect_mem(self.mem)[1] for sim in sims], [2, 0, 0])
+        self.assertEqual([sim.inspect_mem(self.mem)[2] for sim in sims], [0, 4, 0])
+
+    def test_run_batch(self):
+        inputs = [[{'a': (n * k) % 256} for k in range(100)] for n in range(6)]
+        sims = [self.sim() for _ in inputs]
+        self.assertEqual(self.sim.run_batch(sims, inputs, jobs=3), [None] * 6)
+        for sim, steps in zip(sims, inputs):
+            ref = pyrtl.Simulation()
+            for step in steps:
+                ref.step(step)
+            self.assertEqual(sim.tracer.trace['o'], ref.tracer.trace['o'])
+            self.assertEqual(sim.inspect_mem(self.mem), ref.inspect_mem(self.mem))
+
+    def test_run_batch_errors(self):
+        sim = self.sim()
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.sim.run_batch([sim], [])
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.sim.run_batch([sim, sim], [[], []])
+
+
+class RtlAssertBase(unittest.TestCase):
+
+    class RTLSampleException(Exception):
+        pass
+
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(8, 'a')
+        count = pyrtl.Register(8, 'count')
+        count.next <<= count + 1
+        self.small = pyrtl.rtl_assert(self.a < 100, self.RTLSampleException('a too big'))
+        self.early = pyrtl.rtl_assert(count < 5, self.RTLSampleException('too late'))
+
+    def test_run_stops_at_failing_step(self):
+        sim = self.sim()
+        inputs = [{'a': 1}, {'a': 2}, {'a': 200}, {'a': 3}]
+        with self.assertRaises(self.RTLSampleException) as cm:
+            sim.run(inputs)
+        self.assertEqual(str(cm.exception), 'a too big')
+        self.assertEqual(sim.failed_assertion, (2, self.small))
+        self.assertEqual(sim.tracer.trace['a'], [1, 2, 200])
+        self.assertEqual(sim.tracer.trace['count'], [0, 1, 2])
+
+    def test_step_and_run_until(self):
+        sim = self.sim()
+        sim.step({'a': 1})
+        self.assertEqual(sim.failed_assertion, None)
+        with self.assertRaises(self.RTLSampleException) as cm:
+            sim.run_until('count', 100, 50, {'a': 1})
+        self.assertEqual(str(cm.exception), 'too late')
+        self.assertEqual(sim.failed_assertion, (5, self.early))
+        self.assertEqual(len(sim.tracer.trace['count']), 6)
+
+    def test_passing_assertions(self):
+        sim = self.sim()
+        sim.run([{'a': 99}] * 5)
+        self.assertEqual(sim.failed_assertion, None)
+        self.assertEqual(sim.inspect(self.small), 1)
+
+
+class SnapshotBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(8, 'a')
+        self.r = pyrtl.Register(70, 'r')
+        self.r.next <<= self.r + self.a
+        self.mem = pyrtl.MemBlock(8, 2, 'mem', asynchronous=True)
+        self.mem[self.a[:2]] <<= self.r[:8]
+        o = pyrtl.Output(8, 'o')
+        o <<= self.mem[self.a[2:4]]
+
+    def warm_up(self, sim):
+        for n in range(6):
+            sim.step({'a': 37 * n % 256})
+
+    def check_continues_like(self, sim, ref):
+        for n in range(6):
+            sim.step({'a': 53 * n % 256})
+            ref.step({'a': 53 * n % 256})
+        for name in ('a', 'r', 'o'):
+            self.assertEqual(sim.tracer.trace[name], ref.tracer.trace[name])
+
+    def test_restore(self):
+        sim = self.sim()
+        self.warm_up(sim)
+        snapshot = sim.snapshot()
+        self.assertEqual(snapshot.trace_position, 6)
+        sim.step({'a': 255})
+        sim.step({'a': 254})
+        sim.restore(snapshot)
+        self.assertEqual(len(sim.tracer), 6)
+        ref = self.sim()
+        self.warm_up(ref)
+        self.check_continues_like(sim, ref)
+
+    def test_fork_is_independent(self):
+        sim = self.sim()
+        self.warm_up(sim)
+        fork = sim.fork()
+        fork.step({'a': 255})
+        self.assertEqual(len(sim.tracer), 6)
+        self.assertEqual(len(fork.tracer), 7)
+        ref = self.sim()
+        self.warm_up(ref)
+        self.check_continues_like(sim, ref)
+
+    def test_pickled_snapshot_in_new_simulation(self):
+        sim = self.sim()
+        self.warm_up(sim)
+        snapshot = pickle.loads(pickle.dumps(sim.snapshot()))
+        new = self.sim(tracer=None)
+        new.restore(snapshot)
+        new.step({'a': 1})
+        sim.step({'a': 1})
+        self.assertEqual(new.inspect_mem(self.mem), sim.inspect_mem(self.mem))
+
+    def test_mismatched_design(self):
+        snapshot = self.sim().snapshot()
+        r2 = pyrtl.Register(8, 'r2')
+        r2.next <<= r2
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.sim().restore(snapshot)
+
+    def test_snapshot_from_simulation(self):
+        ref = pyrtl.Simulation()
+        self.warm_up(ref)
+        sim = self.sim()
+        self.warm_up(sim)
+        self.assertEqual(sim.snapshot().registers, ref.snapshot().registers)
+        sim = self.sim()
+        sim.restore(ref.snapshot())
+        self.assertEqual(sim.inspect_mem(self.mem), ref.inspect_mem(self.mem))
+        sim.step({'a': 9})
+        ref.step({'a': 9})
+        self.assertEqual(sim.inspect('r'), ref.inspect('r'))
+
 
 class TraceErrorBase(unittest.TestCase):
     def setUp(self):
@@ -750,6 +1162,212 @@ class TraceErrorBase(unittest.TestCase):
             self.sim_trace.print_trace(base=4)
 
 
+class CompileCacheBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.old_cache_dir = pyrtl.simcache.get_cache_dir()
+        self.cache_dir = tempfile.mkdtemp()
+        pyrtl.simcache.set_cache_dir(self.cache_dir)
+        a = pyrtl.Input(8, 'a')
+        r = pyrtl.Register(8, 'r')
+        o = pyrtl.Output(8, 'o')
+        r.next <<= r + a
+        o <<= r
+
+    def tearDown(self):
+        pyrtl.simcache.set_cache_dir(self.old_cache_dir)
+        pyrtl.simcache.set_cache_size_limit(1 << 30)
+        shutil.rmtree(self.cache_dir)
+
+    def cached_libs(self):
+        return os.listdir(os.path.join(self.cache_dir, 'compilesim'))
+
+    def test_same_design_reuses_library(self):
+        sim1 = self.sim()
+        self.assertEqual(len(self.cached_libs()), 1)
+        sim2 = self.sim()
+        self.assertEqual(len(self.cached_libs()), 1)
+        sim1.step({'a': 3})
+        sim2.step({'a': 5})
+        sim2.step({'a': 5})
+        # the simulations share the cached library but not its state
+        self.assertEqual(sim1.inspect('o'), 0)
+        self.assertEqual(sim2.inspect('o'), 5)
+        sim1.step({'a': 3})
+        self.assertEqual(sim1.inspect('o'), 3)
+
+    def test_changed_design_adds_library(self):
+        self.sim()
+        o2 = pyrtl.Output(8, 'o2')
+        o2 <<= pyrtl.Const(3)
+        self.sim()
+        self.assertEqual(len(self.cached_libs()), 2)
+
+    def test_initial_values_reuse_library(self):
+        mem = pyrtl.MemBlock(8, 2, name='mem')
+        m = pyrtl.Output(8, 'm')
+        m <<= mem[pyrtl.Const(1, 2)]
+        r = pyrtl.working_block().wirevector_by_name['r']
+        sims = [self.sim(register_value_map={r: seed}, memory_value_map={mem: {1: 2 * seed}})
+                for seed in range(4)]
+        self.assertEqual(len(self.cached_libs()), 1)
+        for seed, sim in enumerate(sims):
+            sim.step({'a': 1})
+            self.assertEqual(sim.inspect('o'), seed)
+            self.assertEqual(sim.inspect('m'), 2 * seed)
+            self.assertEqual(sim.inspect_mem(mem)[1], 2 * seed)
+        sim = self.sim(default_value=7)
+        sim.step({'a': 1})
+        self.assertEqual(sim.inspect('o'), 7)
+        self.assertEqual(len(self.cached_libs()), 1)
+
+    def test_key_independent_of_host_name(self):
+        node = pyrtl.compilesim.platform.node
+        self.addCleanup(setattr, pyrtl.compilesim.platform, 'node', node)
+        pyrtl.compilesim._compiler_id = None
+        version = pyrtl.compilesim._compiler_version()
+        pyrtl.compilesim.platform.node = lambda: 'another-host'
+        pyrtl.compilesim._compiler_id = None
+        self.assertEqual(pyrtl.compilesim._compiler_version(), version)
+
+    def test_eviction(self):
+        self.sim()
+        pyrtl.simcache.set_cache_size_limit(0)
+        o2 = pyrtl.Output(8, 'o2')
+        o2 <<= pyrtl.Const(3)
+        sim = self.sim()
+        self.assertEqual(self.cached_libs(), [])
+        sim.step({'a': 1})
+        self.assertEqual(sim.inspect('o2'), 3)
+
+    def test_stale_temporary_files_removed(self):
+        self.sim()
+        path = os.path.join(self.cache_dir, 'compilesim')
+        for name, age in (('.tmpstale', 2 * 3600), ('.tmpfresh', 0)):
+            with open(os.path.join(path, name), 'wb') as f:
+                f.write(b'partial')
+            mtime = os.path.getmtime(os.path.join(path, name)) - age
+            os.utime(os.path.join(path, name), (mtime, mtime))
+        pyrtl.simcache.FileCache('compilesim').evict()
+        self.assertNotIn('.tmpstale', self.cached_libs())
+        self.assertIn('.tmpfresh', self.cached_libs())
+        self.assertEqual(len(self.cached_libs()), 2)
+
+
+class OptimizationLevelBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        a, b = pyrtl.Input(70, 'a'), pyrtl.Input(70, 'b')
+        r = pyrtl.Register(140, 'r')
+        r.next <<= pyrtl.select(a < b, a * b, r[0:70] - b)
+        o = pyrtl.Output(140, 'o')
+        o <<= r ^ pyrtl.concat(a, b)
+
+    def check_against_simulation(self, **kwargs):
+        inputs = [{'a': (n * 0x123456789ABCDEF1234) % (1 << 70),
+                   'b': (n * 0xFEDCBA987654321) % (1 << 70)} for n in range(20)]
+        sim = self.sim(**kwargs)
+        sim.run(inputs)
+        ref = pyrtl.Simulation()
+        for step in inputs:
+            ref.step(step)
+        self.assertEqual(sim.tracer.trace['o'], ref.tracer.trace['o'])
+
+    def test_optimization_levels(self):
+        for level in (0, 1, 2, 3, 's'):
+            self.check_against_simulation(optimization_level=level)
+
+    def test_split_logic_functions(self):
+        self.check_against_simulation(max_function_size=1)
+        self.check_against_simulation(optimization_level=2, max_function_size=5)
+
+    def test_parallel_translation_units(self):
+        old_cache_dir = pyrtl.simcache.get_cache_dir()
+        pyrtl.simcache.set_cache_dir(None)  # make sure it is really compiled
+        try:
+            self.check_against_simulation(max_function_size=5, compile_jobs=3)
+            sim = self.sim(max_function_size=5, compile_jobs=3)
+            objects = [f for f in os.listdir(sim._dir) if f.endswith('.o')]
+            self.assertEqual(len(objects), 4)  # the state and three units of logic
+        finally:
+            pyrtl.simcache.set_cache_dir(old_cache_dir)
+
+    def test_invalid_options(self):
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.sim(optimization_level=4)
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.sim(max_function_size=0)
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.sim(compile_jobs=0)
+
+
+class ColumnarRunBase(unittest.TestCase):
+    def setUp(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest('columnar inputs require numpy')
+        self.numpy = numpy
+        pyrtl.reset_working_block()
+        a, b = pyrtl.Input(8, 'a'), pyrtl.Input(100, 'b')
+        r = pyrtl.Register(8, 'r')
+        r.next <<= r + a
+        o, o2 = pyrtl.Output(8, 'o'), pyrtl.Output(100, 'o2')
+        o <<= r
+        o2 <<= b ^ 5
+
+    def test_columns_match_step_inputs(self):
+        a_col = self.numpy.arange(10, dtype=self.numpy.uint8)
+        b_col = [1 << 99, 3] * 5
+        sim = self.sim()
+        res = sim.run({'a': a_col, 'b': b_col})
+        ref = pyrtl.Simulation()
+        for a, b in zip(a_col, b_col):
+            ref.step({'a': int(a), 'b': b})
+        self.assertEqual(list(res['o']), ref.tracer.trace['o'])
+        self.assertEqual(list(res['o2']), ref.tracer.trace['o2'])
+        self.assertEqual(sim.tracer.trace['o'], ref.tracer.trace['o'])
+        self.assertEqual(sim.tracer.trace['a'], ref.tracer.trace['a'])
+
+    def test_columns_into_compact_trace(self):
+        tracer = pyrtl.SimulationTrace(
+            [pyrtl.working_block().get_wirevector_by_name(n) for n in ('a', 'o', 'o2')],
+            compact=True)
+        sim = self.sim(tracer=tracer)
+        sim.run({'a': [1, 2, 3], 'b': [1 << 99, 0, 0]})
+        sim.run([{'a': 4, 'b': 0}])
+        self.assertEqual(list(tracer.trace['o']), [0, 1, 3, 6])
+        self.assertEqual(tracer.trace['o'].itemsize, 1)
+        self.assertEqual(tracer.trace['o2'], [(1 << 99) ^ 5, 5, 5, 5])
+
+    def test_replay_vcd(self):
+        ref = pyrtl.Simulation()
+        ref.run({'a': [3, 3, 9, 1, 0, 0, 0, 200], 'b': [1 << 99, 3, 3, 3, 0, 0, 1, 1]})
+        vcd = six.StringIO()
+        ref.tracer.print_vcd(vcd)
+        sim = self.sim()
+        self.assertEqual(pyrtl.replay_vcd(sim, vcd.getvalue(), chunk_size=3), 8)
+        self.assertEqual(sim.tracer.trace['o'], ref.tracer.trace['o'])
+        self.assertEqual(sim.tracer.trace['o2'], ref.tracer.trace['o2'])
+
+    def test_columns_without_tracer(self):
+        sim = self.sim(tracer=None)
+        res = sim.run({'a': [1, 2, 3], 'b': [0, 0, 0]})
+        self.assertEqual(list(res['o']), [0, 1, 3])
+        self.assertEqual(res['o'].dtype, self.numpy.uint64)
+
+    def test_column_validation(self):
+        sim = self.sim()
+        with self.assertRaises(pyrtl.PyrtlError):
+            sim.run({'a': [1, 256], 'b': [0, 0]})
+        with self.assertRaises(pyrtl.PyrtlError):
+            sim.run({'a': [1, -1], 'b': [0, 0]})
+        with self.assertRaises(pyrtl.PyrtlError):
+            sim.run({'a': [1, 2, 3], 'b': [0, 0]})
+        with self.assertRaises(pyrtl.PyrtlError):
+            sim.run({'nonexistent': [1]})
+
+
 def make_unittests():
     """
     Generates separate unittests for each of the simulators
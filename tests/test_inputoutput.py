@@ -254,5 +254,75 @@ class TestOutputIPynb(unittest.TestCase):
         htmlstring = inputoutput.trace_to_html(sim_trace) # tests if it compiles or not
 
 
+class TestVcdInput(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        a, b = pyrtl.Input(8, 'a'), pyrtl.Input(1, 'b')
+        r = pyrtl.Register(8, 'r')
+        r.next <<= r + a + b
+        self.inputs = {'a': [random.randrange(256) for _ in range(30)],
+                       'b': [random.randrange(2) for _ in range(30)]}
+        self.inputs['a'][10:20] = [7] * 10  # a stretch without changes
+        sim = pyrtl.Simulation()
+        sim.run(self.inputs)
+        self.sim_trace = sim.tracer
+
+    def columns(self, vcd, **options):
+        result = {'a': [], 'b': []}
+        for chunk in pyrtl.vcd_input_columns(vcd, **options):
+            self.assertLessEqual(len(chunk['a']), options.get('chunk_size', 1 << 16))
+            for name, values in chunk.items():
+                result[name].extend(values)
+        return result
+
+    def test_round_trip(self):
+        vcd = io.StringIO()
+        self.sim_trace.print_vcd(vcd)
+        self.assertEqual(self.columns(vcd.getvalue(), chunk_size=7), self.inputs)
+
+    def test_round_trip_with_clock(self):
+        vcd = io.StringIO()
+        self.sim_trace.print_vcd(vcd, include_clock=True)
+        vcd.seek(0)
+        self.assertEqual(self.columns(vcd, clock='clk', chunk_size=4), self.inputs)
+
+    def test_foreign_vcd(self):
+        vcd = """$date today $end
+$timescale 1ps $end
+$scope module top $end
+$scope module dut $end
+$var reg 8 % a [7:0] $end
+$var wire 1 & b $end
+$var wire 1 ' other $end
+$upscope $end
+$upscope $end
+$enddefinitions $end
+$comment initial values $end
+$dumpvars
+bx1 %
+z&
+1'
+$end
+#4
+1&
+#12
+b11 %
+0'
+#20
+"""
+        self.assertEqual(self.columns(vcd, period=4), {'a': [1, 1, 1, 3, 3],
+                                                       'b': [0, 1, 1, 1, 1]})
+
+    def test_errors(self):
+        with self.assertRaises(pyrtl.PyrtlError):
+            list(pyrtl.vcd_input_columns('$var wire 8 ! a $end\n$enddefinitions $end\n'))
+        with self.assertRaises(pyrtl.PyrtlError):
+            list(pyrtl.vcd_input_columns('$var wire 8 ! a $end\n$var wire 1 " b $end\n'
+                                         '$enddefinitions $end\n#10\n#5\n'))
+        with self.assertRaises(pyrtl.PyrtlError):
+            list(pyrtl.vcd_input_columns('$var wire 9 ! a $end\n$var wire 1 " b $end\n'
+                                         '$enddefinitions $end\nb111111111 !\n#10\n'))
+
+
 if __name__ == "__main__":
     unittest.main()
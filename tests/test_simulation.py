@@ -1,5 +1,9 @@
 import unittest
 import six
+import pickle
+import os
+import shutil
+import tempfile
 
 import pyrtl
 from pyrtl.corecircuits import _basic_add
@@ -330,6 +334,195 @@ class TraceWithAdderBase(unittest.TestCase):
         self.assertEqual(sim.inspect(self.r), 6)
 
 
+class RenderWindowBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.r = pyrtl.Register(3, 'r')
+        self.r.next <<= self.r + 1
+        self.slow = pyrtl.Output(1, 'slow')
+        self.slow <<= self.r[2]
+        self.sim_trace = pyrtl.SimulationTrace([self.r, self.slow])
+        sim = self.sim(tracer=self.sim_trace)
+        for _ in range(15):
+            sim.step({})
+
+    def render(self, sim_trace, **window):
+        output = six.StringIO()
+        sim_trace.render_trace(file=output, render_cls=pyrtl.simulation.AsciiWaveRenderer,
+                               **window)
+        return output.getvalue().splitlines()
+
+    def expected(self, steps, **options):
+        """ The rendering of a trace of just the given steps, without the ruler. """
+        sim_trace = pyrtl.SimulationTrace([self.r, self.slow])
+        for step in steps:
+            sim_trace.add_step_named({name: values[step]
+                                      for name, values in self.sim_trace.trace.items()})
+        return self.render(sim_trace, **options)[1:]
+
+    def test_window(self):
+        lines = self.render(self.sim_trace, start=10, end=14)
+        self.assertEqual(lines[0], ' ' * 5 + '-10'.ljust(25))
+        self.assertEqual(lines[1:], self.expected(range(10, 14)))
+        self.assertEqual(self.render(self.sim_trace, start=-3)[1:], self.expected([12, 13, 14]))
+
+    def test_downsample(self):
+        lines = self.render(self.sim_trace, max_steps=5)
+        self.assertEqual(lines[1:], self.expected([0, 3, 6, 9, 12]))
+        lines = self.render(self.sim_trace, max_steps=4, segment_size=2)
+        self.assertEqual(lines[0], ' ' * 5 + '-0'.ljust(10) + ' ' + '-8'.ljust(10))
+
+    def test_collapse(self):
+        lines = self.render(self.sim_trace, trace_list=['slow'], collapse=True, segment_size=2)
+        self.assertEqual(lines[0], ' ' * 5 + '-0'.ljust(10) + ' ' + '-8'.ljust(10))
+        self.assertEqual(lines[1:], self.expected([0, 4, 8, 12], trace_list=['slow'],
+                                                  segment_size=2))
+        html = pyrtl.trace_to_html(self.sim_trace, trace_list=['slow'], start=2, collapse=True)
+        self.assertIn('wave: "====", data: ["0", "1", "0", "1"]', html)
+
+    def test_invalid_window(self):
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.render(self.sim_trace, max_steps=0)
+
+
+class CompactTraceBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(8, 'a')
+        self.r = pyrtl.Register(8, 'r')
+        self.r.next <<= self.r + self.a
+        self.wide = pyrtl.Output(100, 'wide')
+        self.wide <<= pyrtl.concat(self.r, pyrtl.Const(0, 92)) | self.a
+
+    def run_sim(self, compact):
+        tracer = pyrtl.SimulationTrace([self.a, self.r, self.wide], compact=compact)
+        sim = self.sim(tracer=tracer)
+        for a in (1, 7, 255, 3):
+            sim.step({'a': a})
+        return sim
+
+    def test_compact_trace_matches_lists(self):
+        sim = self.run_sim(compact=True)
+        ref = self.run_sim(compact=False).tracer.trace
+        trace = sim.tracer.trace
+        self.assertEqual({name: list(values) for name, values in trace.items()}, dict(ref))
+        self.assertEqual(len(sim.tracer), 4)
+        self.assertEqual(trace['a'].itemsize, 1)
+        self.assertIsInstance(trace['wide'], list)
+        output = six.StringIO()
+        sim.tracer.print_trace(output)
+        ref_output = six.StringIO()
+        self.run_sim(compact=False).tracer.print_trace(ref_output)
+        self.assertEqual(output.getvalue(), ref_output.getvalue())
+
+    def test_compact_trace_snapshot_and_fork(self):
+        sim = self.run_sim(compact=True)
+        snapshot = sim.snapshot()
+        sim.step({'a': 9})
+        other = sim.fork(snapshot)
+        self.assertTrue(other.tracer.compact)
+        self.assertEqual(list(other.tracer.trace['r']), [0, 1, 8, 7])
+        sim.restore(snapshot)
+        self.assertEqual(list(sim.tracer.trace['a']), [1, 7, 255, 3])
+
+
+class TraceCaptureBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.r = pyrtl.Register(8, 'r')
+        self.r.next <<= self.r + 1
+        self.hit = pyrtl.WireVector(1, 'hit')
+        self.hit <<= self.r == 5
+
+    def run_sim(self, steps=10, **capture):
+        tracer = pyrtl.SimulationTrace([self.r, self.hit], **capture)
+        sim = self.sim(tracer=tracer)
+        for _ in range(steps):
+            sim.step({})
+        return sim
+
+    def test_keep_last(self):
+        tracer = self.run_sim(keep_last=3).tracer
+        self.assertEqual(tracer.trace['r'], [7, 8, 9])
+        self.assertEqual(tracer.start_cycle, 7)
+
+    def test_keep_last_bounded(self):
+        tracer = pyrtl.SimulationTrace([self.r, self.hit], keep_last=4)
+        sim = self.sim(tracer=tracer)
+        for cycle in range(40):
+            sim.step({})
+            # the dropped steps are deleted in bulk, but never seen
+            self.assertLessEqual(len(tracer._column_of['r']), 8)
+            if cycle % 7 == 0:
+                first = max(cycle - 3, 0)
+                self.assertEqual(tracer.trace['r'], list(range(first, cycle + 1)))
+                self.assertEqual(tracer.start_cycle, first)
+        self.assertEqual(len(tracer), 4)
+        self.assertEqual(tracer.trace['r'], [36, 37, 38, 39])
+        self.assertEqual(tracer.start_cycle, 36)
+
+    def test_keep_last_bounded_during_run(self):
+        tracer = pyrtl.SimulationTrace([self.r, self.hit], keep_last=10)
+        held = []
+        steps_added = tracer._steps_added
+
+        def record():
+            steps_added()
+            held.append(len(tracer._column_of['r']))
+        tracer._steps_added = record
+        sim = self.sim(tracer=tracer)
+        steps = 5 * pyrtl.simulation._trace_chunk_size
+        sim.run({}, nsteps=steps)
+        self.assertGreater(len(held), 1)  # applied in the middle of the run
+        self.assertLessEqual(max(held), 20 + pyrtl.simulation._trace_chunk_size)
+        self.assertEqual(list(tracer.trace['r']), [n % 256 for n in range(steps - 10, steps)])
+        self.assertEqual(tracer.start_cycle, steps - 10)
+
+    def test_every(self):
+        tracer = self.run_sim(every=3).tracer
+        self.assertEqual(tracer.trace['r'], [0, 3, 6, 9])
+        self.assertEqual(tracer.start_cycle, 0)
+
+    def test_start_trigger(self):
+        tracer = self.run_sim(steps=8, start_trigger=self.hit, pre_trigger=2).tracer
+        self.assertEqual(tracer.trace['r'], [3, 4, 5, 6, 7])
+        self.assertEqual(tracer.start_cycle, 3)
+
+    def test_start_trigger_not_fired(self):
+        tracer = self.run_sim(steps=4, start_trigger='hit', pre_trigger=2).tracer
+        self.assertEqual(tracer.trace['r'], [2, 3])
+        self.assertEqual(tracer.start_cycle, 2)
+
+    def test_stop_trigger(self):
+        tracer = self.run_sim(stop_trigger=self.hit, keep_last=2).tracer
+        self.assertEqual(tracer.trace['r'], [4, 5])
+        self.assertEqual(tracer.trace['hit'], [0, 1])
+        self.assertEqual(tracer.start_cycle, 4)
+
+    def test_triggers_with_every(self):
+        tracer = self.run_sim(steps=20, every=2, start_trigger=self.hit,
+                              stop_trigger=self.hit, pre_trigger=1).tracer
+        # cycle 5 is not recorded, so the triggers never fire
+        self.assertEqual(tracer.trace['r'], [18])
+        self.assertEqual(tracer.start_cycle, 18)
+
+    def test_fork_keeps_policy(self):
+        sim = self.run_sim(steps=4, keep_last=2)
+        other = sim.fork()
+        other.step({})
+        self.assertEqual(other.tracer.trace['r'], [3, 4])
+        self.assertEqual(other.tracer.start_cycle, 3)
+        self.assertEqual(sim.tracer.trace['r'], [2, 3])
+
+    def test_invalid_policy(self):
+        with self.assertRaises(pyrtl.PyrtlError):
+            pyrtl.SimulationTrace([self.r], start_trigger=self.hit)
+        with self.assertRaises(pyrtl.PyrtlError):
+            pyrtl.SimulationTrace([self.r], keep_last=0)
+        with self.assertRaises(pyrtl.PyrtlError):
+            pyrtl.SimulationTrace([self.r], every=0)
+
+
 class SimulationVCDWithAdderBase(unittest.TestCase):
     def setUp(self):
         pyrtl.reset_working_block()
@@ -346,9 +539,6 @@ $enddefinitions $end
 $dumpvars
 b0 r
 $end
-#0
-b0 r
-
 #10
 b1 r
 
@@ -408,6 +598,35 @@ b110 r
         sim_trace.print_vcd(test_output)
         self.assertEqual(self.VCD_OUTPUT, test_output.getvalue())
 
+    def test_streaming_vcd_output(self):
+        test_output = six.StringIO()
+        sim_trace = pyrtl.StreamingVCDTrace(test_output)
+        sim = self.sim(tracer=sim_trace)
+        for i in range(15):
+            sim.step({})
+        self.assertEqual(sim.inspect(self.r), 6)
+        self.assertEqual(len(sim_trace), 1)  # only the last step is kept
+        sim_trace.close()
+        self.assertEqual(self.VCD_OUTPUT, test_output.getvalue())
+
+    def test_vcd_only_dumps_changes(self):
+        a = pyrtl.Input(4, 'a')
+        o = pyrtl.Output(4, 'o')
+        o <<= a
+        sim_trace = pyrtl.SimulationTrace([a, self.r])
+        sim = self.sim(tracer=sim_trace)
+        for value in (2, 2, 2, 5):
+            sim.step({a: value})
+        test_output = six.StringIO()
+        sim_trace.print_vcd(test_output, include_clock=True)
+        self.assertEqual(test_output.getvalue().split('$enddefinitions $end\n')[1], (
+            '$dumpvars\nb10 a\nb0 r\n$end\n'
+            '#0\nb1 clk\n\n#5\nb0 clk\n\n'
+            '#10\nb1 r\nb1 clk\n\n#15\nb0 clk\n\n'
+            '#20\nb10 r\nb1 clk\n\n#25\nb0 clk\n\n'
+            '#30\nb101 a\nb11 r\nb1 clk\n\n#35\nb0 clk\n\n'
+            '#40\n'))
+
 
 class SimTraceWithMuxBase(unittest.TestCase):
     def setUp(self):
@@ -566,6 +785,83 @@ class MemBlockBase(unittest.TestCase):
                                             'o3 000000\n')
 
 
+class DenseMemoryBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+
+    def build(self, bitwidth, addrwidth):
+        addr = pyrtl.Input(addrwidth, 'addr')
+        data = pyrtl.Input(bitwidth, 'data')
+        we = pyrtl.Input(1, 'we')
+        mem = pyrtl.MemBlock(bitwidth, addrwidth, 'mem', asynchronous=True)
+        mem[addr] <<= pyrtl.MemBlock.EnabledWrite(data, we)
+        out = pyrtl.Output(bitwidth, 'out')
+        out <<= mem[addr]
+        return mem
+
+    def write_and_read(self, sim, addr, data):
+        sim.step({'addr': addr, 'data': data, 'we': 1})
+        sim.step({'addr': addr, 'data': 0, 'we': 0})
+        return sim.inspect('out')
+
+    def test_large_memory_held_in_array(self):
+        mem = self.build(16, 20)
+        sim = self.sim(memory_value_map={mem: {5: 7}}, default_value=3)
+        contents = sim.inspect_mem(mem)
+        self.assertIsInstance(contents, pyrtl.simulation.DenseMemory)
+        self.assertEqual(contents[5], 7)
+        self.assertEqual(contents[6], 3)
+        self.assertEqual(self.write_and_read(sim, (1 << 20) - 1, 0xbeef), 0xbeef)
+        contents[9] = 11  # changes the state of the simulation
+        sim.step({'addr': 9, 'data': 0, 'we': 0})
+        self.assertEqual(sim.inspect('out'), 11)
+
+    def test_dense_memory_lists_only_values_held(self):
+        mem = self.build(16, 20)
+        sim = self.sim(memory_value_map={mem: {5: 7}}, default_value=3)
+        self.write_and_read(sim, 8, 3)  # writing the default value leaves it out
+        self.write_and_read(sim, 12, 0)
+        contents = sim.inspect_mem(mem)
+        # like the dictionary of a larger memory, not every address of the array
+        self.assertEqual(len(contents), 2)
+        self.assertEqual(dict(contents.items()), {5: 7, 12: 0})
+        self.assertIn(5, contents)
+        self.assertNotIn(6, contents)
+        self.assertEqual(contents, {5: 7, 8: 3, 12: 0})
+        del contents[5]
+        self.assertEqual(list(contents), [12])
+
+    def test_memory_value_map_copied_into_dense_memory(self):
+        mem = self.build(8, 4)
+        initial = {2: 5}
+        sim = self.sim(memory_value_map={mem: initial})
+        self.write_and_read(sim, 2, 9)
+        self.assertEqual(initial, {2: 5})
+        self.assertEqual(sim.inspect_mem(mem), {2: 9})
+
+    def test_wide_memory_held_in_list(self):
+        mem = self.build(100, 4)
+        sim = self.sim()
+        self.assertEqual(self.write_and_read(sim, 3, (1 << 99) + 1), (1 << 99) + 1)
+        self.assertEqual(sim.inspect_mem(mem), {3: (1 << 99) + 1})
+
+    def test_huge_memory_held_in_dict(self):
+        mem = self.build(8, 40)
+        sim = self.sim()
+        self.assertEqual(self.write_and_read(sim, (1 << 40) - 1, 200), 200)
+        self.assertEqual(sim.inspect_mem(mem), {(1 << 40) - 1: 200})
+
+    def test_comparison_with_dict(self):
+        mem = self.build(8, 3)
+        sim = self.sim()
+        self.write_and_read(sim, 2, 9)
+        self.assertEqual(sim.inspect_mem(mem), {2: 9})
+        self.assertEqual(sim.inspect_mem(mem), {2: 9, 3: 0})
+        self.assertNotEqual(sim.inspect_mem(mem), {2: 8})
+        self.assertNotEqual(sim.inspect_mem(mem), {2: 9, 8: 1})
+        self.assertEqual(sim.snapshot().memories, {'mem': {2: 9}})
+
+
 class RegisterDefaultsBase(unittest.TestCase):
     def setUp(self):
         pyrtl.reset_working_block()
@@ -698,6 +994,50 @@ class RomBlockSimBase(unittest.TestCase):
         with self.assertRaises(pyrtl.PyrtlError):
             sim.step({rom_add_1: 7})
 
+    def test_rom_read_from_table(self):
+        calls = []
+
+        def rom_data_function(add):
+            calls.append(add)
+            return (add * 7) % 16
+        rom = pyrtl.RomBlock(bitwidth=4, addrwidth=4, romdata=rom_data_function)
+        addr = pyrtl.Input(4, 'addr')
+        out = pyrtl.Output(4, 'out')
+        out <<= rom[addr]
+        sim = self.sim()
+        built = len(calls)
+        for a in range(16):
+            sim.step({addr: a})
+            self.assertEqual(sim.inspect('out'), (a * 7) % 16)
+        self.assertEqual(len(calls), built)  # the table was read instead
+
+    def test_rom_table_shared_by_read_ports(self):
+        calls = []
+
+        def rom_data_function(add):
+            calls.append(add)
+            return (add * 3) % 16
+        rom = pyrtl.RomBlock(bitwidth=4, addrwidth=4, romdata=rom_data_function,
+                             asynchronous=True)
+        addr = pyrtl.Input(4, 'addr')
+        out1, out2 = pyrtl.Output(4, 'out1'), pyrtl.Output(4, 'out2')
+        out1 <<= rom[addr]
+        out2 <<= rom[~addr]
+        sim = self.sim()
+        self.assertEqual(len(calls), 16)  # one table, for both read ports
+        sim.step({addr: 5})
+        self.assertEqual((sim.inspect('out1'), sim.inspect('out2')), (15, 14))
+        self.assertEqual(len(calls), 16)
+
+    def test_large_rom_read_from_data(self):
+        rom = pyrtl.RomBlock(bitwidth=8, addrwidth=24, romdata=lambda add: add % 256)
+        addr = pyrtl.Input(24, 'addr')
+        out = pyrtl.Output(8, 'out')
+        out <<= rom[addr]
+        sim = self.sim()
+        sim.step({addr: 0xabcdef})
+        self.assertEqual(sim.inspect('out'), 0xef)
+
     def test_rom_val_map(self):
         def rom_data_function(add):
             return int((add + 5) / 2)
@@ -782,6 +1122,435 @@ class TraceErrorBase(unittest.TestCase):
             self.sim_trace.print_trace(base=4)
 
 
+class SnapshotBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(8, 'a')
+        self.r = pyrtl.Register(70, 'r')
+        self.r.next <<= self.r + self.a
+        self.mem = pyrtl.MemBlock(8, 2, 'mem', asynchronous=True)
+        self.mem[self.a[:2]] <<= self.r[:8]
+        o = pyrtl.Output(8, 'o')
+        o <<= self.mem[self.a[2:4]]
+
+    def warm_up(self, sim):
+        for n in range(6):
+            sim.step({'a': 37 * n % 256})
+
+    def check_continues_like(self, sim, ref):
+        for n in range(6):
+            sim.step({'a': 53 * n % 256})
+            ref.step({'a': 53 * n % 256})
+        for name in ('a', 'r', 'o'):
+            self.assertEqual(sim.tracer.trace[name], ref.tracer.trace[name])
+
+    def test_restore(self):
+        sim = self.sim()
+        self.warm_up(sim)
+        snapshot = sim.snapshot()
+        self.assertEqual(snapshot.trace_position, 6)
+        sim.step({'a': 255})
+        sim.step({'a': 254})
+        sim.restore(snapshot)
+        self.assertEqual(len(sim.tracer), 6)
+        ref = self.sim()
+        self.warm_up(ref)
+        self.check_continues_like(sim, ref)
+
+    def test_fork_is_independent(self):
+        sim = self.sim()
+        self.warm_up(sim)
+        fork = sim.fork()
+        fork.step({'a': 255})
+        self.assertEqual(len(sim.tracer), 6)
+        self.assertEqual(len(fork.tracer), 7)
+        ref = self.sim()
+        self.warm_up(ref)
+        self.check_continues_like(sim, ref)
+
+    def test_pickled_snapshot_in_new_simulation(self):
+        sim = self.sim()
+        self.warm_up(sim)
+        snapshot = pickle.loads(pickle.dumps(sim.snapshot()))
+        new = self.sim(tracer=None)
+        new.restore(snapshot)
+        new.step({'a': 1})
+        sim.step({'a': 1})
+        self.assertEqual(new.inspect_mem(self.mem), sim.inspect_mem(self.mem))
+
+    def test_mismatched_design(self):
+        snapshot = self.sim().snapshot()
+        r2 = pyrtl.Register(8, 'r2')
+        r2.next <<= r2
+        with self.assertRaises(pyrtl.PyrtlError):
+            self.sim().restore(snapshot)
+
+
+class EventDrivenSimulationBase(unittest.TestCase):
+    """
+    Checks the event driven mode of Simulation against each simulator
+    """
+
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.en, self.addr = pyrtl.Input(1, 'en'), pyrtl.Input(3, 'addr')
+        count = pyrtl.Register(8, 'count')
+        with pyrtl.conditional_assignment:
+            with self.en:
+                count.next |= count + 1
+        self.mem = pyrtl.MemBlock(8, 3, 'mem', asynchronous=True)
+        self.mem[self.addr] <<= count
+        rom = pyrtl.RomBlock(8, 3, [n * 7 for n in range(8)], asynchronous=True)
+        o = pyrtl.Output(8, 'o')
+        o <<= self.mem[self.addr] ^ rom[count[:3]]
+        idle = pyrtl.Output(10, 'idle')
+        idle <<= (self.addr * 5) + 3
+
+    def stimulus(self):
+        for n in range(40):
+            yield {'en': int(n % 10 == 0), 'addr': n // 8 % 8}
+
+    def test_matches_simulator(self):
+        event = pyrtl.Simulation(event_driven=True)
+        sim = self.sim()
+        for inputs in self.stimulus():
+            event.step(inputs)
+            sim.step(inputs)
+        for name in ('count', 'o', 'idle'):
+            self.assertEqual(event.tracer.trace[name], sim.tracer.trace[name])
+        self.assertEqual(event.inspect_mem(self.mem), sim.inspect_mem(self.mem))
+
+    def test_evaluates_fewer_nets(self):
+        executed = []
+        event = pyrtl.Simulation(event_driven=True)
+        event._plan = tuple((lambda f: lambda value, memvalue: executed.append(f) or
+                             f(value, memvalue))(f) for f in event._plan)
+        for inputs in self.stimulus():
+            event.step(inputs)
+        self.assertLess(len(executed), 40 * len(pyrtl.working_block().logic) // 2)
+
+    def test_restore_reevaluates(self):
+        event = pyrtl.Simulation(event_driven=True)
+        for inputs in self.stimulus():
+            event.step(inputs)
+        snapshot = event.snapshot()
+        sim = self.sim()
+        sim.restore(snapshot)
+        event = pyrtl.Simulation(event_driven=True)
+        event.restore(snapshot)
+        event.step({'en': 0, 'addr': 0})
+        sim.step({'en': 0, 'addr': 0})
+        self.assertEqual(event.inspect('o'), sim.inspect('o'))
+
+
+class FastSimulationRunBase(unittest.TestCase):
+    """
+    Checks FastSimulation.run against stepping a simulator cycle by cycle
+    """
+
+    class RTLSampleException(Exception):
+        pass
+
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(8, 'a')
+        self.we = pyrtl.Input(1, 'we')
+        self.r = pyrtl.Register(8, 'r')
+        self.r.next <<= self.r + self.a
+        self.mem = pyrtl.MemBlock(8, 3, 'mem')
+        self.mem[self.a[0:3]] <<= pyrtl.MemBlock.EnabledWrite(self.r, self.we)
+        rom = pyrtl.RomBlock(4, 2, [1, 2, 3, 4])
+        o = pyrtl.Output(8, 'o')
+        o <<= self.mem[self.a[0:3]] ^ self.r
+        o2 = pyrtl.Output(4, 'o2')
+        o2 <<= rom[self.a[0:2]]
+        internal = pyrtl.WireVector(8, 'internal')
+        internal <<= self.r & self.a
+        self.inputs = {'a': [(cycle * 37 + 11) % 256 for cycle in range(20)],
+                       'we': [cycle % 2 for cycle in range(20)]}
+
+    def check_against_steps(self, fast, nsteps):
+        sim = self.sim(register_value_map={self.r: 3})
+        for cycle in range(nsteps):
+            sim.step({name: values[cycle] for name, values in self.inputs.items()})
+        self.assertEqual(dict(fast.tracer.trace), dict(sim.tracer.trace))
+        self.assertEqual(fast.inspect_mem(self.mem), sim.inspect_mem(self.mem))
+        for name in ('a', 'r', 'o', 'o2'):
+            self.assertEqual(fast.inspect(name), sim.inspect(name))
+
+    def test_run_matches_steps(self):
+        fast = pyrtl.FastSimulation(register_value_map={self.r: 3})
+        fast.run(self.inputs)
+        self.check_against_steps(fast, 20)
+
+    def test_run_continues_steps(self):
+        fast = pyrtl.FastSimulation(register_value_map={self.r: 3})
+        fast.step({'a': self.inputs['a'][0], 'we': self.inputs['we'][0]})
+        fast.run({name: values[1:] for name, values in self.inputs.items()}, 8)
+        fast.step({'a': self.inputs['a'][9], 'we': self.inputs['we'][9]})
+        fast.run([{'a': a, 'we': we} for a, we in zip(self.inputs['a'][10:],
+                                                      self.inputs['we'][10:])])
+        self.check_against_steps(fast, 20)
+
+    def test_constant_inputs(self):
+        fast = pyrtl.FastSimulation()
+        fast.run({'a': 5, 'we': [1, 0, 1]})
+        self.assertEqual(fast.tracer.trace['r'], [0, 5, 10])
+        fast.run({'a': 1, 'we': 0}, 2)
+        self.assertEqual(fast.tracer.trace['r'], [0, 5, 10, 15, 16])
+        self.assertEqual(fast.inspect('r'), 16)
+
+    def test_run_input_validation(self):
+        fast = pyrtl.FastSimulation()
+        with self.assertRaises(pyrtl.PyrtlError):
+            fast.run({'a': [1, 2]})
+        with self.assertRaises(pyrtl.PyrtlError):
+            fast.run({'a': [1, 256], 'we': [0, 0]})
+        with self.assertRaises(pyrtl.PyrtlError):
+            fast.run({'a': [1, 2], 'we': [0]}, 2)
+        with self.assertRaises(pyrtl.PyrtlError):
+            fast.run({'a': 1, 'we': 0})
+
+    def test_run_stops_at_failing_assertion(self):
+        pyrtl.rtl_assert(self.a < 100, self.RTLSampleException('a too big'))
+        fast = pyrtl.FastSimulation()
+        with self.assertRaises(self.RTLSampleException):
+            fast.run({'a': [1, 2, 200, 3], 'we': 0})
+        self.assertEqual(fast.tracer.trace['a'], [1, 2, 200])
+        self.assertEqual(fast.inspect('r'), 3)
+
+    def test_run_applies_capture_policy(self):
+        tracer = pyrtl.SimulationTrace([self.a, self.r], keep_last=4, every=2)
+        fast = pyrtl.FastSimulation(register_value_map={self.r: 3}, tracer=tracer)
+        fast.run(self.inputs, 11)
+        fast.run({name: values[11:] for name, values in self.inputs.items()})
+        ref = self.sim(register_value_map={self.r: 3})
+        for cycle in range(20):
+            ref.step({name: values[cycle] for name, values in self.inputs.items()})
+        self.assertEqual(tracer.trace['r'], ref.tracer.trace['r'][12::2])
+        self.assertEqual(tracer.start_cycle, 12)
+
+
+class VCDReplayBase(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(8, 'a')
+        self.b = pyrtl.Input(1, 'b')
+        self.r = pyrtl.Register(8, 'r')
+        self.r.next <<= pyrtl.select(self.b, self.r + self.a, self.r)
+        self.o = pyrtl.Output(8, 'o')
+        self.o <<= self.r ^ self.a
+        self.inputs = {'a': [(cycle * 37 + 11) % 256 for cycle in range(25)],
+                       'b': [int(cycle % 3 == 0) for cycle in range(25)]}
+        self.ref = pyrtl.Simulation()
+        for cycle in range(25):
+            self.ref.step({name: values[cycle] for name, values in self.inputs.items()})
+
+    def test_run_matches_steps(self):
+        sim = self.sim()
+        sim.run(self.inputs, 10)
+        sim.run({'a': self.inputs['a'][10:], 'b': self.inputs['b'][10:]})
+        self.assertEqual(dict(sim.tracer.trace), dict(self.ref.tracer.trace))
+
+    def test_event_driven_run(self):
+        sim = pyrtl.Simulation(event_driven=True)
+        sim.run(self.inputs)
+        self.assertEqual(dict(sim.tracer.trace), dict(self.ref.tracer.trace))
+
+    def test_run_input_validation(self):
+        sim = self.sim()
+        with self.assertRaises(pyrtl.PyrtlError):
+            sim.run({'a': [1, 2]})
+        with self.assertRaises(pyrtl.PyrtlError):
+            sim.run({'a': [1, 2], 'b': [0, 2]})
+        with self.assertRaises(pyrtl.PyrtlError):
+            sim.run({'a': [1, 2], 'b': [0, 1], 'o': [0, 0]})
+
+    def test_replay_vcd(self):
+        vcd = six.StringIO()
+        self.ref.tracer.print_vcd(vcd, include_clock=True)
+        vcd.seek(0)
+        sim = self.sim()
+        self.assertEqual(pyrtl.replay_vcd(sim, vcd, clock='clk', chunk_size=10), 25)
+        self.assertEqual(dict(sim.tracer.trace), dict(self.ref.tracer.trace))
+
+
+class FastSimulationCacheBase(unittest.TestCase):
+    """
+    Checks that FastSimulation reuses the code generated for the same design
+    """
+
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.old_cache_dir = pyrtl.simcache.get_cache_dir()
+        self.cache_dir = tempfile.mkdtemp()
+        pyrtl.simcache.set_cache_dir(self.cache_dir)
+        pyrtl.simulation._fastsim_code.clear()
+        self.compiled = 0
+        self.old_compiled = pyrtl.FastSimulation._compiled
+
+        def counting_compiled(sim):
+            self.compiled += 1
+            return self.old_compiled(sim)
+        pyrtl.FastSimulation._compiled = counting_compiled
+
+        a = pyrtl.Input(8, 'a')
+        r = pyrtl.Register(8, 'r')
+        self.o = pyrtl.Output(8, 'o')
+        r.next <<= r + a
+        self.o <<= r ^ a
+
+    def tearDown(self):
+        pyrtl.FastSimulation._compiled = self.old_compiled
+        pyrtl.simcache.set_cache_dir(self.old_cache_dir)
+        pyrtl.simulation._fastsim_code.clear()
+        shutil.rmtree(self.cache_dir)
+
+    def cached_code(self):
+        return os.listdir(os.path.join(self.cache_dir, 'fastsim'))
+
+    def run_sim(self, sim):
+        for a in (3, 5, 250):
+            sim.step({'a': a})
+        return sim.tracer.trace['o']
+
+    def test_same_design_reuses_code(self):
+        expected = self.run_sim(pyrtl.FastSimulation())
+        self.assertEqual(self.run_sim(pyrtl.FastSimulation()), expected)
+        self.assertEqual(self.compiled, 1)
+        self.assertEqual(len(self.cached_code()), 1)
+
+    def test_code_loaded_from_disk(self):
+        expected = self.run_sim(pyrtl.FastSimulation())
+        pyrtl.simulation._fastsim_code.clear()  # as if in a new process
+        self.assertEqual(self.run_sim(pyrtl.FastSimulation()), expected)
+        self.assertEqual(self.compiled, 1)
+
+    def test_changed_design_or_trace_adds_code(self):
+        pyrtl.FastSimulation()
+        pyrtl.FastSimulation(tracer=pyrtl.SimulationTrace([self.o]))
+        self.assertEqual(self.compiled, 2)
+        o2 = pyrtl.Output(8, 'o2')
+        o2 <<= pyrtl.Const(3)
+        sim = pyrtl.FastSimulation()
+        self.assertEqual(self.compiled, 3)
+        self.assertEqual(len(self.cached_code()), 3)
+        sim.step({'a': 1})
+        self.assertEqual(sim.inspect('o2'), 3)
+
+    def test_code_file_written_when_cached(self):
+        pyrtl.FastSimulation()
+        code_file = os.path.join(self.cache_dir, 'code.py')
+        pyrtl.FastSimulation(code_file=code_file)
+        with open(code_file) as f:
+            self.assertIn('def sim_func', f.read())
+
+
+class BatchedFastSimulationBase(unittest.TestCase):
+    """
+    Checks every lane of a BatchedFastSimulation against a separate simulator
+    """
+
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.a = pyrtl.Input(8, 'a')
+        self.we = pyrtl.Input(1, 'we')
+        self.r = pyrtl.Register(8, 'r')
+        self.r.next <<= self.r + self.a
+        self.mem = pyrtl.MemBlock(8, 3, 'mem')
+        self.mem[self.a[0:3]] <<= pyrtl.MemBlock.EnabledWrite(self.r, self.we)
+        rom = pyrtl.RomBlock(4, 2, [1, 2, 3, 4])
+        o = pyrtl.Output(8, 'o')
+        o <<= self.mem[self.a[0:3]] ^ self.r
+        o2 = pyrtl.Output(4, 'o2')
+        o2 <<= rom[self.a[0:2]]
+        internal = pyrtl.WireVector(8, 'internal')
+        internal <<= self.r & self.a
+
+    def test_lanes_match_separate_sims(self):
+        lanes = 4
+        batch = pyrtl.BatchedFastSimulation(lanes, register_value_map={self.r: [1, 2, 3, 4]})
+        sims = [self.sim(register_value_map={self.r: n+1}) for n in range(lanes)]
+        for cycle in range(12):
+            ins = {'a': [(cycle * 37 + 11 * n) % 256 for n in range(lanes)],
+                   'we': [(cycle + n) % 2 for n in range(lanes)]}
+            batch.step(ins)
+            for n, sim in enumerate(sims):
+                sim.step({name: vals[n] for name, vals in ins.items()})
+        for n, sim in enumerate(sims):
+            self.assertEqual(dict(batch.tracers[n].trace), dict(sim.tracer.trace))
+            self.assertEqual(batch.inspect_mem(self.mem)[n], sim.inspect_mem(self.mem))
+            self.assertEqual(batch.inspect('o')[n], sim.inspect('o'))
+
+    def test_large_memories_share_dense_budget(self):
+        big = pyrtl.MemBlock(8, 20, 'big', asynchronous=True)
+        big[self.a.zero_extended(20)] <<= pyrtl.MemBlock.EnabledWrite(self.r, self.we)
+        o3 = pyrtl.Output(8, 'o3')
+        o3 <<= big[self.a.zero_extended(20)]
+        for lanes, dense in ((4, True), (8, False)):
+            batch = pyrtl.BatchedFastSimulation(
+                lanes, register_value_map={self.r: 5}, memory_value_map={big: {1: 9}})
+            contents = batch.inspect_mem(big)
+            self.assertEqual(len(contents), lanes)
+            for lane in contents:
+                self.assertEqual(isinstance(lane, pyrtl.simulation.DenseMemory), dense)
+            batch.step({'a': [1] * lanes, 'we': [1] + [0] * (lanes - 1)})
+            self.assertEqual(batch.inspect('o3'), [9] * lanes)
+            batch.step({'a': [1] * lanes, 'we': [0] * lanes})
+            self.assertEqual(batch.inspect('o3'), [5] + [9] * (lanes - 1))
+            self.assertEqual(batch.inspect_mem(big)[1][1], 9)
+
+    def test_lane_input_validation(self):
+        batch = pyrtl.BatchedFastSimulation(2, tracer=None)
+        with self.assertRaises(pyrtl.PyrtlError):
+            batch.step({'a': [1], 'we': [0, 0]})
+        with self.assertRaises(pyrtl.PyrtlError):
+            batch.step({'a': [1, 256], 'we': [0, 0]})
+        with self.assertRaises(pyrtl.PyrtlError):
+            batch.step({'a': [1, 2]})
+
+
+class BitSlicedSimulationBase(unittest.TestCase):
+    """
+    Checks every lane of a BitSlicedSimulation against a separate simulator
+    """
+
+    def setUp(self):
+        pyrtl.reset_working_block()
+        a, b, we = pyrtl.Input(8, 'a'), pyrtl.Input(8, 'b'), pyrtl.Input(1, 'we')
+        r = pyrtl.Register(8, 'r')
+        r.next <<= pyrtl.select(a < b, r + a, r - b)
+        self.mem = pyrtl.MemBlock(8, 3, 'mem')
+        self.mem[a[0:3]] <<= pyrtl.MemBlock.EnabledWrite(r, we)
+        o, o2, o3 = pyrtl.Output(8, 'o'), pyrtl.Output(16, 'o2'), pyrtl.Output(1, 'o3')
+        o <<= self.mem[b[0:3]] ^ r
+        o2 <<= a * b
+        o3 <<= a == b
+
+    def test_lanes_match_separate_sims(self):
+        lanes = 70
+        presynth = pyrtl.working_block()
+        sims = [self.sim(tracer=None, block=presynth) for n in range(lanes)]
+        pyrtl.synthesize()
+        pyrtl.optimize()
+        bitsliced = pyrtl.BitSlicedSimulation(lanes)
+        for cycle in range(10):
+            ins = {'a': [(cycle * 37 + 11 * n) % 256 for n in range(lanes)],
+                   'b': [(cycle * 91 + 7 * n) % 256 for n in range(lanes)],
+                   'we': [(cycle + n) % 2 for n in range(lanes)]}
+            bitsliced.step(ins)
+            for n, sim in enumerate(sims):
+                sim.step({name: vals[n] for name, vals in ins.items()})
+            for name in ('o', 'o2', 'o3'):
+                self.assertEqual(bitsliced.inspect(name), [sim.inspect(name) for sim in sims])
+        self.assertEqual(bitsliced.inspect_mem(self.mem),
+                         [sim.inspect_mem(self.mem) for sim in sims])
+
+    def test_unsynthesized_block_error(self):
+        with self.assertRaises(pyrtl.PyrtlError):
+            pyrtl.BitSlicedSimulation()
+
+
 def make_unittests():
     """
     Generates separate unittests for each of the simulators
@@ -0,0 +1,126 @@
+import unittest
+import six
+import os
+import shutil
+import struct
+import tempfile
+
+import pyrtl
+
+
+class TestTraceFile(unittest.TestCase):
+    def setUp(self):
+        pyrtl.reset_working_block()
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'sim.trace')
+        a = pyrtl.Input(8, 'a')
+        r = pyrtl.Register(8, 'r')
+        r.next <<= r + a
+        flag = pyrtl.Output(1, 'flag')
+        flag <<= r > 100
+        wide = pyrtl.Output(100, 'wide')
+        wide <<= pyrtl.concat(r, pyrtl.Const(0, 92)) | a
+        self.sim = pyrtl.Simulation()
+        for cycle in range(50):
+            self.sim.step({'a': 3 if cycle % 10 else 40})
+        self.trace = self.sim.tracer
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self, **options):
+        pyrtl.write_trace(self.trace, self.path, **options)
+        mapped = pyrtl.read_trace(self.path)
+        self.addCleanup(mapped.close)
+        return mapped
+
+    def check_same_trace(self, mapped):
+        self.assertEqual(len(mapped), 50)
+        self.assertEqual(set(mapped.trace), set(self.trace.trace))
+        for name, values in self.trace.trace.items():
+            self.assertEqual(list(mapped.trace[name]), values)
+            self.assertEqual(mapped.trace[name][-1], values[-1])
+            self.assertEqual(mapped.trace[name][7], values[7])
+            self.assertEqual(mapped.trace[name][5:45:3], values[5:45:3])
+            self.assertEqual(mapped.trace[name][10:20], values[10:20])
+        for method in ('print_trace', 'print_vcd'):
+            expected, output = six.StringIO(), six.StringIO()
+            getattr(self.trace, method)(expected)
+            getattr(mapped, method)(output)
+            self.assertEqual(output.getvalue(), expected.getvalue())
+        expected, output = six.StringIO(), six.StringIO()
+        self.trace.render_trace(file=expected, render_cls=pyrtl.simulation.AsciiWaveRenderer)
+        mapped.render_trace(file=output, render_cls=pyrtl.simulation.AsciiWaveRenderer)
+        self.assertEqual(output.getvalue(), expected.getvalue())
+        self.assertEqual(pyrtl.trace_to_html(mapped), pyrtl.trace_to_html(self.trace))
+
+    def test_round_trip(self):
+        self.check_same_trace(self.read())
+
+    def test_change_only_round_trip(self):
+        self.check_same_trace(self.read(change_only=True))
+
+    def test_change_only_is_smaller(self):
+        flag = pyrtl.SimulationTrace([self.trace._wires['flag']])
+        for value in self.trace.trace['flag']:
+            flag.add_step_named({'flag': value})
+        self.trace = flag
+        pyrtl.write_trace(self.trace, self.path)
+        size = os.path.getsize(self.path)
+        pyrtl.write_trace(self.trace, self.path, change_only=True)
+        self.assertLess(os.path.getsize(self.path), size)
+
+    def test_file_objects(self):
+        with open(self.path, 'wb') as f:
+            pyrtl.write_trace(self.trace, f)
+        with open(self.path, 'rb') as f:
+            mapped = pyrtl.read_trace(f)
+        self.assertEqual(list(mapped.trace['r']), self.trace.trace['r'])
+        mapped.close()
+
+    def test_rewrite_mapped_trace(self):
+        mapped = self.read(change_only=True)
+        other = os.path.join(self.dir, 'other.trace')
+        pyrtl.write_trace(mapped, other)
+        remapped = pyrtl.read_trace(other)
+        self.assertEqual(list(remapped.trace['wide']), self.trace.trace['wide'])
+        remapped.close()
+
+    def test_capture_position_kept(self):
+        pyrtl.reset_working_block()
+        r = pyrtl.Register(4, 'r')
+        r.next <<= r + 1
+        sim = pyrtl.Simulation(tracer=pyrtl.SimulationTrace([r], keep_last=3, every=2))
+        for _ in range(20):
+            sim.step({})
+        self.trace = sim.tracer
+        mapped = self.read()
+        self.assertEqual(list(mapped.trace['r']), [14, 0, 2])
+        self.assertEqual((mapped.start_cycle, mapped.every), (14, 2))
+
+    def test_read_only(self):
+        mapped = self.read()
+        with self.assertRaises(pyrtl.PyrtlError):
+            mapped.add_step({})
+        with self.assertRaises(IndexError):
+            mapped.trace['r'][50]
+
+    def test_packed_items(self):
+        # what python 2 reads the mapped file through
+        data = struct.pack('<5H', 1, 2, 3, 400, 5)
+        items = pyrtl.tracefile._PackedItems(data, 2, 'H', 4)
+        self.assertEqual((len(items), items[2], items[-1]), (4, 400, 5))
+        self.assertEqual(items[1:3].tolist(), [3, 400])
+        self.assertEqual(items.tolist(), [2, 3, 400, 5])
+        with self.assertRaises(IndexError):
+            items[4]
+
+    def test_not_a_trace_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'$timescale 1ns $end\n')
+        with self.assertRaises(pyrtl.PyrtlError):
+            pyrtl.read_trace(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()